@@ -3,6 +3,11 @@ import logging
 from datetime import datetime, timedelta
 from app.db.database import SessionLocal
 from app.services.performance_services import PerformanceService
+from app.services.vector_maintenance_services import VectorMaintenanceService
+from app.core.vector_maintenance import list_indexed_organizations, vector_gc
+from app.core.reindex import reindex_manager
+from app.db.repository.organization import get_embedding_configs
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +16,8 @@ class BackgroundMonitor:
         self.is_running = False
         self.alert_check_interval = 300  # 5 minutes
         self.cleanup_interval = 86400    # 24 hours
+        self.vector_compaction_interval = settings.VECTOR_COMPACTION_INTERVAL
+        self.vector_tier_interval = settings.VECTOR_TIER_INTERVAL
     
     async def start(self):
         # Start background monitoring tasks
@@ -21,14 +28,30 @@ class BackgroundMonitor:
         logger.info("Starting background monitoring tasks")
         
         # Start alert checking task
-        asyncio.create_task(self._alert_check_loop())
+        if settings.PERFORMANCE_ALERTS_ENABLED:
+            asyncio.create_task(self._alert_check_loop())
         
-        # Start cleanup task
-        asyncio.create_task(self._cleanup_loop())
+        # Start cleanup task, it deletes metrics history so it is opt-in
+        if settings.METRICS_CLEANUP_ENABLED:
+            asyncio.create_task(self._cleanup_loop())
+
+        # Start vector cleanup worker and index compaction task
+        vector_gc.start()
+        asyncio.create_task(self._vector_compaction_loop())
+
+        # Start promoting/demoting vectors between the RAM and disk tiers
+        if settings.VECTOR_TIERING_ENABLED:
+            asyncio.create_task(self._vector_tiering_loop())
+
+        # Re-embed indexes built with another embedding provider or model
+        if settings.REINDEX_ON_STARTUP:
+            asyncio.create_task(self._start_stale_reindexes())
     
     async def stop(self):
         """Stop background monitoring"""
         self.is_running = False
+        await vector_gc.stop()
+        await reindex_manager.stop()
         logger.info("Stopping background monitoring tasks")
     
     async def _alert_check_loop(self):
@@ -54,6 +77,41 @@ class BackgroundMonitor:
             
             await asyncio.sleep(self.cleanup_interval)
     
+    async def _start_stale_reindexes(self):
+        """Start re-index jobs for organizations whose index doesn't match their embedding config"""
+        try:
+            async with SessionLocal() as db:
+                configs = await get_embedding_configs(db)
+            for organization_id in reindex_manager.stale_organizations(list_indexed_organizations(), configs):
+                reindex_manager.start(organization_id, configs.get(organization_id))
+        except Exception as e:
+            logger.error(f"Error starting re-index jobs: {e}")
+
+    async def _vector_compaction_loop(self):
+        """Reclaim space left in vector indexes by deleted knowledge"""
+        while self.is_running:
+            # Compaction is heavy, don't run it while the app is still starting
+            await asyncio.sleep(self.vector_compaction_interval)
+            try:
+                async with SessionLocal() as db:
+                    await VectorMaintenanceService.compact_indexes(db)
+                # Indexes that grew past VECTOR_SHARD_MAX_SIZE per shard get split further
+                await VectorMaintenanceService.rebalance_shards()
+                logger.info("Vector index compaction completed")
+            except Exception as e:
+                logger.error(f"Error in vector compaction loop: {e}")
+    
+    async def _vector_tiering_loop(self):
+        """Keep the most retrieved chunks of each index in RAM, HNSW serves the rest"""
+        while self.is_running:
+            # Hit counts need some traffic before the first pass means anything
+            await asyncio.sleep(self.vector_tier_interval)
+            try:
+                results = await VectorMaintenanceService.refresh_vector_tiers()
+                logger.debug(f"Vector tiers refreshed for {len(results)} organizations")
+            except Exception as e:
+                logger.error(f"Error in vector tiering loop: {e}")
+    
     async def _cleanup_old_metrics(self):
         """Remove metrics older than 30 days"""
         cutoff_date = datetime.now() - timedelta(days=30)
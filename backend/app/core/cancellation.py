@@ -0,0 +1,84 @@
+import json
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Deque, Optional, TypeVar
+from fastapi import WebSocket, WebSocketDisconnect, status
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+#SH: Client frame that stops the reply being generated
+CANCEL_FRAME = "cancel"
+
+#SH: Messages sent while a reply is being generated would otherwise have to wait in no queue at all
+MAX_QUEUED_FRAMES = 20
+
+#SH: The socket as the receive loop sees it: frames that arrived while a reply was generating come first, in order
+class SocketInbox:
+    def __init__(self, websocket: WebSocket, max_queued: int = MAX_QUEUED_FRAMES):
+        self.websocket = websocket
+        self.max_queued = max_queued
+        self.frames: Deque[dict] = deque()
+
+    async def receive(self) -> dict:
+        if self.frames:
+            return self.frames.popleft()
+        return await self.websocket.receive()
+
+    #SH: Same contract as WebSocket.receive_json: raises WebSocketDisconnect once the client is gone
+    async def receive_json(self) -> Any:
+        frame = await self.receive()
+        if frame["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(frame.get("code", status.WS_1000_NORMAL_CLOSURE))
+        return json.loads(frame.get("text") or frame.get("bytes").decode())
+
+#SH: Awaits one reply while still reading the socket, so a {"type": "cancel"} frame or a disconnect cancels the
+#SH: generation instead of letting it run (and bill) for nobody. Any other message is queued in the inbox and
+#SH: answered once this reply is done. Returns None when cancelled, raises WebSocketDisconnect.
+async def run_cancellable(inbox: SocketInbox, work: Awaitable[T]) -> Optional[T]:
+    task = asyncio.ensure_future(work)
+    receive = None
+    try:
+        while True:
+            receive = asyncio.ensure_future(inbox.websocket.receive())
+            done, _ = await asyncio.wait({task, receive}, return_when=asyncio.FIRST_COMPLETED)
+            if receive not in done:
+                return task.result()
+
+            frame = receive.result()
+            if frame["type"] == "websocket.disconnect":
+                await _cancel(task)
+                raise WebSocketDisconnect(frame.get("code", status.WS_1000_NORMAL_CLOSURE))
+            try:
+                data = json.loads(frame.get("text") or "")
+            except json.JSONDecodeError:
+                data = None
+            if isinstance(data, dict) and data.get("type") == CANCEL_FRAME:
+                if task.done():
+                    # Too late, the reply is already complete
+                    return task.result()
+                await _cancel(task)
+                return None
+            if len(inbox.frames) < inbox.max_queued:
+                inbox.frames.append(frame)
+            else:
+                await inbox.websocket.send_json({
+                    "type": "error",
+                    "content": "Too many messages waiting for a reply, this one was dropped"
+                })
+            if task.done():
+                return task.result()
+    finally:
+        if receive is not None and not receive.done():
+            receive.cancel()
+        if not task.done():
+            await _cancel(task)
+
+#SH: Cancel and wait for the task to unwind, so partial usage is recorded before the socket moves on
+async def _cancel(task: asyncio.Future):
+    task.cancel()
+    await asyncio.wait({task})
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Cancelled reply failed while stopping: {task.exception()}")
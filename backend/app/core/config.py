@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 class Settings(BaseSettings):
     #MJ: Added these in .env
@@ -20,10 +20,92 @@ class Settings(BaseSettings):
     FALLBACK_MODEL: str = "gpt-3.5-turbo"
     MAX_RETRIES: int = 3
     REQUEST_TIMEOUT: int = 30
+    LLM_STREAMING_ENABLED: bool = True  # forward answers as delta frames, clients can opt out per message with "stream": false
+    LLM_HTTP2: bool = True  # used when the h2 package is installed
+    LLM_POOL_MAX_CONNECTIONS: int = 100  # per worker
+    LLM_POOL_MAX_KEEPALIVE: int = 20  # idle connections kept open between requests
+    LLM_POOL_KEEPALIVE_EXPIRY: float = 60.0  # seconds an idle connection stays open
+    LLM_POOL_TIMEOUT: float = 10.0  # seconds a request may wait for a free connection
+    OPENAI_MODELS: List[str] = ["gpt-4", "gpt-3.5-turbo"]  # models agents may select that OpenAI serves
+    #SH: Other OpenAI-compatible endpoints, e.g. our own inference server: name -> {"base_url", "api_key", "models",
+    #SH: and optionally "max_connections", "max_keepalive", "keepalive_expiry", "timeout", "pool_timeout", "http2"}.
+    #SH: Add their models to MODEL_PRICING too, unlisted models are priced as the most expensive one.
+    LLM_PROVIDERS: Dict[str, Dict[str, Any]] = {}
+    #SH: Load testing: base URL of the mock server (python -m benchmarks.mock_llm), e.g. http://127.0.0.1:8100/v1.
+    #SH: Every provider's completions and the OpenAI embeddings behind the vector store go there; use a throwaway CHROMA_DIR.
+    LLM_MOCK_URL: Optional[str] = None
     MAX_TOKENS_LIMIT: int = 4000
+    #SH: USD per 1K tokens; cached_input applies to prompt tokens the provider served from its prompt cache.
+    #SH: Dated snapshots use their family's price, unknown models the most expensive listed one.
+    MODEL_PRICING: Dict[str, Dict[str, float]] = {
+        "gpt-4": {"input": 0.03, "cached_input": 0.03, "output": 0.06},
+        "gpt-4-turbo": {"input": 0.01, "cached_input": 0.01, "output": 0.03},
+        "gpt-4o": {"input": 0.0025, "cached_input": 0.00125, "output": 0.01},
+        "gpt-4o-mini": {"input": 0.00015, "cached_input": 0.000075, "output": 0.0006},
+        "gpt-3.5-turbo": {"input": 0.0015, "cached_input": 0.0015, "output": 0.002},
+    }
     FALLBACK_CHUNKS: int = 3
     MAX_TOKENS: int = 1500
     RAG_K: int = 3
+    RAG_CANDIDATE_K: int = 8  # chunks fetched before adaptive selection
+    RAG_SCORE_CUTOFF: float = 0.3  # minimum relevance score (0-1) for a chunk to enter the context
+    RAG_MIN_PASSAGE_TOKENS: int = 50  # don't squeeze a truncated passage into less than this
+    PROMPT_SAFETY_MARGIN: int = 100  # tokens left free for message formatting overhead
+
+    #SH: For reusing retrieved context across the turns of one conversation
+    RAG_REUSE_ENABLED: bool = True
+    RAG_REUSE_SIMILARITY: float = 0.9  # cosine similarity to a recent turn to reuse its chunks without searching
+    RAG_AUGMENT_SIMILARITY: float = 0.75  # above this, a smaller search is merged with the recent turns' chunks
+    RAG_REUSE_TURNS: int = 3  # turns remembered per conversation
+    RAG_REUSE_MAX_CONVERSATIONS: int = 5000
+    RAG_REUSE_TTL: int = 1800  # seconds
+
+    #SH: For conversation history in prompts: recent messages verbatim, older ones as a rolling summary
+    CONVERSATION_MEMORY_ENABLED: bool = True
+    CONVERSATION_RECENT_MESSAGES: int = 6  # user and agent messages included verbatim
+    CONVERSATION_HISTORY_TOKENS: int = 800  # summary plus recent messages, the oldest recent messages are dropped first
+    CONVERSATION_SUMMARY_TOKENS: int = 300  # most the summary may grow to
+    CONVERSATION_SUMMARY_MIN_MESSAGES: int = 4  # messages out of the recent window before the summary is refreshed
+    CONVERSATION_SUMMARY_MODEL: Optional[str] = None  # None uses FALLBACK_MODEL
+
+    #SH: For query-relevance compression of retrieved context
+    CONTEXT_COMPRESSION_ENABLED: bool = False  # default for agents without their own context_compression setting
+    CONTEXT_COMPRESSION_TOKENS: int = 600  # sentence budget, agents can lower it with context_compression_tokens
+    CONTEXT_COMPRESSION_CACHE_SIZE: int = 20000  # sentence embeddings (organization embedding model) kept in process
+
+    #SH: For cross-encoder reranking of a wider candidate set
+    RERANK_ENABLED: bool = False  # default for agents without their own rerank setting
+    RERANK_MODEL: Optional[str] = "ms-marco-MiniLM-L-6-v2"
+    RERANK_MODEL_DIR: str = "models/rerankers"  # <dir>/<model>/model.onnx and tokenizer.json
+    RERANK_CANDIDATE_K: int = 20  # chunks retrieved for the reranker to choose from
+    RERANK_TOP_N: int = 3  # chunks passed on to the prompt, agents can override it with rerank_top_n
+    RERANK_SCORE_CUTOFF: float = 0.0  # minimum reranker relevance (0-1), 0 keeps the top n
+    RERANK_BATCH_SIZE: int = 16  # query-passage pairs per inference call
+    RERANK_THREADS: int = 2  # inference calls running in parallel
+    RERANK_MAX_LENGTH: int = 512  # tokens per query-passage pair
+
+    #SH: For admission control of LLM calls, per worker
+    LLM_GLOBAL_RPM: int = 3000
+    LLM_GLOBAL_TPM: int = 1000000  # prompt + completion tokens, estimated before the call and settled after
+    LLM_GLOBAL_CONCURRENCY: int = 64  # calls in flight
+    LLM_ORG_RPM: int = 600
+    LLM_ORG_TPM: int = 200000
+    LLM_ORG_CONCURRENCY: int = 16
+    LLM_ORG_WEIGHTS: Dict[int, float] = {}  # organization id -> fair share weight, 1 when not listed
+    LLM_QUEUE_TIMEOUT: float = 30.0  # seconds a call may wait for admission before failing
+    LLM_RETRY_BASE_DELAY: float = 0.5  # seconds, doubled per attempt with full jitter
+    LLM_RETRY_MAX_DELAY: float = 8.0
+    LLM_RETRY_BUDGET_RATIO: float = 0.1  # retries allowed per first attempt
+    LLM_RETRY_BUDGET_MIN_PER_MINUTE: int = 10  # retries always allowed at low traffic
+
+    #SH: For routing between an agent's model and FALLBACK_MODEL
+    ROUTER_WINDOW: int = 100  # latest calls per model the error rate and p95 are taken over
+    ROUTER_MIN_SAMPLES: int = 20  # calls before the circuit can open or a hedge deadline exists
+    ROUTER_ERROR_THRESHOLD: float = 0.5  # error rate that opens a model's circuit
+    ROUTER_OPEN_SECONDS: float = 30.0  # open circuits send one probe to the model after this
+    ROUTER_HEDGE_ENABLED: bool = False  # default for agents without their own hedge setting, a hedge pays for two calls
+    ROUTER_HEDGE_MULTIPLIER: float = 1.0  # hedge deadline is the primary's p95 latency times this
+    ROUTER_HEDGE_MIN_MS: float = 1000.0
 
     #SH: for Knowledge base
     MAX_FILE_SIZE: int = 10_485_760 # 10MB
@@ -40,7 +122,65 @@ class Settings(BaseSettings):
     EMBEDDING_MODEL: str = "text-embedding-3-small"
     KNOWLEDGE_DIR: str = "data"
     CHROMA_DIR: str = "chroma"
-  
+    SNIPPET_LENGTH: int = 200  # characters
+    SNIPPET_CANDIDATES_PER_RESULT: int = 3  # chunks fetched per result in the batched snippet search
+    SNIPPET_CACHE_SIZE: int = 2000
+    SNIPPET_CACHE_TTL: int = 600  # seconds
+
+    #SH: For query embedding cache
+    EMBEDDING_CACHE_SIZE: int = 5000  # entries kept in process
+    EMBEDDING_CACHE_TTL: int = 86400  # seconds
+    EMBEDDING_CACHE_SHARED: bool = False  # share entries across workers via a local sqlite file
+    EMBEDDING_CACHE_PATH: str = "cache/embeddings.sqlite3"
+    EMBEDDING_BATCH_MAX_SIZE: int = 64  # query texts per coalesced embedding request
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = 10  # how long a query waits for company while a batch is in flight
+
+    #SH: For embedding providers, organizations can override these in their embedding_config
+    EMBEDDING_PROVIDER: str = "openai"  # "openai" or "local"
+    EMBEDDING_DIMENSIONS: Optional[int] = None  # reduced output size, None keeps the model's native size
+    EMBEDDING_VECTOR_DTYPE: str = "float32"  # "float32" or "float16" for vectors kept in process
+    PROFILE_REPORT_DIMENSIONS: List[int] = [1536, 1024, 768, 512, 256]  # candidates in the index profile report
+    LOCAL_EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
+    LOCAL_EMBEDDING_MODEL_DIR: str = "models/embeddings"  # <dir>/<model>/model.onnx and tokenizer.json
+    LOCAL_EMBEDDING_QUANTIZED: bool = True  # prefer model_quantized.onnx when present
+    LOCAL_EMBEDDING_BATCH_SIZE: int = 32  # texts per inference call
+    LOCAL_EMBEDDING_THREADS: int = 4  # inference calls running in parallel
+    LOCAL_EMBEDDING_MAX_LENGTH: int = 256  # tokens, longer texts are truncated
+
+    #SH: For performance monitoring jobs, each worker runs the ones enabled here
+    PERFORMANCE_ALERTS_ENABLED: bool = False  # check alert rules every 5 minutes
+    METRICS_CLEANUP_ENABLED: bool = False  # delete API and system metrics older than 30 days, once a day
+
+    #SH: For vector index maintenance
+    VECTOR_GC_BATCH_SIZE: int = 500  # ids per delete call
+    VECTOR_COMPACTION_INTERVAL: int = 86400  # 24 hours
+    VECTOR_COMPACTION_DEAD_RATIO: float = 0.2  # rebuild an index once this share of it was deleted
+    VECTOR_MAINTENANCE_STALE_AFTER: int = 600  # a compaction lock untouched for this long belongs to a dead worker
+
+    #SH: For sharded organization indexes, searched in parallel once they outgrow one shard
+    VECTOR_SHARD_MAX_SIZE: int = 250_000  # chunks per shard before the index is split further
+    VECTOR_MAX_SHARDS: int = 16
+    VECTOR_SHARD_BY: str = "hash"  # "hash" spreads chunks evenly, "knowledge_base" keeps a knowledge base in one shard
+    VECTOR_SEARCH_WORKERS: int = 0  # threads searching shards, 0 means one per CPU core
+
+    #SH: For tiered vector storage, most retrieved chunks searched exactly in RAM and the rest by the HNSW index
+    VECTOR_TIERING_ENABLED: bool = False  # keep the most retrieved chunks in RAM, merged with HNSW results
+    VECTOR_TIER_INTERVAL: int = 300  # seconds between promote/demote passes
+    VECTOR_TIER_SMALL_INDEX_SIZE: int = 5_000  # indexes up to this many chunks are kept entirely in RAM
+    VECTOR_TIER_HOT_SIZE: int = 20_000  # most retrieved chunks kept in RAM per organization
+    VECTOR_TIER_MAX_RAM_MB: int = 2048  # hot vectors of all workers on a node together, 0 means no cap
+    VECTOR_TIER_MAX_INDEX_SIZE: int = 500_000  # larger indexes are only served by the (sharded) HNSW index
+    VECTOR_TIER_DECAY: float = 0.5  # hit counts are multiplied by this on every pass
+    ADMIN_USER_IDS: List[str] = []  # Clerk user ids allowed on /admin routes
+
+    #SH: For re-embedding indexes when EMBEDDING_MODEL changes
+    EMBEDDING_LEGACY_MODEL: str = "text-embedding-ada-002"  # model of indexes created before index manifests
+    REINDEX_ON_STARTUP: bool = True  # re-embed indexes built with another model in the background
+    REINDEX_BATCH_SIZE: int = 100  # chunks per embedding request
+    REINDEX_TOKENS_PER_MINUTE: int = 500_000  # keep re-indexing under the embedding rate limit
+    REINDEX_RETIRE_DELAY: int = 300  # seconds the old index is kept after a swap
+    REINDEX_STALE_AFTER: int = 600  # a build without progress for this long is considered dead
+
     #Sh: For Websockets
     WEBSOCKET_TIMEOUT: int = 300  # 5 minutes
     MAX_CONNECTIONS: int = 1000
@@ -68,7 +208,15 @@ class Settings(BaseSettings):
     WIDGET_DEFAULT_MODEL: str = "gpt-3.5-turbo"
     WIDGET_MAX_CONTEXT_TOKENS: int = 2000
     WIDGET_ANONYMOUS_PREFIX: str = "visitor-"
-    
+
+    #SH: For semantic response cache of public agents
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_SIMILARITY_THRESHOLD: float = 0.95  # cosine similarity
+    RESPONSE_CACHE_TTL: int = 3600  # seconds
+    RESPONSE_CACHE_MAX_ENTRIES: int = 500  # per agent
+    SINGLE_FLIGHT_ENABLED: bool = True  # public widget: identical in-flight questions share one completion, agents can opt out with single_flight
+    SINGLE_FLIGHT_MAX_TEMPERATURE: float = 0.2  # near-deterministic agents only, hotter sampling means answers should differ
+
     #SH: For Url_scraping
     SCRAPER_USER_AGENT: str = "AI Knowledge Scraper/1.0"
     MAX_CRAWL_DEPTH: int = 3
@@ -0,0 +1,158 @@
+import re
+import time
+import zlib
+import logging
+from typing import Any, Dict, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from app.core.config import settings
+from app.core.context_packer import Passage, split_sentences
+from app.core.embedding_cache import TTLCache
+from app.core.tokenizer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+_HASH_BUCKETS = 1 << 12
+SPAN_GAP = " … "
+
+#SH: Sublinear tf-idf over hashed words of the texts themselves, the scorer when no query embedding is available
+def hashed_tfidf(texts: List[str]) -> np.ndarray:
+    rows, cols = [], []
+    for row, text in enumerate(texts):
+        for word in _WORD.findall(text.casefold()):
+            rows.append(row)
+            cols.append(zlib.crc32(word.encode()) % _HASH_BUCKETS)
+    counts = np.zeros((len(texts), _HASH_BUCKETS), dtype=np.float32)
+    np.add.at(counts, (rows, cols), 1.0)
+    document_frequency = np.count_nonzero(counts, axis=0)
+    idf = np.log((len(texts) + 1) / (document_frequency + 1)) + 1
+    return np.log1p(counts) * idf
+
+def _cosine(matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1) * max(float(np.linalg.norm(query)), 1e-12)
+    return (matrix @ query) / np.clip(norms, 1e-12, None)
+
+#SH: Keeps the sentences of retrieved passages that answer the query best. Sentences are scored in the vector space
+#SH: retrieval searched, against the query embedding it already has, so the query is never embedded twice.
+class ContextCompressor:
+    def __init__(self, cache_size: int, cache_ttl: float):
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.runs = 0
+        self.embedding_runs = 0
+        self.lexical_runs = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.total_ms = 0.0
+
+    def _embed(self, embeddings: Embeddings, texts: List[str]) -> np.ndarray:
+        # Popular chunks come back turn after turn, their sentences are embedded once per vector space
+        space = getattr(embeddings, "model", type(embeddings).__name__)
+        vectors: List[Optional[np.ndarray]] = [self.cache.get((space, text)) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            for i, vector in zip(missing, embeddings.embed_documents([texts[i] for i in missing])):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+                self.cache.set((space, texts[i]), vectors[i])
+        return np.vstack(vectors)
+
+    #SH: Relevance of every sentence to the query, one matrix product for the whole candidate set.
+    #SH: Falls back to hashed tf-idf when retrieval left no embedding or the embedding call fails.
+    def score(
+        self,
+        query: str,
+        sentences: List[str],
+        query_embedding: Optional[List[float]] = None,
+        embeddings: Optional[Embeddings] = None
+    ) -> np.ndarray:
+        if query_embedding is not None and embeddings is not None:
+            try:
+                matrix = self._embed(embeddings, sentences)
+                query_vector = np.asarray(query_embedding, dtype=np.float32)
+                if matrix.shape[1] == len(query_vector):
+                    self.embedding_runs += 1
+                    return _cosine(matrix, query_vector)
+                logger.warning("Query embedding and sentence embeddings differ in size, scoring sentences lexically")
+            except Exception as e:
+                logger.warning(f"Sentence embedding failed, scoring sentences lexically: {e}")
+        self.lexical_runs += 1
+        vectors = hashed_tfidf([query] + sentences)
+        return _cosine(vectors[1:], vectors[0])
+
+    #SH: Cut passages down to their best sentences within budget_tokens, kept sentences stay in reading order
+    def compress(
+        self,
+        passages: List[Passage],
+        budget_tokens: int,
+        query: str,
+        model: str,
+        query_embedding: Optional[List[float]] = None,
+        embeddings: Optional[Embeddings] = None
+    ) -> List[Passage]:
+        started = time.perf_counter()
+        sentences = [
+            (p, sentence)
+            for p, passage in enumerate(passages)
+            for sentence in split_sentences(passage.text)
+        ]
+        if len(sentences) <= 1:
+            return passages
+
+        texts = [sentence for _, sentence in sentences]
+        tokens = [count_tokens(text, model) for text in texts]
+        scores = self.score(query, texts, query_embedding, embeddings)
+
+        keep = set()
+        used = 0
+        for i in np.argsort(-scores, kind="stable"):
+            if used + tokens[i] > budget_tokens:
+                continue
+            keep.add(int(i))
+            used += tokens[i]
+        # A single sentence over budget still beats an empty context, pack_context truncates it
+        if not keep:
+            best = int(np.argmax(scores))
+            keep.add(best)
+            used = tokens[best]
+
+        # Runs of consecutive kept sentences, gaps between runs are marked so the model doesn't read them as one
+        spans: Dict[int, List[List[str]]] = {}
+        previous: Dict[int, int] = {}
+        for i, (p, text) in enumerate(sentences):
+            if i not in keep:
+                continue
+            runs = spans.setdefault(p, [])
+            if not runs or previous[p] != i - 1:
+                runs.append([])
+            runs[-1].append(text)
+            previous[p] = i
+
+        compressed = []
+        for p, passage in enumerate(passages):
+            if p in spans:
+                passage.text = SPAN_GAP.join(" ".join(run) for run in spans[p])
+                compressed.append(passage)
+
+        self.runs += 1
+        self.tokens_in += sum(tokens)
+        self.tokens_out += used
+        self.total_ms += (time.perf_counter() - started) * 1000
+        return compressed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "embedding_scored": self.embedding_runs,
+            "lexically_scored": self.lexical_runs,
+            "sentence_tokens_in": self.tokens_in,
+            "sentence_tokens_out": self.tokens_out,
+            "token_reduction_percent": round((1 - self.tokens_out / self.tokens_in) * 100, 2) if self.tokens_in else 0.0,
+            "avg_compression_ms": round(self.total_ms / self.runs, 2) if self.runs else 0.0,
+            "sentence_cache": self.cache.stats(),
+        }
+
+# Global instance
+context_compressor = ContextCompressor(
+    cache_size=settings.CONTEXT_COMPRESSION_CACHE_SIZE,
+    cache_ttl=settings.EMBEDDING_CACHE_TTL
+)
@@ -0,0 +1,178 @@
+import re
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from app.core.tokenizer import count_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+
+@dataclass
+class Passage:
+    text: str
+    score: float
+    source_key: Any
+    first_index: Optional[int]
+    last_index: Optional[int]
+    documents: List[Document] = field(default_factory=list)
+
+@dataclass
+class PackedContext:
+    text: str
+    documents: List[Document]
+    tokens: int
+    raw_tokens: int  # tokens the selected chunks would have cost joined as-is
+    candidates: int
+    uncompressed_tokens: int = 0  # tokens before query-relevance compression, same as tokens when it is off
+    compressed: bool = False
+    reranked: bool = False
+    rerank_ms: float = 0.0
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in _SENTENCE_SPLIT.split(text) if sentence.strip()]
+
+#SH: Length of the longest suffix of `left` that is also a prefix of `right`
+def _overlap_length(left: str, right: str, min_overlap: int = 20, max_overlap: int = 300) -> int:
+    max_len = min(len(left), len(right), max_overlap)
+    for size in range(max_len, min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+def _source_key(doc: Document):
+    metadata = doc.metadata or {}
+    return metadata.get("knowledge_id", metadata.get("source"))
+
+#SH: Keep the best chunks, dropping the tail once scores fall under the cutoff
+def select_adaptive(
+    scored_docs: List[Tuple[Document, float]],
+    score_cutoff: float,
+    max_k: int
+) -> List[Tuple[Document, float]]:
+    ranked = sorted(scored_docs, key=lambda item: item[1], reverse=True)
+    selected = [item for item in ranked if item[1] >= score_cutoff][:max_k]
+    # A weak match is still better than answering with no context at all
+    if not selected and ranked:
+        selected = ranked[:1]
+    return selected
+
+#SH: Merge chunks of the same document that are adjacent or share the splitter overlap
+def merge_passages(scored_docs: List[Tuple[Document, float]]) -> List[Passage]:
+    groups: Dict[Any, List[Tuple[Document, float]]] = {}
+    standalone: List[Passage] = []
+    for doc, score in scored_docs:
+        key = _source_key(doc)
+        if key is None:
+            standalone.append(Passage(doc.page_content, score, None, None, None, [doc]))
+        else:
+            groups.setdefault(key, []).append((doc, score))
+
+    passages: List[Passage] = []
+    for key, items in groups.items():
+        items.sort(key=lambda item: (item[0].metadata or {}).get("chunk_index", 0))
+        current: Optional[Passage] = None
+        for doc, score in items:
+            index = (doc.metadata or {}).get("chunk_index")
+            if current is not None:
+                overlap = _overlap_length(current.text, doc.page_content)
+                adjacent = index is not None and current.last_index is not None and index - current.last_index <= 1
+                if overlap or adjacent:
+                    current.text += (doc.page_content[overlap:] if overlap else "\n" + doc.page_content)
+                    current.score = max(current.score, score)
+                    current.last_index = index if index is not None else current.last_index
+                    current.documents.append(doc)
+                    continue
+                passages.append(current)
+            current = Passage(doc.page_content, score, key, index, index, [doc])
+        if current is not None:
+            passages.append(current)
+
+    passages.extend(standalone)
+    passages.sort(key=lambda passage: passage.score, reverse=True)
+    return passages
+
+#SH: Sentence spans of a text as (start, end, next_start), next_start includes the separator that follows
+def _sentence_spans(text: str) -> List[Tuple[int, int, int]]:
+    spans = []
+    start = 0
+    for match in _SENTENCE_SPLIT.finditer(text):
+        spans.append((start, match.start(), match.end()))
+        start = match.end()
+    spans.append((start, len(text), len(text)))
+    return spans
+
+#SH: Drop sentences that were already emitted by a higher ranked passage, keeping the text's own separators
+def remove_duplicate_spans(passages: List[Passage]) -> List[Passage]:
+    seen = set()
+    result = []
+    for passage in passages:
+        text = passage.text
+        own = set()
+        parts = []
+        for start, end, next_start in _sentence_spans(text):
+            normalized = " ".join(text[start:end].split()).casefold()
+            if normalized and normalized in seen:
+                continue
+            if normalized:
+                own.add(normalized)
+            parts.append(text[start:next_start])
+        # A passage may repeat itself (lists, table rows), only text of earlier passages is dropped
+        seen |= own
+        if own:
+            passage.text = "".join(parts).strip()
+            result.append(passage)
+    return result
+
+#SH: Assemble the RAG context: adaptive k, merged chunks, no repeated text, bounded by a token budget
+def pack_context(
+    scored_docs: List[Tuple[Document, float]],
+    budget_tokens: int,
+    model: str,
+    score_cutoff: float,
+    max_k: int,
+    min_passage_tokens: int = 50,
+    compress: Optional[Callable[[List[Passage], int], List[Passage]]] = None
+) -> PackedContext:
+    selected = select_adaptive(scored_docs, score_cutoff, max_k)
+    raw_tokens = count_tokens("\n".join(doc.page_content for doc, _ in selected), model)
+    passages = remove_duplicate_spans(merge_passages(selected))
+    uncompressed_tokens = None
+    if compress is not None and passages:
+        # What packing alone would have sent, to measure what compression saves
+        uncompressed_tokens = min(count_tokens("\n\n".join(p.text for p in passages), model), budget_tokens)
+        passages = compress(passages, budget_tokens)
+
+    parts: List[str] = []
+    documents: List[Document] = []
+    used = 0
+    for passage in passages:
+        remaining = budget_tokens - used
+        if remaining <= 0:
+            break
+        tokens = count_tokens(passage.text, model)
+        if tokens > remaining:
+            if remaining < min_passage_tokens:
+                break
+            passage.text = truncate_to_tokens(passage.text, remaining, model)
+            tokens = count_tokens(passage.text, model)
+        parts.append(passage.text)
+        documents.extend(passage.documents)
+        used += tokens
+
+    text = "\n\n".join(parts)
+    packed = PackedContext(
+        text=text,
+        documents=documents,
+        tokens=count_tokens(text, model),
+        raw_tokens=raw_tokens,
+        candidates=len(scored_docs),
+        uncompressed_tokens=uncompressed_tokens if uncompressed_tokens is not None else count_tokens(text, model),
+        compressed=uncompressed_tokens is not None
+    )
+    logger.debug(
+        f"Packed context: {len(selected)}/{len(scored_docs)} chunks kept, "
+        f"{packed.raw_tokens} -> {packed.tokens} tokens (budget {budget_tokens})"
+    )
+    return packed
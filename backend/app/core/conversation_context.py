@@ -0,0 +1,148 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+REUSE = "reuse"
+AUGMENT = "augment"
+MISS = "miss"
+
+@dataclass
+class RetrievalTurn:
+    vector: np.ndarray
+    scored_docs: List[Tuple[Any, float]]
+
+@dataclass
+class _ConversationEntry:
+    index_version: tuple
+    turns: List[RetrievalTurn] = field(default_factory=list)
+    touched_at: float = field(default_factory=time.monotonic)
+
+@dataclass
+class ReuseDecision:
+    mode: str
+    similarity: float = 0.0
+    scored_docs: List[Tuple[Any, float]] = field(default_factory=list)
+
+#SH: Chunk identity for merging turns, documents from the vector store carry their Chroma id
+def chunk_key(doc) -> str:
+    return getattr(doc, "id", None) or doc.page_content
+
+#SH: Union of scored chunks keeping each chunk's best score, best first
+def merge_scored_docs(*groups: List[Tuple[Any, float]]) -> List[Tuple[Any, float]]:
+    best: Dict[str, Tuple[Any, float]] = {}
+    for group in groups:
+        for doc, score in group:
+            key = chunk_key(doc)
+            if key not in best or score > best[key][1]:
+                best[key] = (doc, score)
+    return sorted(best.values(), key=lambda item: item[1], reverse=True)
+
+#SH: Per-conversation memory of the last turns' query embeddings and retrieved chunks, so follow-ups skip the search
+class ConversationRetrievalCache:
+    def __init__(self, reuse_threshold: float, augment_threshold: float, turns: int, max_conversations: int, ttl: float):
+        self.reuse_threshold = reuse_threshold
+        self.augment_threshold = augment_threshold
+        self.turns = turns
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, _ConversationEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.augmented = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def _entry(self, key: Hashable, index_version: tuple) -> Optional[_ConversationEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.touched_at + self.ttl < time.monotonic():
+            del self._entries[key]
+            return None
+        # Chunks written, deleted or re-embedded since: cached results may point at stale text
+        if entry.index_version != index_version:
+            del self._entries[key]
+            self.invalidations += 1
+            return None
+        return entry
+
+    #SH: How to serve this turn: reuse the closest turn's chunks, augment them with a smaller search, or search in full
+    def lookup(self, key: Hashable, index_version: tuple, embedding) -> ReuseDecision:
+        query = self._normalize(embedding)
+        with self._lock:
+            entry = self._entry(key, index_version)
+            turns = [turn for turn in entry.turns if turn.vector.shape == query.shape] if entry else []
+            if not turns:
+                self.misses += 1
+                return ReuseDecision(MISS)
+            similarities = [float(turn.vector @ query) for turn in turns]
+            best = int(np.argmax(similarities))
+            similarity = similarities[best]
+            if similarity >= self.reuse_threshold:
+                self.reused += 1
+                entry.touched_at = time.monotonic()
+                self._entries.move_to_end(key)
+                return ReuseDecision(REUSE, similarity, list(turns[best].scored_docs))
+            if similarity >= self.augment_threshold:
+                self.augmented += 1
+                # Earlier chunks were relevant to a different question, discount them by how close it was
+                carried = [
+                    (doc, score * sim)
+                    for turn, sim in zip(turns, similarities) if sim >= self.augment_threshold
+                    for doc, score in turn.scored_docs
+                ]
+                return ReuseDecision(AUGMENT, similarity, merge_scored_docs(carried))
+            self.misses += 1
+            return ReuseDecision(MISS, similarity)
+
+    def store(self, key: Hashable, index_version: tuple, embedding, scored_docs: List[Tuple[Any, float]]):
+        turn = RetrievalTurn(vector=self._normalize(embedding), scored_docs=list(scored_docs))
+        with self._lock:
+            entry = self._entry(key, index_version)
+            if entry is None:
+                entry = _ConversationEntry(index_version=index_version)
+                self._entries[key] = entry
+            entry.turns = (entry.turns + [turn])[-self.turns:]
+            entry.touched_at = time.monotonic()
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_conversations:
+                self._entries.popitem(last=False)
+
+    def forget(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.reused + self.augmented + self.misses
+        return {
+            "conversations": len(self._entries),
+            "reused": self.reused,
+            "augmented": self.augmented,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "reuse_rate_percent": round(self.reused / total * 100, 2) if total else 0.0,
+            "reuse_threshold": self.reuse_threshold,
+            "augment_threshold": self.augment_threshold,
+        }
+
+# Global instance
+conversation_retrieval_cache = ConversationRetrievalCache(
+    reuse_threshold=settings.RAG_REUSE_SIMILARITY,
+    augment_threshold=settings.RAG_AUGMENT_SIMILARITY,
+    turns=settings.RAG_REUSE_TURNS,
+    max_conversations=settings.RAG_REUSE_MAX_CONVERSATIONS,
+    ttl=settings.RAG_REUSE_TTL
+)
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+#SH: Collects query texts from concurrent coroutines and embeds them in one provider call
+class CoalescingEmbeddings(Embeddings):
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int, max_wait_ms: float):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight = 0
+        self.requests = 0
+        self.batches = 0
+        self.max_batch_seen = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+        self.requests += 1
+        # An idle embedder sends right away, waiting only pays off while another batch is on the wire
+        if self._in_flight == 0 or len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            self._in_flight += 1
+            asyncio.get_running_loop().create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch: List[Tuple[str, asyncio.Future]]):
+        # Identical questions in one window are embedded once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.batches += 1
+        self.max_batch_seen = max(self.max_batch_seen, len(texts))
+        try:
+            vectors = await self.embeddings.aembed_documents(texts)
+            by_text: Dict[str, List[float]] = dict(zip(texts, vectors))
+            for text, future in batch:
+                if not future.done():
+                    future.set_result(by_text[text])
+        except Exception as e:
+            logger.warning(f"Batched embedding of {len(texts)} queries failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._in_flight -= 1
+            # Whatever queued up behind this batch goes out now instead of waiting for the timer
+            if self._pending and self._in_flight == 0:
+                self._flush()
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0,
+            "max_batch_size": self.max_batch_seen,
+            "pending": len(self._pending),
+            "in_flight": self._in_flight
+        }
@@ -0,0 +1,212 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+#SH: In-process LRU cache where every entry also expires after a fixed TTL
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (ttl if ttl is not None else self.ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate_percent": round(self.hits / total * 100, 2) if total else 0.0,
+        }
+
+#SH: Local sqlite store so that all workers on one host share cached vectors
+class SharedEmbeddingStore:
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector FROM query_embeddings WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        vector = array("f")
+        vector.frombytes(row[0])
+        return vector.tolist()
+
+    def set(self, key: str, vector: List[float]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, vector, expires_at) VALUES (?, ?, ?)",
+                (key, array("f", vector).tobytes(), time.time() + self.ttl)
+            )
+            self._conn.commit()
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM query_embeddings WHERE expires_at <= ?", (time.time(),))
+            self._conn.commit()
+            return cursor.rowcount
+
+#SH: Two level cache (process LRU, then optional shared store) for query embeddings
+class EmbeddingCache:
+    def __init__(self, maxsize: int, ttl: float, shared_path: Optional[str] = None):
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.shared: Optional[SharedEmbeddingStore] = None
+        self.shared_hits = 0
+        if shared_path:
+            try:
+                self.shared = SharedEmbeddingStore(shared_path, ttl)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared embedding cache disabled: {e}")
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split()).casefold()
+
+    @classmethod
+    def make_key(cls, model: str, text: str) -> str:
+        return f"{model}:{cls.normalize(text)}"
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        key = self.make_key(model, text)
+        vector = self.local.get(key)
+        if vector is not None or self.shared is None:
+            return vector
+        try:
+            vector = self.shared.get(key)
+        except sqlite3.Error as e:
+            logger.warning(f"Shared embedding cache read failed: {e}")
+            return None
+        if vector is not None:
+            self.shared_hits += 1
+            self.local.set(key, vector)
+        return vector
+
+    def set(self, model: str, text: str, vector: List[float]):
+        key = self.make_key(model, text)
+        self.local.set(key, vector)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, vector)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared embedding cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.local.stats()
+        stats["shared_enabled"] = self.shared is not None
+        stats["shared_hits"] = self.shared_hits
+        # A shared hit was first counted as a local miss, so fold it back into the hit rate
+        lookups = self.local.hits + self.local.misses
+        stats["hit_rate_percent"] = round((self.local.hits + self.shared_hits) / lookups * 100, 2) if lookups else 0.0
+        return stats
+
+#SH: Embeddings wrapper that answers repeated queries from the cache and skips the API hop
+class CachedEmbeddings(Embeddings):
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        cache: "EmbeddingCache",
+        model: Optional[str] = None,
+        dtype: str = "float32"
+    ):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model or getattr(embeddings, "model", type(embeddings).__name__)
+        self.dtype = np.dtype(dtype)
+
+    #SH: Cached vectors are held as compact numpy arrays (float16 halves the cache), callers still get lists
+    def _store(self, text: str, vector: List[float]) -> List[float]:
+        self.cache.set(self.model, text, np.asarray(vector, dtype=self.dtype))
+        return vector
+
+    @staticmethod
+    def _load(vector) -> List[float]:
+        return vector.astype(np.float32).tolist() if isinstance(vector, np.ndarray) else vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Document embeddings happen once at ingestion, caching them would only evict queries
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.cache.get(self.model, text)
+        if vector is None:
+            return self._store(text, self.embeddings.embed_query(text))
+        return self._load(vector)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self.cache.get(self.model, text)
+        if vector is None:
+            return self._store(text, await self.embeddings.aembed_query(text))
+        return self._load(vector)
+
+# Global instance
+embedding_cache = EmbeddingCache(
+    maxsize=settings.EMBEDDING_CACHE_SIZE,
+    ttl=settings.EMBEDDING_CACHE_TTL,
+    shared_path=settings.EMBEDDING_CACHE_PATH if settings.EMBEDDING_CACHE_SHARED else None
+)
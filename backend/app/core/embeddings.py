@@ -0,0 +1,200 @@
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+#SH: Sentence-embedding model exported to ONNX, run on the CPU inside this process
+class LocalOnnxEmbeddings(Embeddings):
+
+    def __init__(
+        self,
+        session,
+        tokenizer,
+        model: str,
+        batch_size: int = 32,
+        threads: int = 4,
+        max_length: int = 256
+    ):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.model = model
+        self.batch_size = batch_size
+        self.input_names = {node.name for node in session.get_inputs()}
+        self.tokenizer.enable_truncation(max_length=max_length)
+        if self.tokenizer.padding is None:
+            self.tokenizer.enable_padding()
+        # onnxruntime releases the GIL while it runs, so batches really execute in parallel
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="local-embeddings")
+
+    @classmethod
+    def from_directory(
+        cls,
+        model: str,
+        model_dir: str,
+        quantized: bool = True,
+        **kwargs
+    ) -> "LocalOnnxEmbeddings":
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise RuntimeError("The local embedding provider needs onnxruntime and tokenizers installed") from e
+
+        path = os.path.join(model_dir, model)
+        model_file = os.path.join(path, "model_quantized.onnx")
+        if not (quantized and os.path.exists(model_file)):
+            model_file = os.path.join(path, "model.onnx")
+        if not os.path.exists(model_file):
+            raise RuntimeError(f"No ONNX model found for local embedding model {model} in {path}")
+
+        options = ort.SessionOptions()
+        # Parallelism comes from running batches on our pool, not from threads inside one run
+        options.intra_op_num_threads = 1
+        session = ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        logger.info(f"Loaded local embedding model {model} from {model_file}")
+        return cls(session, tokenizer, model, **kwargs)
+
+    #SH: Mean pooling over real tokens, then L2 normalization (sentence-transformers convention)
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        hidden = self.session.run(None, feeds)[0]
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        return [vector for batch in self.executor.map(self._embed_batch, batches) for vector in batch]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.embed_query, text)
+
+#SH: Keeps the leading dimensions and re-normalizes, for models trained to front-load information (Matryoshka)
+class ReducedDimensionEmbeddings(Embeddings):
+
+    def __init__(self, embeddings: Embeddings, dimensions: int):
+        self.embeddings = embeddings
+        self.dimensions = dimensions
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+
+    def _reduce(self, vectors: List[List[float]]) -> List[List[float]]:
+        array = np.asarray(vectors, dtype=np.float32)[:, :self.dimensions]
+        norms = np.linalg.norm(array, axis=1, keepdims=True)
+        return (array / np.clip(norms, 1e-12, None)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._reduce(self.embeddings.embed_documents(texts)) if texts else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._reduce([self.embeddings.embed_query(text)])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._reduce(await self.embeddings.aembed_documents(texts)) if texts else []
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self._reduce([await self.embeddings.aembed_query(text)])[0]
+
+def _openai_embeddings(model: str, dimensions: Optional[int] = None) -> Embeddings:
+    if settings.LLM_MOCK_URL:
+        # Plain strings instead of tiktoken ids, the mock has to work offline
+        return OpenAIEmbeddings(
+            model=model,
+            dimensions=dimensions,
+            openai_api_key=settings.OPENAI_API_KEY,
+            openai_api_base=settings.LLM_MOCK_URL,
+            check_embedding_ctx_length=False
+        )
+    # text-embedding-3 models shorten vectors server side, which also shrinks the response
+    return OpenAIEmbeddings(model=model, dimensions=dimensions, openai_api_key=settings.OPENAI_API_KEY)
+
+def _local_embeddings(model: str, dimensions: Optional[int] = None) -> Embeddings:
+    embeddings = LocalOnnxEmbeddings.from_directory(
+        model,
+        settings.LOCAL_EMBEDDING_MODEL_DIR,
+        quantized=settings.LOCAL_EMBEDDING_QUANTIZED,
+        batch_size=settings.LOCAL_EMBEDDING_BATCH_SIZE,
+        threads=settings.LOCAL_EMBEDDING_THREADS,
+        max_length=settings.LOCAL_EMBEDDING_MAX_LENGTH
+    )
+    return ReducedDimensionEmbeddings(embeddings, dimensions) if dimensions else embeddings
+
+#SH: Storage dtypes of the vectors we keep in process (query cache, hot tier), Chroma itself stores float32
+VECTOR_DTYPES = {"float32": np.float32, "float16": np.float16}
+
+#SH: Provider name -> (factory building an Embeddings for a model and output dimensions, default model)
+EMBEDDING_PROVIDERS: Dict[str, Tuple[Callable[..., Embeddings], Callable[[], str]]] = {
+    "openai": (_openai_embeddings, lambda: settings.EMBEDDING_MODEL),
+    "local": (_local_embeddings, lambda: settings.LOCAL_EMBEDDING_MODEL),
+}
+
+#SH: Providers billed and rate limited per token, bulk jobs throttle against them
+REMOTE_PROVIDERS = {"openai"}
+
+_instances: Dict[Tuple[str, str, Optional[int]], Embeddings] = {}
+_instances_lock = threading.Lock()
+
+def register_embedding_provider(name: str, factory: Callable[..., Embeddings], default_model: Callable[[], str]):
+    EMBEDDING_PROVIDERS[name] = (factory, default_model)
+
+#SH: Fill in the defaults of an organization's embedding profile (provider, model, dimensions, dtype)
+def resolve_embedding_config(config: Optional[dict] = None) -> dict:
+    config = {key: value for key, value in (config or {}).items() if value is not None}
+    provider = config.get("provider") or settings.EMBEDDING_PROVIDER
+    if provider not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"Unknown embedding provider {provider}. Allowed: {sorted(EMBEDDING_PROVIDERS)}")
+    model = config.get("model") or EMBEDDING_PROVIDERS[provider][1]()
+    # The default dimensions belong to the default model, a profile naming its own model opts out of them
+    dimensions = config.get("dimensions", None if "model" in config else settings.EMBEDDING_DIMENSIONS)
+    dtype = config.get("dtype") or settings.EMBEDDING_VECTOR_DTYPE
+
+    if dimensions is not None:
+        dimensions = int(dimensions)
+        if dimensions <= 0:
+            raise ValueError("Embedding dimensions must be positive")
+        if provider == "openai" and not model.startswith("text-embedding-3"):
+            raise ValueError(f"{model} does not support reduced dimensions")
+    if dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Unknown vector dtype {dtype}. Allowed: {sorted(VECTOR_DTYPES)}")
+    return {**config, "provider": provider, "model": model, "dimensions": dimensions, "dtype": dtype}
+
+#SH: Identifier of the vector space, OpenAI models keep their plain name so existing caches stay valid.
+#SH: Mock vectors get their own space, they must never be cached as the real model's.
+def embedding_id(provider: str, model: str, dimensions: Optional[int] = None) -> str:
+    if provider == "openai" and settings.LLM_MOCK_URL:
+        provider = "mock"
+    name = model if provider == "openai" else f"{provider}:{model}"
+    return f"{name}@{dimensions}" if dimensions else name
+
+#SH: Models are loaded once per process, local ones are far too expensive to build per request
+def get_embeddings(provider: str, model: str, dimensions: Optional[int] = None) -> Embeddings:
+    key = (provider, model, dimensions)
+    if key not in _instances:
+        with _instances_lock:
+            if key not in _instances:
+                factory = EMBEDDING_PROVIDERS[provider][0]
+                _instances[key] = factory(model, dimensions)
+    return _instances[key]
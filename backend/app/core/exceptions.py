@@ -49,6 +49,12 @@ def openai_exception(detail: str) -> HTTPException:
         detail=f"OpenAI API Error: {detail}",
     )
 
+def prompt_too_large_error(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Prompt Too Large: {detail}",
+    )
+
 def network_exception(detail: str = "Connection to AI service failed") -> HTTPException:
     return HTTPException(
         status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
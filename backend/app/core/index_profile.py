@@ -0,0 +1,106 @@
+import os
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_community.vectorstores import Chroma
+
+#SH: Chroma's HNSW defaults, collections here are created without hnsw:* metadata
+HNSW_M = 16
+FLOAT32_BYTES = 4
+
+#SH: Models trained so that leading dimensions carry most of the signal, truncating them keeps recall
+MATRYOSHKA_MODEL_PREFIXES = ("text-embedding-3",)
+
+def supports_reduced_dimensions(model: str) -> bool:
+    return model.startswith(MATRYOSHKA_MODEL_PREFIXES)
+
+#SH: Resident bytes of one HNSW element: the float32 vector, level 0 links (2*M ids + count) and the label
+def hnsw_bytes_per_vector(dimensions: int, m: int = HNSW_M) -> int:
+    # Upper layers hold about 1/M of the elements, small enough to leave out
+    return dimensions * FLOAT32_BYTES + (2 * m + 1) * 4 + 8 + 4
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+#SH: recall@k of truncated vectors against exact search on the stored full vectors
+def estimate_recall(vectors: np.ndarray, dimensions: int, queries: int = 50, k: int = 10) -> Optional[float]:
+    if len(vectors) <= k or dimensions > vectors.shape[1]:
+        return None
+    full = _normalize(vectors.astype(np.float32))
+    reduced = _normalize(full[:, :dimensions])
+    query_rows = np.linspace(0, len(vectors) - 1, min(queries, len(vectors))).astype(int)
+
+    hits = 0
+    for row in query_rows:
+        exact = full @ full[row]
+        approx = reduced @ reduced[row]
+        # The query itself is always its own top hit, leave it out of both lists
+        exact[row] = approx[row] = -np.inf
+        hits += len(set(np.argpartition(-exact, k)[:k]) & set(np.argpartition(-approx, k)[:k]))
+    return round(hits / (len(query_rows) * k), 4)
+
+#SH: Sample of stored vectors, enough for a recall estimate without loading the whole index
+def sample_vectors(store: Chroma, limit: int = 2000) -> np.ndarray:
+    embeddings = store._collection.get(include=["embeddings"], limit=limit)["embeddings"]
+    if embeddings is None or len(embeddings) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.asarray(embeddings, dtype=np.float32)
+
+#SH: Memory and disk of one organization index under each candidate dimension count. Chroma stores float32 whatever
+#SH: the profile dtype is (that only affects in-process caches), so the dtype does not appear here.
+def profile_index(
+    store: Chroma,
+    index_dir: str,
+    generation: dict,
+    candidate_dimensions: List[int],
+    sample_size: int = 2000
+) -> Dict:
+    count = store._collection.count()
+    vectors = sample_vectors(store, sample_size)
+    dimensions = vectors.shape[1] if vectors.size else generation.get("dimensions")
+    disk_bytes = _directory_size(index_dir)
+    provider, model = generation.get("provider", "openai"), generation["model"]
+    reducible = supports_reduced_dimensions(model)
+
+    current = {
+        "dimensions": dimensions,
+        "index_ram_bytes": count * hnsw_bytes_per_vector(dimensions) if dimensions else 0,
+        "disk_bytes": disk_bytes
+    }
+    if not dimensions:
+        return {"vectors": count, "provider": provider, "model": model, "current": current, "profiles": []}
+
+    # Vectors sit both in the HNSW files and in the sqlite embeddings queue, the rest is documents and metadata
+    vector_disk = count * (hnsw_bytes_per_vector(dimensions) + dimensions * FLOAT32_BYTES)
+    other_disk = max(disk_bytes - vector_disk, 0)
+
+    profiles = []
+    for candidate in sorted({d for d in candidate_dimensions if d <= dimensions} | {dimensions}, reverse=True):
+        if candidate != dimensions and not reducible:
+            continue
+        index_ram = count * hnsw_bytes_per_vector(candidate)
+        profiles.append({
+            "dimensions": candidate,
+            "index_ram_bytes": index_ram,
+            "disk_bytes": other_disk + count * (hnsw_bytes_per_vector(candidate) + candidate * FLOAT32_BYTES),
+            "ram_reduction": round(current["index_ram_bytes"] / index_ram, 2) if index_ram else None,
+            "recall_at_10": estimate_recall(vectors, candidate)
+        })
+
+    return {
+        "vectors": count,
+        "provider": provider,
+        "model": model,
+        "supports_reduced_dimensions": reducible,
+        "current": current,
+        "profiles": profiles
+    }
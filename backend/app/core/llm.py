@@ -1,41 +1,173 @@
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, before_sleep_log
 import openai
 from openai import AsyncOpenAI
+import time
+import asyncio
 import logging
+from types import SimpleNamespace
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple, TypeVar
 from app.core.config import settings
-from app.core.exceptions import llm_service_error, invalid_api_key_error, openai_exception
+from app.core.llm_admission import INTERACTIVE, AdmissionTimeout, Ticket, llm_admission, llm_retry_policy
+from app.core.llm_pool import llm_providers
+from app.core.model_router import StreamInterrupted, model_router
+from app.core.tokenizer import FittedPrompt, count_message_tokens, count_tokens, fit_prompt, get_context_window
+from app.core.exceptions import llm_service_error, invalid_api_key_error, openai_exception, prompt_too_large_error
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+#SH: Per-token prices of a model from settings.MODEL_PRICING. Unknown models get the highest listed price, so costs are never understated.
+def get_model_pricing(model: str) -> dict:
+    table = settings.MODEL_PRICING
+    name = model if model in table else next(
+        (family for family in sorted(table, key=len, reverse=True) if (model or "").startswith(family)), None
+    )
+    if name is None:
+        name = max(table, key=lambda family: table[family]["input"] + table[family]["output"])
+        logger.warning(f"No pricing configured for model {model}, using {name} prices")
+    prices = table[name]
+    return {
+        "input": prices["input"] / 1000,
+        "cached_input": prices.get("cached_input", prices["input"]) / 1000,
+        "output": prices["output"] / 1000,
+    }
+
+#SH: What a completion has used so far, filled in while it runs so a cancelled call can still be accounted for
+@dataclass
+class GenerationProgress:
+    model: Optional[str] = None
+    prompt_tokens: int = 0
+    parts: List[str] = field(default_factory=list)
+    calls: List["GenerationProgress"] = field(default_factory=list)
+
+    #SH: Progress of one of several calls made for the same answer (fallback, hedging), usage and cost add up over all of them
+    def child(self) -> "GenerationProgress":
+        call = GenerationProgress()
+        self.calls.append(call)
+        return call
+
+    @property
+    def started(self) -> bool:
+        return self.model is not None or any(call.started for call in self.calls)
+
+    #SH: Model of the first call that started, the primary when calls were raced
+    def model_used(self) -> Optional[str]:
+        return self.model or next((call.model_used() for call in self.calls if call.started), None)
+
+    #SH: Text produced so far, of the first call that produced any when calls were raced
+    def text(self) -> str:
+        if self.calls:
+            return next((text for text in (call.text() for call in self.calls) if text), "")
+        return "".join(self.parts)
+
+    def usage(self) -> dict:
+        if self.calls:
+            usages = [call.usage() for call in self.calls]
+            return {key: sum(usage[key] for usage in usages) for key in ("prompt_tokens", "completion_tokens", "total_tokens")}
+        completion_tokens = count_tokens("".join(self.parts), self.model) if self.parts else 0
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": self.prompt_tokens + completion_tokens
+        }
+
+    def cost(self) -> float:
+        if self.calls:
+            return sum(call.cost() for call in self.calls)
+        if not self.started:
+            return 0.0
+        usage = self.usage()
+        prices = get_model_pricing(self.model)
+        return usage["prompt_tokens"] * prices["input"] + usage["completion_tokens"] * prices["output"]
+
 #SH: This class handles communication with openai's async api
 class OpenAIClient:
-    def __init__(self):
-        #SH: Initialize the openai async client with credentials and settings
-        self.client = AsyncOpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            timeout=settings.REQUEST_TIMEOUT,
-            max_retries=settings.MAX_RETRIES,
-        )
+    def __init__(self, client: Optional[AsyncOpenAI] = None):
+        self._client = client
 
-    #SH: Retry logic: If certain exceptions happen, retry the API call
-    @retry(
-        stop=stop_after_attempt(settings.MAX_RETRIES),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type((openai.APIError, openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)),
-        before_sleep=before_sleep_log(logger, logging.WARNING),
-    )
-    async def generate(self, model: str, prompt: str, system_prompt: str, temperature: float, max_tokens: int) -> dict:
+    #SH: The pooled AsyncOpenAI of the provider serving the model unless one was passed in, so every call reuses warm connections
+    def client_for(self, model: str) -> AsyncOpenAI:
+        return self._client or llm_providers.client(model)
+
+    #SH: Count the prompt before sending it: trim context that would overflow the model window and cap the completion
+    #SH: to what is left, so an oversized request fails here instead of at the provider after a round trip
+    @staticmethod
+    def _preflight(model: str, prompt: str, system_prompt: str, max_tokens: int) -> Tuple[FittedPrompt, int]:
+        completion_tokens = min(max_tokens, settings.MAX_TOKENS_LIMIT)
+        fitted = fit_prompt(model, system_prompt, prompt, completion_tokens)
+        if fitted.trimmed_tokens:
+            logger.warning(f"Prompt for {model} trimmed by {fitted.trimmed_tokens} tokens to fit its context window")
+        free = get_context_window(model) - fitted.prompt_tokens
+        if free < 1:
+            raise prompt_too_large_error(f"Prompt of {fitted.prompt_tokens} tokens does not fit the {model} context window")
+        return fitted, min(completion_tokens, free)
+
+    #SH: The only retry loop for LLM calls: every attempt is admitted again, so a retry storm queues instead of hammering the provider
+    async def _admitted(
+        self,
+        attempt_call: Callable[[Ticket], Awaitable[T]],
+        estimated_tokens: int,
+        organization_id: Optional[int],
+        priority: int
+    ) -> T:
+        llm_retry_policy.record_attempt()
+        attempt = 0
+        while True:
+            attempt += 1
+            ticket = await llm_admission.admit(organization_id, estimated_tokens, priority)
+            try:
+                return await attempt_call(ticket)
+            except Exception as e:
+                delay = llm_retry_policy.next_delay(e, attempt)
+                if delay is None:
+                    raise
+                logger.warning(f"LLM call failed ({type(e).__name__}), attempt {attempt} of {llm_retry_policy.max_attempts}, retrying in {delay:.1f}s")
+            finally:
+                ticket.release()
+            await asyncio.sleep(delay)
+
+    async def generate(
+        self,
+        model: str,
+        prompt: str,
+        system_prompt: str,
+        temperature: float,
+        max_tokens: int,
+        organization_id: Optional[int] = None,
+        priority: int = INTERACTIVE,
+        progress: Optional[GenerationProgress] = None
+    ) -> dict:
         #SH: This function sends a prompt to OpenAI and returns the generated response.It also logs token usage and handles common API errors.
-        try:
+        fitted, completion_tokens = self._preflight(model, prompt, system_prompt, max_tokens)
+        if progress is not None:
+            progress.model, progress.prompt_tokens, progress.parts = model, fitted.prompt_tokens, []
+
+        async def attempt_call(ticket: Ticket):
             #SH: Send the prompt and system message to OpenAI's chat completion endpoint
-            response = await self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=temperature,
-                max_tokens=min(max_tokens, settings.MAX_TOKENS_LIMIT),
+            try:
+                response = await self.client_for(model).chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": fitted.prompt},
+                    ],
+                    temperature=temperature,
+                    max_tokens=completion_tokens,
+                )
+            except asyncio.CancelledError:
+                # Cancelling closes the connection, the completion it would have produced no longer counts against the limits
+                ticket.settle(fitted.prompt_tokens)
+                raise
+            ticket.settle(response.usage.total_tokens)
+            return response
+
+        try:
+            response = await self._admitted(
+                attempt_call,
+                fitted.prompt_tokens + completion_tokens,
+                organization_id,
+                priority
             )
 
             #SH: Calculate cost of the API call based on token usage and model pricing
@@ -48,6 +180,7 @@ class OpenAIClient:
                 "usage": response.usage.model_dump(),
                 "model": model,
                 "cost": cost,
+                "prompt_trimmed_tokens": fitted.trimmed_tokens,
             }
 
         #SH: Handle specific API errors
@@ -57,20 +190,188 @@ class OpenAIClient:
         except openai.RateLimitError:
             logger.warning("Rate limit exceeded")
             raise llm_service_error("API rate limit exceeded")
+        except AdmissionTimeout as e:
+            logger.warning(str(e))
+            raise llm_service_error("LLM capacity exhausted, please retry shortly")
         except Exception as e:
             logger.error(f"OpenAI API error: {str(e)}")
-            raise openai_exception("API error occurred")
+            raise openai_exception("API error occurred") from e
 
-    def _calculate_cost(self, usage, model):
-        
-        #SH: Estimate the cost of the API call based on token usage. Different models have different pricing.
-        pricing = {
-            "gpt-4": {"input": 0.03/1000, "output": 0.06/1000},
-            "gpt-3.5-turbo": {"input": 0.0015/1000, "output": 0.002/1000},
+    #SH: Streams the completion: {"type": "delta", "content"} per chunk, then one {"type": "done"} carrying the full
+    #SH: text, usage and cost. Retried only until the first delta, after that a retry would repeat text the client already shows.
+    async def generate_stream(
+        self,
+        model: str,
+        prompt: str,
+        system_prompt: str,
+        temperature: float,
+        max_tokens: int,
+        organization_id: Optional[int] = None,
+        priority: int = INTERACTIVE,
+        progress: Optional[GenerationProgress] = None
+    ) -> AsyncIterator[dict]:
+        started = time.perf_counter()
+        first_token_ms = None
+        parts = []
+        usage = None
+        fitted, completion_tokens = self._preflight(model, prompt, system_prompt, max_tokens)
+        if progress is not None:
+            progress.model, progress.prompt_tokens, progress.parts = model, fitted.prompt_tokens, parts
+        estimated_tokens = fitted.prompt_tokens + completion_tokens
+        llm_retry_policy.record_attempt()
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                ticket = await llm_admission.admit(organization_id, estimated_tokens, priority)
+                stream = None
+                try:
+                    stream = await self.client_for(model).chat.completions.create(
+                        model=model,
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": fitted.prompt},
+                        ],
+                        temperature=temperature,
+                        max_tokens=completion_tokens,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                    )
+                    async for chunk in stream:
+                        # The usage chunk comes last and has no choices
+                        if chunk.usage is not None:
+                            usage = chunk.usage
+                        if not chunk.choices or not chunk.choices[0].delta.content:
+                            continue
+                        if first_token_ms is None:
+                            first_token_ms = (time.perf_counter() - started) * 1000
+                        parts.append(chunk.choices[0].delta.content)
+                        yield {"type": "delta", "content": chunk.choices[0].delta.content}
+                    if usage is None:
+                        usage = self._counted_usage(model, fitted.prompt, system_prompt, "".join(parts))
+                    ticket.settle(usage.total_tokens)
+                    break
+                except (asyncio.CancelledError, GeneratorExit):
+                    # The caller went away: close the HTTP stream so the provider stops generating, and give back the
+                    # part of the estimate that was never produced
+                    ticket.settle(fitted.prompt_tokens + (count_tokens("".join(parts), model) if parts else 0))
+                    if stream is not None:
+                        await stream.close()
+                    raise
+                except Exception as e:
+                    delay = None if parts else llm_retry_policy.next_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    logger.warning(f"LLM stream failed before its first token ({type(e).__name__}), retrying in {delay:.1f}s")
+                finally:
+                    ticket.release()
+                await asyncio.sleep(delay)
+
+        except openai.AuthenticationError:
+            logger.error("Authentication error")
+            raise invalid_api_key_error()
+        except openai.RateLimitError:
+            logger.warning("Rate limit exceeded")
+            raise llm_service_error("API rate limit exceeded")
+        except AdmissionTimeout as e:
+            logger.warning(str(e))
+            raise llm_service_error("LLM capacity exhausted, please retry shortly")
+        except Exception as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            raise openai_exception("API error occurred") from e
+
+        content = "".join(parts)
+        cost = self._calculate_cost(usage, model)
+        logger.info(f"API Stream | Model: {model} | Tokens: {usage.total_tokens} | Cost: ${cost:.5f} | TTFT: {first_token_ms or 0:.0f}ms")
+        yield {
+            "type": "done",
+            "content": content,
+            "usage": usage.model_dump(),
+            "model": model,
+            "cost": cost,
+            "time_to_first_token_ms": first_token_ms,
+            "prompt_trimmed_tokens": fitted.trimmed_tokens,
         }
 
-        #SH: Use default GPT-4 pricing if the model is unknown
-        model_pricing = pricing.get(model, pricing["gpt-3.5-turbo"])
+    #SH: generate() with the answer forwarded to on_delta while it is produced, returns the same dict plus time to first token
+    async def generate_streamed(self, on_delta, **kwargs) -> dict:
+        forwarded = False
+        events = self.generate_stream(**kwargs)
+        try:
+            async for event in events:
+                if event["type"] == "done":
+                    return event
+                await on_delta(event["content"])
+                forwarded = True
+        except Exception as e:
+            if forwarded:
+                raise StreamInterrupted(str(e)) from e
+            raise
+        finally:
+            # Cancelled while forwarding a delta, the generator is parked on its yield: close it now, not at garbage collection
+            await events.aclose()
+        raise StreamInterrupted("Stream ended without a final event")
+
+    #SH: Usage for servers without stream usage support: count it ourselves
+    @staticmethod
+    def _counted_usage(model: str, prompt: str, system_prompt: str, content: str) -> SimpleNamespace:
+        prompt_tokens = count_message_tokens(model, system_prompt, prompt)
+        completion_tokens = count_tokens(content, model)
+        return SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+            model_dump=lambda: {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        )
+
+    #SH: generate() or generate_streamed() through the model router: the agent's model, or fallback_model when that
+    #SH: model's circuit is open, it fails, or (hedge) it runs past its p95 deadline. The response names its route.
+    async def generate_routed(
+        self,
+        fallback_model: Optional[str] = None,
+        on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+        hedge: bool = False,
+        **completion
+    ) -> dict:
+        progress = completion.pop("progress", None)
+
+        async def call(model: str) -> dict:
+            # Raced calls run at the same time, each one fills in its own progress
+            call_progress = progress.child() if progress is not None else None
+            options = {**completion, "model": model, "progress": call_progress}
+            try:
+                if on_delta is not None:
+                    return await self.generate_streamed(on_delta, **options)
+                return await self.generate(**options)
+            except StreamInterrupted:
+                raise
+            except Exception:
+                # A call that failed before streaming anything used no tokens, cancelled and interrupted ones did
+                if call_progress is not None:
+                    progress.calls.remove(call_progress)
+                raise
+
+        return await model_router.route(
+            call,
+            completion["model"],
+            fallback_model,
+            hedge=hedge,
+            streaming=on_delta is not None
+        )
+
+    def _calculate_cost(self, usage, model):
+        #SH: Calculate total cost = input cost + output cost, prompt tokens served from the provider's cache are cheaper
+        model_pricing = get_model_pricing(model)
+        cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+        return (
+            (usage.prompt_tokens - cached_tokens) * model_pricing["input"]
+            + cached_tokens * model_pricing["cached_input"]
+            + usage.completion_tokens * model_pricing["output"]
+        )
 
-        #SH: Calculate total cost = input cost + output cost
-        return (usage.prompt_tokens * model_pricing["input"]) + (usage.completion_tokens * model_pricing["output"])
\ No newline at end of file
+# Global instance
+llm_client = OpenAIClient()
@@ -0,0 +1,293 @@
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import openai
+from app.core.config import settings
+from app.core.rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+#SH: Lower runs first, interactive chat goes ahead of background jobs
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+GLOBAL = None
+
+class AdmissionTimeout(Exception):
+    pass
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    virtual_finish: float
+    seq: int
+    virtual_start: float = field(compare=False)
+    organization_id: Optional[int] = field(compare=False)
+    tokens: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+
+@dataclass
+class _Limits:
+    requests: TokenBucket
+    tokens: TokenBucket
+    max_concurrency: int
+    active: int = 0
+    # Start-time fair queueing: an organization's requests are spaced by tokens / weight in virtual time
+    virtual_finish: float = 0.0
+
+#SH: A granted LLM call: holds its concurrency slots until released, settles its token estimate with real usage
+class Ticket:
+    def __init__(self, controller: "AdmissionController", organization_id: Optional[int], tokens: float, waited_ms: float):
+        self.controller = controller
+        self.organization_id = organization_id
+        self.tokens = tokens
+        self.waited_ms = waited_ms
+        self._released = False
+
+    def settle(self, used_tokens: int):
+        self.controller._settle(self.organization_id, self.tokens - used_tokens)
+        self.tokens = used_tokens
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self.organization_id)
+
+    async def __aenter__(self) -> "Ticket":
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+class AdmissionController:
+    """Admits LLM calls under global and per-organization RPM/TPM buckets and concurrency limits, by priority then weighted fair share"""
+
+    def __init__(
+        self,
+        global_rpm: int,
+        global_tpm: int,
+        global_concurrency: int,
+        org_rpm: int,
+        org_tpm: int,
+        org_concurrency: int,
+        queue_timeout: float,
+        org_weights: Optional[Dict[int, float]] = None
+    ):
+        self.org_rpm = org_rpm
+        self.org_tpm = org_tpm
+        self.org_concurrency = org_concurrency
+        self.queue_timeout = queue_timeout
+        self.org_weights = org_weights or {}
+        self.global_limits = _Limits(TokenBucket(global_rpm), TokenBucket(global_tpm), global_concurrency)
+        self.orgs: Dict[int, _Limits] = {}
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.admitted = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.timeouts = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def _org(self, organization_id: Optional[int]) -> _Limits:
+        if organization_id is GLOBAL:
+            return self.global_limits
+        if organization_id not in self.orgs:
+            self.orgs[organization_id] = _Limits(TokenBucket(self.org_rpm), TokenBucket(self.org_tpm), self.org_concurrency)
+        return self.orgs[organization_id]
+
+    def _scopes(self, organization_id: Optional[int]) -> List[_Limits]:
+        return [self.global_limits] if organization_id is GLOBAL else [self.global_limits, self._org(organization_id)]
+
+    #SH: Wait for a slot, the request and its estimated tokens are taken from every bucket it is subject to
+    async def admit(self, organization_id: Optional[int], tokens: int, priority: int = INTERACTIVE) -> Ticket:
+        limits = self._org(organization_id)
+        weight = self.org_weights.get(organization_id, 1.0)
+        # An idle organization starts at the current virtual time, it can't bank credit while away
+        start = max(self._virtual_time, limits.virtual_finish)
+        limits.virtual_finish = start + tokens / weight
+        waiter = _Waiter(
+            priority=priority,
+            virtual_finish=limits.virtual_finish,
+            seq=next(self._seq),
+            virtual_start=start,
+            organization_id=organization_id,
+            tokens=tokens,
+            future=asyncio.get_running_loop().create_future()
+        )
+        heapq.heappush(self._queue, waiter)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted in the same tick the timeout fired, hand the slot back
+                self._release(organization_id)
+            else:
+                waiter.future.cancel()
+                self._remove(waiter)
+            self.timeouts += 1
+            raise AdmissionTimeout(f"LLM capacity for organization {organization_id} exhausted")
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(organization_id)
+            else:
+                waiter.future.cancel()
+                self._remove(waiter)
+            raise
+
+        waited_ms = (time.monotonic() - waiter.enqueued_at) * 1000
+        self.total_wait_ms += waited_ms
+        self.max_wait_ms = max(self.max_wait_ms, waited_ms)
+        self.admitted[PRIORITY_NAMES.get(priority, str(priority))] += 1
+        return Ticket(self, organization_id, tokens, waited_ms)
+
+    def _remove(self, waiter: _Waiter):
+        if waiter in self._queue:
+            self._queue.remove(waiter)
+            heapq.heapify(self._queue)
+        self._dispatch()
+
+    #SH: Grant queued requests in (priority, virtual finish) order; an organization at its own limits doesn't hold up others,
+    #SH: but the global limits do, so background work can't slip past waiting chat
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        next_check = None
+        granted = []
+        for waiter in sorted(self._queue):
+            if waiter.future.done():
+                granted.append(waiter)
+                continue
+            scopes = self._scopes(waiter.organization_id)
+            blocked = False
+            for scope in scopes:
+                if scope.active >= scope.max_concurrency:
+                    blocked = True
+                    continue
+                delay = max(scope.requests.wait_time(1), scope.tokens.wait_time(waiter.tokens))
+                if delay > 0:
+                    blocked = True
+                    next_check = delay if next_check is None else min(next_check, delay)
+            if blocked:
+                if self._blocks_globally(waiter.tokens):
+                    break
+                continue
+            for scope in scopes:
+                scope.requests.try_acquire(1)
+                scope.tokens.adjust(-min(waiter.tokens, scope.tokens.capacity))
+                scope.active += 1
+            self._virtual_time = max(self._virtual_time, waiter.virtual_start)
+            waiter.future.set_result(True)
+            granted.append(waiter)
+
+        if granted:
+            self._queue = [waiter for waiter in self._queue if waiter not in granted]
+            heapq.heapify(self._queue)
+        # Bucket waits have no event to wake us, so check again once the earliest one has refilled
+        if next_check is not None and self._queue:
+            self._timer = asyncio.get_running_loop().call_later(next_check, self._dispatch)
+
+    def _blocks_globally(self, tokens: float) -> bool:
+        scope = self.global_limits
+        return (
+            scope.active >= scope.max_concurrency
+            or scope.requests.wait_time(1) > 0
+            or scope.tokens.wait_time(tokens) > 0
+        )
+
+    def _release(self, organization_id: Optional[int]):
+        for scope in self._scopes(organization_id):
+            scope.active = max(0, scope.active - 1)
+        if self._queue:
+            self._dispatch()
+
+    def _settle(self, organization_id: Optional[int], unused_tokens: float):
+        for scope in self._scopes(organization_id):
+            scope.tokens.adjust(unused_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        admitted = sum(self.admitted.values())
+        return {
+            "queued": len(self._queue),
+            "active": self.global_limits.active,
+            "admitted": self.admitted,
+            "timeouts": self.timeouts,
+            "avg_queue_wait_ms": round(self.total_wait_ms / admitted, 2) if admitted else 0.0,
+            "max_queue_wait_ms": round(self.max_wait_ms, 2),
+            "organizations": {
+                org_id: {"active": limits.active, "queued": sum(1 for w in self._queue if w.organization_id == org_id)}
+                for org_id, limits in self.orgs.items() if limits.active or any(w.organization_id == org_id for w in self._queue)
+            }
+        }
+
+#SH: The one retry policy for LLM calls: capped attempts, jittered backoff that honours Retry-After, and a retry budget
+class RetryPolicy:
+    RETRYABLE = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float, budget_ratio: float, budget_min_per_minute: int):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        # Every first attempt deposits budget_ratio of a retry, so retries stay a fraction of traffic in an outage
+        self.budget = TokenBucket(budget_min_per_minute, capacity=max(budget_min_per_minute, 1))
+        self.retries = 0
+        self.exhausted = 0
+
+    def record_attempt(self):
+        self.budget.adjust(self.budget_ratio)
+
+    #SH: Seconds to wait before the next attempt, None when the error must be raised
+    def next_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        if not isinstance(error, self.RETRYABLE) or attempt >= self.max_attempts:
+            return None
+        if not self.budget.try_acquire(1):
+            self.exhausted += 1
+            logger.warning("LLM retry budget exhausted, failing fast")
+            return None
+        self.retries += 1
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        retry_after = self._retry_after(error)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        response = getattr(error, "response", None)
+        value = response.headers.get("retry-after") if response is not None else None
+        try:
+            return min(float(value), 60.0) if value is not None else None
+        except ValueError:
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"retries": self.retries, "budget_exhausted": self.exhausted, "budget_available": round(self.budget.tokens, 2)}
+
+# Global instance
+llm_admission = AdmissionController(
+    global_rpm=settings.LLM_GLOBAL_RPM,
+    global_tpm=settings.LLM_GLOBAL_TPM,
+    global_concurrency=settings.LLM_GLOBAL_CONCURRENCY,
+    org_rpm=settings.LLM_ORG_RPM,
+    org_tpm=settings.LLM_ORG_TPM,
+    org_concurrency=settings.LLM_ORG_CONCURRENCY,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+    org_weights=settings.LLM_ORG_WEIGHTS
+)
+
+# Global instance
+llm_retry_policy = RetryPolicy(
+    max_attempts=settings.MAX_RETRIES,
+    base_delay=settings.LLM_RETRY_BASE_DELAY,
+    max_delay=settings.LLM_RETRY_MAX_DELAY,
+    budget_ratio=settings.LLM_RETRY_BUDGET_RATIO,
+    budget_min_per_minute=settings.LLM_RETRY_BUDGET_MIN_PER_MINUTE
+)
@@ -0,0 +1,212 @@
+import time
+import logging
+import importlib.util
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import httpx
+from openai import AsyncOpenAI
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+#SH: Connection pool numbers gathered from httpcore trace events, one event loop so no locking
+class PoolMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.total_connect_ms = 0.0
+
+    #SH: httpx request hook: attaches a tracer that times how long the request waited for a pooled connection
+    async def on_request(self, request: httpx.Request):
+        started = time.perf_counter()
+        state: Dict[str, Any] = {"acquired": False, "connect_started": None}
+
+        async def trace(event: str, info: dict):
+            now = time.perf_counter()
+            # The pool traces nothing while a request waits, its first event means a connection was handed out
+            if not state["acquired"]:
+                state["acquired"] = True
+                self._record_wait((now - started) * 1000)
+            if event.endswith("connect_tcp.started"):
+                state["connect_started"] = now
+                self.new_connections += 1
+            elif event.endswith("start_tls.complete") or (event.endswith("connect_tcp.complete") and request.url.scheme == "http"):
+                if state["connect_started"] is not None:
+                    self.total_connect_ms += (now - state["connect_started"]) * 1000
+                    state["connect_started"] = None
+
+        request.extensions["trace"] = trace
+        self.requests += 1
+
+    def _record_wait(self, wait_ms: float):
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        reused = self.requests - self.new_connections
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "connection_reuse_percent": round(max(reused, 0) / self.requests * 100, 2) if self.requests else 0.0,
+            "avg_pool_wait_ms": round(self.total_wait_ms / self.requests, 3) if self.requests else 0.0,
+            "max_pool_wait_ms": round(self.max_wait_ms, 3),
+            "avg_connect_ms": round(self.total_connect_ms / self.new_connections, 2) if self.new_connections else 0.0,
+        }
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+#SH: An OpenAI-compatible endpoint and the models it serves; pool and timeout fields left out use the LLM_POOL_* settings
+@dataclass
+class ProviderConfig:
+    name: str
+    base_url: Optional[str] = None  # None is OpenAI (or OPENAI_BASE_URL when set)
+    api_key: Optional[str] = None
+    models: List[str] = field(default_factory=list)
+    max_connections: Optional[int] = None
+    max_keepalive: Optional[int] = None
+    keepalive_expiry: Optional[float] = None
+    timeout: Optional[float] = None
+    pool_timeout: Optional[float] = None
+    http2: Optional[bool] = None
+
+    #SH: OpenAI itself, serving OPENAI_MODELS and any model no other provider lists
+    @classmethod
+    def openai(cls) -> "ProviderConfig":
+        return cls(
+            name=DEFAULT_PROVIDER,
+            base_url=settings.LLM_MOCK_URL,
+            api_key=settings.OPENAI_API_KEY,
+            models=list(settings.OPENAI_MODELS)
+        )
+
+DEFAULT_PROVIDER = "openai"
+
+#SH: One AsyncOpenAI client and keep-alive pool per provider and worker, opened and closed with the app lifespan
+class LLMClientPool:
+    def __init__(self, provider: Optional[ProviderConfig] = None):
+        self.provider = provider or ProviderConfig.openai()
+        self._client: Optional[AsyncOpenAI] = None
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self.http2 = False
+        self.metrics = PoolMetrics()
+
+    def _option(self, name: str, default):
+        value = getattr(self.provider, name)
+        return default if value is None else value
+
+    def _build(self) -> AsyncOpenAI:
+        wanted_http2 = self._option("http2", settings.LLM_HTTP2)
+        self.http2 = wanted_http2 and http2_available()
+        if wanted_http2 and not self.http2:
+            logger.info(f"h2 is not installed, {self.provider.name} connections use HTTP/1.1")
+        # openai sends its timeout with every request, so the pool timeout has to be part of it
+        timeout = httpx.Timeout(
+            self._option("timeout", settings.REQUEST_TIMEOUT),
+            pool=self._option("pool_timeout", settings.LLM_POOL_TIMEOUT)
+        )
+        self._http_client = httpx.AsyncClient(
+            http2=self.http2,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self._option("max_keepalive", settings.LLM_POOL_MAX_KEEPALIVE),
+                keepalive_expiry=self._option("keepalive_expiry", settings.LLM_POOL_KEEPALIVE_EXPIRY)
+            ),
+            event_hooks={"request": [self.metrics.on_request]}
+        )
+        return AsyncOpenAI(
+            # Self-hosted servers often ignore the key, the SDK still insists on one
+            api_key=self.provider.api_key or "unused",
+            base_url=self.provider.base_url,
+            timeout=timeout,
+            # Retries happen in OpenAIClient, where each attempt goes back through admission control
+            max_retries=0,
+            http_client=self._http_client
+        )
+
+    @property
+    def max_connections(self) -> int:
+        return self._option("max_connections", settings.LLM_POOL_MAX_CONNECTIONS)
+
+    #SH: Built on first use too, so scripts and tests work without the app lifespan
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            self._client = self._build()
+        return self._client
+
+    async def start(self):
+        self.client
+        logger.info(f"LLM client pool for {self.provider.name} ready (http2={self.http2}, max_connections={self.max_connections})")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+        self._client = self._http_client = None
+
+    def stats(self) -> Dict[str, Any]:
+        pool = getattr(getattr(self._http_client, "_transport", None), "_pool", None)
+        return {
+            "base_url": str(self._client.base_url) if self._client is not None else self.provider.base_url,
+            "models": self.provider.models,
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "max_keepalive_connections": self._option("max_keepalive", settings.LLM_POOL_MAX_KEEPALIVE),
+            "open_connections": len(pool.connections) if pool is not None else 0,
+            **self.metrics.stats()
+        }
+
+#SH: Maps model names to the provider serving them, each with its own pooled client
+class ProviderRegistry:
+    def __init__(self, providers: List[ProviderConfig]):
+        self.pools: Dict[str, LLMClientPool] = {provider.name: LLMClientPool(provider) for provider in providers}
+        if DEFAULT_PROVIDER not in self.pools:
+            self.pools[DEFAULT_PROVIDER] = LLMClientPool()
+        self._by_model: Dict[str, str] = {}
+        for provider in providers:
+            for model in provider.models:
+                if model in self._by_model and self._by_model[model] != provider.name:
+                    raise ValueError(f"Model {model} is listed by both {self._by_model[model]} and {provider.name}")
+                self._by_model[model] = provider.name
+        for model in self.pools[DEFAULT_PROVIDER].provider.models:
+            self._by_model.setdefault(model, DEFAULT_PROVIDER)
+
+    @classmethod
+    def from_settings(cls) -> "ProviderRegistry":
+        providers = [ProviderConfig.openai()] + [
+            ProviderConfig(name=name, **options) for name, options in settings.LLM_PROVIDERS.items()
+        ]
+        if settings.LLM_MOCK_URL:
+            logger.warning(f"LLM_MOCK_URL is set, every LLM provider is served by the mock at {settings.LLM_MOCK_URL}")
+            for provider in providers:
+                provider.base_url = settings.LLM_MOCK_URL
+        return cls(providers)
+
+    def models(self) -> List[str]:
+        return sorted(self._by_model)
+
+    def provider_for(self, model: str) -> str:
+        return self._by_model.get(model, DEFAULT_PROVIDER)
+
+    def pool(self, model: str) -> LLMClientPool:
+        return self.pools[self.provider_for(model)]
+
+    def client(self, model: str) -> AsyncOpenAI:
+        return self.pool(model).client
+
+    async def start(self):
+        for pool in self.pools.values():
+            await pool.start()
+
+    async def close(self):
+        for pool in self.pools.values():
+            await pool.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+# Global instance
+llm_providers = ProviderRegistry.from_settings()
@@ -0,0 +1,230 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+import numpy as np
+import openai
+from app.core.config import settings
+from app.core.llm_admission import AdmissionTimeout
+
+logger = logging.getLogger(__name__)
+
+#SH: Which route served a message, recorded with its metrics
+PRIMARY = "primary"
+FALLBACK = "fallback"  # primary failed, the fallback model answered
+CIRCUIT_OPEN = "circuit_open"  # primary skipped while its circuit is open
+HEDGE_PRIMARY = "hedge_primary"  # hedge fired but the primary answered first
+HEDGE_FALLBACK = "hedge_fallback"  # hedge fired and the fallback answered first
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+#SH: Raised when a stream fails after part of the answer was already forwarded to the client, no other model can take over then
+class StreamInterrupted(Exception):
+    pass
+
+#SH: Errors that say something about the model's provider; bad requests, bad keys and our own queue timeouts don't
+#SH: OpenAIClient maps provider errors to HTTP exceptions, so the original is looked for down the exception chain
+def is_model_failure(error: Optional[BaseException]) -> bool:
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, AdmissionTimeout):
+            return False
+        if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code >= 500
+        error = error.__cause__ or error.__context__
+    return False
+
+#SH: Router arguments for an agent: FALLBACK_MODEL only when the agent allows fallback, hedging per agent or server default
+def route_options(agent) -> Dict[str, Any]:
+    hedge = (agent.config or {}).get("hedge")
+    return {
+        "fallback_model": settings.FALLBACK_MODEL if agent.enable_fallback is not False else None,
+        "hedge": settings.ROUTER_HEDGE_ENABLED if hedge is None else bool(hedge),
+    }
+
+#SH: Rolling outcomes of one model's calls and the circuit breaker built on them
+class ModelHealth:
+    def __init__(self, window: int, min_samples: int, error_threshold: float, open_seconds: float):
+        self.min_samples = min_samples
+        self.error_threshold = error_threshold
+        self.open_seconds = open_seconds
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        # Whole-completion latencies only, streams finish at the model's pace so they'd skew the deadline
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.trips = 0
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def p95_ms(self) -> Optional[float]:
+        if len(self.latencies) < self.min_samples:
+            return None
+        return float(np.percentile(np.fromiter(self.latencies, dtype=np.float64), 95))
+
+    #SH: Closed lets everything through; open lets nothing through until it cools down, then exactly one probe
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record(self, ok: bool, latency_ms: Optional[float] = None):
+        self.outcomes.append(ok)
+        if ok and latency_ms is not None:
+            self.latencies.append(latency_ms)
+        if self.state == HALF_OPEN and self.probing:
+            self.probing = False
+            if ok:
+                self.state = CLOSED
+                self.outcomes.clear()
+            else:
+                self._trip()
+        elif self.state == CLOSED and len(self.outcomes) >= self.min_samples and self.error_rate() >= self.error_threshold:
+            self._trip()
+
+    def _trip(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.trips += 1
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.p95_ms()
+        return {
+            "state": self.state,
+            "samples": len(self.outcomes),
+            "error_rate_percent": round(self.error_rate() * 100, 2),
+            "p95_ms": round(p95, 2) if p95 is not None else None,
+            "trips": self.trips,
+        }
+
+#SH: Sends a completion to the agent's model or its fallback, by circuit state, failures and a p95 hedge deadline
+class ModelRouter:
+    def __init__(
+        self,
+        window: int,
+        min_samples: int,
+        error_threshold: float,
+        open_seconds: float,
+        hedge_multiplier: float,
+        hedge_min_ms: float
+    ):
+        self.window = window
+        self.min_samples = min_samples
+        self.error_threshold = error_threshold
+        self.open_seconds = open_seconds
+        self.hedge_multiplier = hedge_multiplier
+        self.hedge_min_ms = hedge_min_ms
+        self.models: Dict[str, ModelHealth] = {}
+        self.routes: Dict[str, int] = {}
+
+    def health(self, model: str) -> ModelHealth:
+        if model not in self.models:
+            self.models[model] = ModelHealth(self.window, self.min_samples, self.error_threshold, self.open_seconds)
+        return self.models[model]
+
+    #SH: Seconds to give the primary before hedging, None until there are enough samples for a p95
+    def hedge_deadline(self, model: str) -> Optional[float]:
+        p95 = self.health(model).p95_ms()
+        if p95 is None:
+            return None
+        return max(p95 * self.hedge_multiplier, self.hedge_min_ms) / 1000
+
+    async def _timed(self, model: str, call: Callable[[str], Awaitable[dict]], latency: bool = True) -> dict:
+        started = time.perf_counter()
+        try:
+            response = await call(model)
+        except asyncio.CancelledError:
+            self.health(model).probing = False
+            raise
+        except Exception as e:
+            if is_model_failure(e):
+                self.health(model).record(False)
+            else:
+                # Not the model's fault, but a half-open probe has to come back either way
+                self.health(model).probing = False
+            raise
+        self.health(model).record(True, (time.perf_counter() - started) * 1000 if latency else None)
+        return response
+
+    def _served(self, response: dict, route: str) -> dict:
+        self.routes[route] = self.routes.get(route, 0) + 1
+        response["route"] = route
+        return response
+
+    #SH: `call(model)` runs the completion on a model. Streams pass hedge=False: once deltas flow the answer can't switch models.
+    async def route(
+        self,
+        call: Callable[[str], Awaitable[dict]],
+        model: str,
+        fallback_model: Optional[str],
+        hedge: bool = False,
+        streaming: bool = False
+    ) -> dict:
+        if not fallback_model or fallback_model == model:
+            return self._served(await self._timed(model, call, not streaming), PRIMARY)
+
+        if not self.health(model).allow():
+            return self._served(await self._timed(fallback_model, call, not streaming), CIRCUIT_OPEN)
+
+        deadline = self.hedge_deadline(model) if hedge and not streaming else None
+        primary = asyncio.ensure_future(self._timed(model, call, not streaming))
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=deadline)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if done:
+            try:
+                return self._served(primary.result(), PRIMARY)
+            except Exception as e:
+                if isinstance(e, StreamInterrupted) or not is_model_failure(e):
+                    raise
+                logger.warning(f"Model {model} failed ({e}), answering with {fallback_model}")
+                return self._served(await self._timed(fallback_model, call, not streaming), FALLBACK)
+
+        logger.info(f"Model {model} passed its {deadline * 1000:.0f}ms hedge deadline, also asking {fallback_model}")
+        return await self._race(primary, asyncio.ensure_future(self._timed(fallback_model, call)))
+
+    #SH: First successful answer wins and the other call is cancelled, both failing raises the primary's error
+    async def _race(self, primary: asyncio.Future, hedge: asyncio.Future) -> dict:
+        routes = {primary: HEDGE_PRIMARY, hedge: HEDGE_FALLBACK}
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return self._served(task.result(), routes[task])
+            raise primary.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "routes": dict(self.routes),
+            "models": {model: health.stats() for model, health in self.models.items()},
+        }
+
+# Global instance
+model_router = ModelRouter(
+    window=settings.ROUTER_WINDOW,
+    min_samples=settings.ROUTER_MIN_SAMPLES,
+    error_threshold=settings.ROUTER_ERROR_THRESHOLD,
+    open_seconds=settings.ROUTER_OPEN_SECONDS,
+    hedge_multiplier=settings.ROUTER_HEDGE_MULTIPLIER,
+    hedge_min_ms=settings.ROUTER_HEDGE_MIN_MS
+)
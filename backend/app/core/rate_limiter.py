@@ -0,0 +1,47 @@
+import time
+import asyncio
+from typing import Optional
+
+#SH: Token bucket refilled continuously at `rate_per_minute`, callers wait until enough budget is available
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, amount: float) -> bool:
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    #SH: Seconds until `amount` tokens are available, 0 when they already are
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    #SH: Settle an estimate: give back what was not used, or take the overrun (the bucket may go into debt)
+    def adjust(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    async def acquire(self, amount: float) -> float:
+        """Wait for `amount` tokens, returns the seconds spent waiting"""
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        async with self._lock:
+            while not self.try_acquire(amount):
+                delay = (amount - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+        return waited
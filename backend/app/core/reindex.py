@@ -0,0 +1,306 @@
+import os
+import time
+import shutil
+import asyncio
+import logging
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional, Set
+from app.core.config import settings
+from app.core.embeddings import REMOTE_PROVIDERS, resolve_embedding_config
+from app.core.rate_limiter import TokenBucket
+from app.core.tokenizer import count_tokens
+from app.core.vector_store import (
+    get_generation_embedding_function,
+    get_index_dir,
+    get_organization_dir,
+    get_organization_vector_store,
+    load_manifest,
+    open_index,
+    save_manifest
+)
+
+logger = logging.getLogger(__name__)
+
+LOCK_FILE = "reindex.lock"
+GENERATION_PREFIX = "gen-"
+
+@dataclass
+class ReindexJob:
+    organization_id: int
+    provider: str
+    model: str
+    path: str
+    dimensions: Optional[int] = None
+    status: str = "building"
+    total: int = 0
+    done: int = 0
+    tokens: int = 0
+    throttled_seconds: float = 0.0
+    started_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    error: Optional[str] = None
+
+    def progress(self) -> dict:
+        elapsed = max(self.updated_at - self.started_at, 1e-6)
+        rate = self.done / elapsed
+        remaining = max(self.total - self.done, 0)
+        return {
+            **asdict(self),
+            "percent": round(100 * self.done / self.total, 1) if self.total else 100.0,
+            "chunks_per_second": round(rate, 2),
+            "eta_seconds": round(remaining / rate) if rate else None
+        }
+
+def _next_generation(manifest: dict) -> str:
+    numbers = []
+    for generation in (manifest.get("active"), manifest.get("previous"), manifest.get("building")):
+        path = (generation or {}).get("path", "")
+        if path.startswith(GENERATION_PREFIX) and path[len(GENERATION_PREFIX):].isdigit():
+            numbers.append(int(path[len(GENERATION_PREFIX):]))
+    return f"{GENERATION_PREFIX}{max(numbers, default=0) + 1}"
+
+#SH: Vectors are comparable when provider, model and output dimensions match, the in-process dtype does not matter
+def _same_space(generation: Optional[dict], config: dict) -> bool:
+    generation = generation or {}
+    return (
+        generation.get("provider", "openai") == config["provider"]
+        and generation.get("model") == config["model"]
+        and generation.get("dimensions") == config.get("dimensions")
+    )
+
+#SH: Delete an index generation that no longer serves reads
+def remove_generation(organization_id: int, generation: dict) -> None:
+    org_dir = get_organization_dir(organization_id)
+    index_dir = get_index_dir(organization_id, generation)
+    if index_dir != os.path.normpath(org_dir):
+        shutil.rmtree(index_dir, ignore_errors=True)
+        return
+    # A legacy index shares the org directory with the manifest and newer generations
+    for name in os.listdir(org_dir):
+        path = os.path.join(org_dir, name)
+        if name.startswith(GENERATION_PREFIX) or name in (LOCK_FILE, "manifest.json"):
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif name.startswith("chroma.sqlite3") or name == "maintenance.json":
+            os.remove(path)
+
+class ReindexManager:
+    """Re-embeds organization indexes into a shadow generation and swaps it in once complete"""
+
+    def __init__(self, batch_size: int, tokens_per_minute: int):
+        self.batch_size = batch_size
+        self.limiter = TokenBucket(tokens_per_minute)
+        self.jobs: Dict[int, ReindexJob] = {}
+        self.tasks: Dict[int, asyncio.Task] = {}
+
+    #SH: Organizations whose active index was built with another provider/model than their embedding config
+    def stale_organizations(self, organization_ids: List[int], configs: Optional[Dict[int, dict]] = None) -> List[int]:
+        configs = configs or {}
+        return [
+            org_id for org_id in organization_ids
+            if not _same_space(load_manifest(org_id)["active"], resolve_embedding_config(configs.get(org_id)))
+        ]
+
+    def start(self, organization_id: int, config: Optional[dict] = None) -> bool:
+        task = self.tasks.get(organization_id)
+        if task is not None and not task.done():
+            return False
+        self.tasks[organization_id] = asyncio.create_task(
+            self.run(organization_id, resolve_embedding_config(config))
+        )
+        return True
+
+    async def stop(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+    def status(self, organization_id: int, config: Optional[dict] = None) -> dict:
+        manifest = load_manifest(organization_id)
+        job = self.jobs.get(organization_id)
+        target = resolve_embedding_config(config)
+        return {
+            "organization_id": organization_id,
+            "active": manifest["active"],
+            "building": manifest.get("building"),
+            "target": {key: target[key] for key in ("provider", "model", "dimensions", "dtype")},
+            "up_to_date": _same_space(manifest["active"], target),
+            # Jobs started by this worker, other workers only show up through the manifest
+            "job": job.progress() if job else None
+        }
+
+    #SH: Only one worker may build an organization's shadow index, the lock goes stale with the heartbeat
+    def _claim(self, organization_id: int) -> bool:
+        lock_path = os.path.join(get_organization_dir(organization_id), LOCK_FILE)
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        for _ in range(2):
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                building = load_manifest(organization_id).get("building") or {}
+                heartbeat = building.get("updated_at") or os.path.getmtime(lock_path)
+                if time.time() - heartbeat < settings.REINDEX_STALE_AFTER:
+                    return False
+                logger.warning(f"Breaking stale re-index lock of org {organization_id}")
+                os.remove(lock_path)
+        return False
+
+    def _release(self, organization_id: int):
+        try:
+            os.remove(os.path.join(get_organization_dir(organization_id), LOCK_FILE))
+        except FileNotFoundError:
+            pass
+
+    def _publish(self, job: ReindexJob):
+        job.updated_at = time.time()
+        manifest = load_manifest(job.organization_id)
+        manifest["building"] = {
+            "path": job.path,
+            "provider": job.provider,
+            "model": job.model,
+            "dimensions": job.dimensions,
+            "status": job.status,
+            "total": job.total,
+            "done": job.done,
+            "started_at": job.started_at,
+            "updated_at": job.updated_at
+        }
+        save_manifest(job.organization_id, manifest)
+
+    #SH: Embed source chunks missing from the target, optionally dropping target chunks deleted from the source
+    async def _sync(self, job: ReindexJob, source, target, embedder, delete_extras: bool) -> int:
+        target_ids: Set[str] = set((await asyncio.to_thread(target.get, include=[]))["ids"])
+        source_ids: Set[str] = set()
+        job.total = await asyncio.to_thread(source.count)
+        changed = 0
+        offset = 0
+        while True:
+            page = await asyncio.to_thread(
+                source.get, include=["documents", "metadatas"], limit=self.batch_size, offset=offset
+            )
+            ids = page["ids"]
+            source_ids.update(ids)
+            rows = [i for i, record_id in enumerate(ids) if record_id not in target_ids]
+            if rows:
+                texts = [page["documents"][i] for i in rows]
+                tokens = sum(count_tokens(text, job.model) for text in texts)
+                if job.provider in REMOTE_PROVIDERS:
+                    job.throttled_seconds += await self.limiter.acquire(tokens)
+                vectors = await asyncio.to_thread(embedder.embed_documents, texts)
+                await asyncio.to_thread(
+                    target.add,
+                    ids=[ids[i] for i in rows],
+                    embeddings=vectors,
+                    documents=texts,
+                    metadatas=[page["metadatas"][i] for i in rows]
+                )
+                target_ids.update(ids[i] for i in rows)
+                job.tokens += tokens
+                changed += len(rows)
+            job.done = len(target_ids & source_ids) if delete_extras else job.done + len(rows)
+            if job.status == "building":
+                self._publish(job)
+            if len(ids) < self.batch_size:
+                break
+            offset += self.batch_size
+
+        if delete_extras:
+            extras = list(target_ids - source_ids)
+            for start in range(0, len(extras), self.batch_size):
+                await asyncio.to_thread(target.delete, ids=extras[start:start + self.batch_size])
+            changed += len(extras)
+            job.done = len(source_ids)
+        return changed
+
+    async def run(self, organization_id: int, config: dict):
+        if not self._claim(organization_id):
+            logger.info(f"Re-index of org {organization_id} is already running elsewhere")
+            return
+        try:
+            config = resolve_embedding_config(config)
+            manifest = load_manifest(organization_id)
+            if _same_space(manifest["active"], config):
+                # Only the storage dtype changed, the index itself can stay
+                if manifest["active"].get("dtype") != config["dtype"]:
+                    manifest["active"]["dtype"] = config["dtype"]
+                    save_manifest(organization_id, manifest)
+                return
+            # Retire a generation left behind by an earlier swap before making a new one
+            if manifest.get("previous"):
+                remove_generation(organization_id, manifest["previous"])
+                manifest["previous"] = None
+                save_manifest(organization_id, manifest)
+
+            building = manifest.get("building") or {}
+            # Resume a build into the same vector space, its chunks are skipped by the sync
+            path = building["path"] if _same_space(building, config) else _next_generation(manifest)
+            generation = {key: config[key] for key in ("provider", "model", "dimensions", "dtype")}
+            generation["path"] = path
+            # The new generation keeps the shard layout, a large index stays parallel after the swap
+            for key in ("shards", "shard_by"):
+                if manifest["active"].get(key):
+                    generation[key] = manifest["active"][key]
+            job = ReindexJob(
+                organization_id=organization_id,
+                provider=config["provider"],
+                model=config["model"],
+                path=path,
+                dimensions=config["dimensions"]
+            )
+            self.jobs[organization_id] = job
+            logger.info(f"Re-indexing org {organization_id} into {path} with {config['provider']}/{config['model']}")
+
+            source_store = get_organization_vector_store(organization_id)
+            embedder = get_generation_embedding_function(generation)
+            target_store = open_index(organization_id, generation)
+            source, target = source_store._collection, target_store._collection
+
+            await self._sync(job, source, target, embedder, delete_extras=True)
+            # Catch up with chunks ingested or deleted while the first pass ran
+            for _ in range(3):
+                if not await self._sync(job, source, target, embedder, delete_extras=True):
+                    break
+
+            manifest = load_manifest(organization_id)
+            previous = manifest["active"]
+            manifest["active"] = {**generation, "created_at": time.time()}
+            manifest["previous"] = previous
+            manifest["building"] = None
+            save_manifest(organization_id, manifest)
+            job.status = "swapped"
+            # Writes that raced the swap landed in the old index, copy them over (never delete here)
+            await self._sync(job, source, target, embedder, delete_extras=False)
+
+            job.status = "completed"
+            job.updated_at = time.time()
+            logger.info(f"Swapped org {organization_id} to re-embedded index {path}: {job.progress()}")
+            asyncio.create_task(self._retire(organization_id, previous))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job = self.jobs.get(organization_id)
+            if job is not None:
+                job.status = "failed"
+                job.error = str(e)
+                self._publish(job)
+            logger.error(f"Re-index of org {organization_id} failed: {e}", exc_info=True)
+        finally:
+            self._release(organization_id)
+
+    #SH: Give requests that opened the old index time to finish before deleting it
+    async def _retire(self, organization_id: int, generation: dict):
+        await asyncio.sleep(settings.REINDEX_RETIRE_DELAY)
+        manifest = load_manifest(organization_id)
+        if manifest.get("previous") != generation:
+            return
+        await asyncio.to_thread(remove_generation, organization_id, generation)
+        manifest["previous"] = None
+        save_manifest(organization_id, manifest)
+        logger.info(f"Removed retired index {generation['path']} of org {organization_id}")
+
+# Global instance
+reindex_manager = ReindexManager(
+    batch_size=settings.REINDEX_BATCH_SIZE,
+    tokens_per_minute=settings.REINDEX_TOKENS_PER_MINUTE
+)
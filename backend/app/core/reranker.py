@@ -0,0 +1,129 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+#SH: Cross-encoder exported to ONNX, reads query and passage together and returns one relevance logit per pair
+class OnnxCrossEncoder:
+
+    def __init__(self, session, tokenizer, model: str, batch_size: int = 16, threads: int = 2, max_length: int = 512):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.model = model
+        self.batch_size = batch_size
+        self.input_names = {node.name for node in session.get_inputs()}
+        self.tokenizer.enable_truncation(max_length=max_length)
+        if self.tokenizer.padding is None:
+            self.tokenizer.enable_padding()
+        # onnxruntime releases the GIL while it runs, so batches really execute in parallel
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="reranker")
+
+    @classmethod
+    def from_directory(cls, model: str, model_dir: str, quantized: bool = True, **kwargs) -> "OnnxCrossEncoder":
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise RuntimeError("The reranker needs onnxruntime and tokenizers installed") from e
+
+        path = os.path.join(model_dir, model)
+        model_file = os.path.join(path, "model_quantized.onnx")
+        if not (quantized and os.path.exists(model_file)):
+            model_file = os.path.join(path, "model.onnx")
+        if not os.path.exists(model_file):
+            raise RuntimeError(f"No ONNX model found for reranker model {model} in {path}")
+
+        options = ort.SessionOptions()
+        # Parallelism comes from running batches on our pool, not from threads inside one run
+        options.intra_op_num_threads = 1
+        session = ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        logger.info(f"Loaded reranker model {model} from {model_file}")
+        return cls(session, tokenizer, model, **kwargs)
+
+    def _score_batch(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(pairs)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        feeds = {
+            "input_ids": input_ids,
+            "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        }
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        logits = self.session.run(None, feeds)[0]
+        # Single-logit models score relevance directly, two-class models put it in the second column
+        return logits[:, -1] if logits.ndim == 2 else logits
+
+    def score(self, query: str, passages: List[str]) -> np.ndarray:
+        if not passages:
+            return np.zeros(0, dtype=np.float32)
+        pairs = [(query, passage) for passage in passages]
+        batches = [pairs[i:i + self.batch_size] for i in range(0, len(pairs), self.batch_size)]
+        return np.concatenate(list(self.executor.map(self._score_batch, batches)))
+
+#SH: Re-scores a wide candidate set so only the few best chunks reach the prompt
+class Reranker:
+
+    def __init__(self, model: Optional[str], cross_encoder: Optional[Any] = None):
+        self.model = model
+        self._cross_encoder = cross_encoder
+        self._load_failed = cross_encoder is None and not model
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.pairs = 0
+        self.total_ms = 0.0
+
+    #SH: Loaded once per process on first use, a missing model disables reranking instead of failing chats
+    def _encoder(self):
+        if self._cross_encoder is None and not self._load_failed:
+            with self._lock:
+                if self._cross_encoder is None and not self._load_failed:
+                    try:
+                        self._cross_encoder = OnnxCrossEncoder.from_directory(
+                            self.model,
+                            settings.RERANK_MODEL_DIR,
+                            quantized=settings.LOCAL_EMBEDDING_QUANTIZED,
+                            batch_size=settings.RERANK_BATCH_SIZE,
+                            threads=settings.RERANK_THREADS,
+                            max_length=settings.RERANK_MAX_LENGTH
+                        )
+                    except Exception as e:
+                        self._load_failed = True
+                        logger.warning(f"Reranker model {self.model} unavailable, reranking disabled: {e}")
+        return self._cross_encoder
+
+    #SH: Top n of the candidates by cross-encoder score, scores mapped to 0-1 like retrieval relevance
+    def rerank(self, query: str, scored_docs: List[Tuple[Any, float]], top_n: int) -> Optional[List[Tuple[Any, float]]]:
+        encoder = self._encoder()
+        if encoder is None:
+            return None
+        if not scored_docs:
+            return []
+        started = time.perf_counter()
+        logits = np.asarray(encoder.score(query, [doc.page_content for doc, _ in scored_docs]), dtype=np.float32)
+        relevance = 1 / (1 + np.exp(-logits))
+        order = np.argsort(-relevance, kind="stable")[:top_n]
+        self.runs += 1
+        self.pairs += len(scored_docs)
+        self.total_ms += (time.perf_counter() - started) * 1000
+        return [(scored_docs[i][0], float(relevance[i])) for i in order]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "loaded": self._cross_encoder is not None,
+            "disabled": self._load_failed,
+            "runs": self.runs,
+            "pairs_scored": self.pairs,
+            "avg_pairs_per_run": round(self.pairs / self.runs, 1) if self.runs else 0.0,
+            "avg_rerank_ms": round(self.total_ms / self.runs, 2) if self.runs else 0.0,
+        }
+
+# Global instance
+reranker = Reranker(model=settings.RERANK_MODEL)
@@ -0,0 +1,128 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import numpy as np
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+#SH: Hash of everything in the agent that can change the answer to the same question
+def agent_config_hash(agent) -> str:
+    payload = {
+        "config": agent.config or {},
+        "system_prompt": agent.system_prompt,
+        "personality_traits": agent.personality_traits,
+        "custom_prompt": agent.custom_prompt,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+@dataclass
+class CachedResponse:
+    content: str
+    model: Optional[str]
+    tokens_used: int
+    cost: float
+    response_time_ms: float
+    sources: List[str]
+    created_at: float = field(default_factory=time.monotonic)
+
+@dataclass
+class _AgentNamespace:
+    config_hash: str
+    knowledge_version: str
+    vectors: Optional[np.ndarray] = None
+    entries: List[CachedResponse] = field(default_factory=list)
+
+#SH: Per-agent cache that answers a question when a semantically close one was already answered
+class SemanticResponseCache:
+    def __init__(self, threshold: float, ttl: float, max_entries: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._namespaces: Dict[int, _AgentNamespace] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def _namespace(self, agent_id: int, config_hash: str, knowledge_version: str) -> _AgentNamespace:
+        namespace = self._namespaces.get(agent_id)
+        if namespace is None or namespace.config_hash != config_hash or namespace.knowledge_version != knowledge_version:
+            if namespace is not None:
+                self.invalidations += 1
+                logger.info(f"Response cache for agent {agent_id} invalidated (config or knowledge changed)")
+            namespace = _AgentNamespace(config_hash=config_hash, knowledge_version=knowledge_version)
+            self._namespaces[agent_id] = namespace
+        return namespace
+
+    def _expire(self, namespace: _AgentNamespace):
+        cutoff = time.monotonic() - self.ttl
+        keep = [i for i, entry in enumerate(namespace.entries) if entry.created_at >= cutoff]
+        if len(keep) != len(namespace.entries):
+            namespace.entries = [namespace.entries[i] for i in keep]
+            namespace.vectors = namespace.vectors[keep] if keep else None
+
+    def lookup(self, agent_id: int, config_hash: str, knowledge_version: str, embedding) -> Optional[CachedResponse]:
+        query = self._normalize(embedding)
+        with self._lock:
+            namespace = self._namespace(agent_id, config_hash, knowledge_version)
+            self._expire(namespace)
+            if namespace.vectors is None:
+                self.misses += 1
+                return None
+            scores = namespace.vectors @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return namespace.entries[best]
+
+    def store(self, agent_id: int, config_hash: str, knowledge_version: str, embedding, response: CachedResponse):
+        vector = self._normalize(embedding)[np.newaxis, :]
+        with self._lock:
+            namespace = self._namespace(agent_id, config_hash, knowledge_version)
+            if namespace.vectors is None:
+                namespace.vectors = vector
+            else:
+                namespace.vectors = np.vstack([namespace.vectors, vector])
+            namespace.entries.append(response)
+            # Oldest entries go first once the agent is over its budget
+            overflow = len(namespace.entries) - self.max_entries
+            if overflow > 0:
+                namespace.entries = namespace.entries[overflow:]
+                namespace.vectors = namespace.vectors[overflow:]
+
+    def invalidate(self, agent_id: int):
+        with self._lock:
+            if self._namespaces.pop(agent_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "agents": len(self._namespaces),
+            "entries": sum(len(n.entries) for n in self._namespaces.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate_percent": round(self.hits / total * 100, 2) if total else 0.0,
+            "similarity_threshold": self.threshold,
+        }
+
+# Global instance
+response_cache = SemanticResponseCache(
+    threshold=settings.RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+    ttl=settings.RESPONSE_CACHE_TTL,
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES
+)
@@ -0,0 +1,265 @@
+import os
+import math
+import heapq
+import uuid
+import zlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain_community.vectorstores import Chroma
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SHARD_STRATEGIES = ("hash", "knowledge_base")
+DEFAULT_COLLECTION = "langchain"
+
+#SH: Shard 0 keeps langchain's default collection name, so an unsharded index already is its first shard
+def shard_collection_name(index: int) -> str:
+    return DEFAULT_COLLECTION if index == 0 else f"{DEFAULT_COLLECTION}_shard_{index}"
+
+#SH: Stable placement (crc32, not hash()) so every worker routes a chunk to the same shard
+def shard_for(record_id: str, metadata: Optional[dict], shards: int, shard_by: str) -> int:
+    knowledge_id = (metadata or {}).get("knowledge_id")
+    key = str(knowledge_id) if shard_by == "knowledge_base" and knowledge_id is not None else record_id
+    return zlib.crc32(key.encode()) % shards
+
+#SH: Shard count for an index of this size, growth doubles it so a rebalance moves about half the chunks
+def plan_shards(vector_count: int, current: int = 1) -> int:
+    needed = math.ceil(vector_count / settings.VECTOR_SHARD_MAX_SIZE) if vector_count else 1
+    shards = max(current, 1)
+    while shards < needed:
+        shards *= 2
+    return min(shards, settings.VECTOR_MAX_SHARDS)
+
+#SH: Nearest chunks of one collection as (distance, id, document), documents carry their Chroma id
+def search_collection(collection, embedding: List[float], k: int, filter: Optional[dict] = None) -> List[Tuple[float, str, Document]]:
+    size = collection.count()
+    if size == 0:
+        return []
+    results = collection.query(
+        query_embeddings=[embedding],
+        n_results=min(k, size),
+        where=filter,
+        include=["documents", "metadatas", "distances"]
+    )
+    return [
+        (distance, record_id, Document(id=record_id, page_content=document, metadata=metadata or {}))
+        for record_id, document, metadata, distance in zip(
+            results["ids"][0], results["documents"][0], results["metadatas"][0], results["distances"][0]
+        )
+    ]
+
+#SH: The Chroma collection API over every shard, for maintenance and re-index code that pages through an index
+class ShardedCollection:
+
+    def __init__(self, collections: List[Any], shards: int, shard_by: str):
+        self.collections = collections
+        self.shards = shards
+        self.shard_by = shard_by
+
+    def count(self) -> int:
+        return sum(collection.count() for collection in self.collections)
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[dict] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        include = ["metadatas", "documents"] if include is None else include
+        merged: Dict[str, Any] = {"ids": [], **{field: [] for field in include}}
+        skip, remaining = offset or 0, limit
+        # Shards are read back to back, so limit/offset paging sees one stable order
+        for collection in self.collections:
+            if remaining is not None and remaining <= 0:
+                break
+            if limit is not None or offset:
+                size = collection.count()
+                if skip >= size:
+                    skip -= size
+                    continue
+            page = collection.get(ids=ids, where=where, limit=remaining, offset=skip or None, include=include)
+            skip = 0
+            merged["ids"].extend(page["ids"])
+            for field in include:
+                values = page.get(field)
+                merged[field].extend(list(values) if values is not None else [None] * len(page["ids"]))
+            if remaining is not None:
+                remaining -= len(page["ids"])
+        return merged
+
+    def add(self, ids: List[str], embeddings=None, documents=None, metadatas=None) -> None:
+        groups: Dict[int, List[int]] = {}
+        for i, record_id in enumerate(ids):
+            metadata = metadatas[i] if metadatas else None
+            groups.setdefault(shard_for(record_id, metadata, self.shards, self.shard_by), []).append(i)
+        for shard, rows in groups.items():
+            self.collections[shard].upsert(
+                ids=[ids[i] for i in rows],
+                embeddings=[embeddings[i] for i in rows] if embeddings is not None else None,
+                documents=[documents[i] for i in rows] if documents is not None else None,
+                metadatas=[metadatas[i] for i in rows] if metadatas else None
+            )
+
+    upsert = add
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[dict] = None) -> None:
+        # Chunks may sit in their old shard while a rebalance runs, so deletes go everywhere
+        for collection in self.collections:
+            collection.delete(ids=ids, where=where)
+
+#SH: One organization index split over several Chroma collections, searched in parallel and merged by distance
+class ShardedVectorStore(VectorStore):
+
+    def __init__(
+        self,
+        shards: List[Chroma],
+        shard_count: int,
+        shard_by: str,
+        executor: ThreadPoolExecutor,
+        rebalancing: bool = False
+    ):
+        self.shards = shards
+        self.shard_count = shard_count
+        self.shard_by = shard_by
+        self.executor = executor
+        self.rebalancing = rebalancing
+        self._collection = ShardedCollection([shard._collection for shard in shards], shard_count, shard_by)
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self.shards[0].embeddings
+
+    def _select_relevance_score_fn(self):
+        return self.shards[0]._select_relevance_score_fn()
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any
+    ) -> List[str]:
+        texts = list(texts)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        # One embedding call for the whole batch, then each shard only stores its part
+        vectors = self.embeddings.embed_documents(texts)
+        self._collection.add(ids=ids, embeddings=vectors, documents=texts, metadatas=metadatas)
+        return ids
+
+    #SH: A knowledge_id filter on an index sharded by knowledge base only has to ask one shard
+    def _route(self, filter: Optional[dict]) -> List[Any]:
+        knowledge_id = (filter or {}).get("knowledge_id")
+        # While a rebalance runs chunks may still sit in their old shard
+        if self.shard_by == "knowledge_base" and isinstance(knowledge_id, (int, str)) and not self.rebalancing:
+            return [self._collection.collections[shard_for("", {"knowledge_id": knowledge_id}, self.shard_count, self.shard_by)]]
+        return self._collection.collections
+
+    def similarity_search_by_vector_with_relevance_scores(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[dict] = None,
+        **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        collections = self._route(filter)
+        if len(collections) == 1:
+            per_shard = [search_collection(collections[0], embedding, k, filter)]
+        else:
+            per_shard = list(self.executor.map(lambda c: search_collection(c, embedding, k, filter), collections))
+
+        # Every shard list is sorted by distance already, merge them lazily and stop at k
+        results, seen = [], set()
+        for distance, record_id, document in heapq.merge(*per_shard, key=lambda item: item[0]):
+            # A chunk being moved by a rebalance can briefly live in two shards
+            if record_id in seen:
+                continue
+            seen.add(record_id)
+            results.append((document, distance))
+            if len(results) == k:
+                break
+        return results
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_relevance_scores(self.embeddings.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    #SH: A new sharded index in persist_directory, chunks are routed to their shard like add_texts does
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        shard_count: int = 1,
+        shard_by: Optional[str] = None,
+        persist_directory: Optional[str] = None,
+        executor: Optional[ThreadPoolExecutor] = None,
+        **kwargs: Any
+    ) -> "ShardedVectorStore":
+        shards = [
+            Chroma(
+                collection_name=shard_collection_name(index),
+                persist_directory=persist_directory,
+                embedding_function=embedding,
+                **kwargs
+            )
+            for index in range(shard_count)
+        ]
+        store = cls(shards, shard_count, shard_by or settings.VECTOR_SHARD_BY, executor or search_pool)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+#SH: Move every chunk to the shard it belongs to under the store's layout, returns how many moved
+def rebalance_shards(store: ShardedVectorStore, page_size: int = 500, heartbeat: Optional[Callable[[], None]] = None) -> int:
+    collection = store._collection
+    moved = 0
+    for index, source in enumerate(collection.collections):
+        # Collect first, deleting while paging would shift the offsets
+        misplaced: Dict[int, List[str]] = {}
+        offset = 0
+        while True:
+            if heartbeat is not None:
+                heartbeat()
+            page = source.get(include=["metadatas"], limit=page_size, offset=offset)
+            for record_id, metadata in zip(page["ids"], page["metadatas"]):
+                target = shard_for(record_id, metadata, collection.shards, collection.shard_by)
+                if target != index:
+                    misplaced.setdefault(target, []).append(record_id)
+            if len(page["ids"]) < page_size:
+                break
+            offset += page_size
+
+        for target, ids in misplaced.items():
+            for start in range(0, len(ids), page_size):
+                if heartbeat is not None:
+                    heartbeat()
+                batch = source.get(ids=ids[start:start + page_size], include=["embeddings", "documents", "metadatas"])
+                # Copy before deleting, a search in between finds the chunk twice and drops one
+                collection.collections[target].upsert(
+                    ids=batch["ids"],
+                    embeddings=batch["embeddings"],
+                    documents=batch["documents"],
+                    metadatas=batch["metadatas"]
+                )
+                source.delete(ids=batch["ids"])
+                moved += len(batch["ids"])
+    return moved
+
+# Global instance
+search_pool = ThreadPoolExecutor(
+    max_workers=settings.VECTOR_SEARCH_WORKERS or os.cpu_count() or 4,
+    thread_name_prefix="shard-search"
+)
@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from app.core.config import settings
+from app.core.response_cache import agent_config_hash
+
+logger = logging.getLogger(__name__)
+
+DeltaCallback = Callable[[str], Awaitable[None]]
+
+#SH: Identical questions to the same agent configuration share a flight, whitespace differences don't count
+def flight_key(agent, message: str, temperature: float) -> Tuple:
+    prompt_hash = hashlib.sha256(" ".join(message.split()).encode()).hexdigest()
+    return (agent.id, agent_config_hash(agent), prompt_hash, temperature)
+
+#SH: Sharing one answer is only right when the agent allows it and sampling isn't meant to make answers differ
+def single_flight_allowed(agent) -> bool:
+    config = agent.config or {}
+    enabled = config.get("single_flight")
+    if enabled is None:
+        enabled = settings.SINGLE_FLIGHT_ENABLED
+    return bool(enabled) and config.get("temperature", 0.7) <= settings.SINGLE_FLIGHT_MAX_TEMPERATURE
+
+class _Flight:
+    def __init__(self):
+        self.parts: List[str] = []
+        self.subscribers: List[DeltaCallback] = []
+        self.followers = 0
+        self.waiters = 0
+        self.task: Optional[asyncio.Task] = None
+
+    #SH: Fan a delta out to everyone on the flight, a subscriber that fails (closed socket) is dropped, not the flight
+    async def publish(self, content: str):
+        self.parts.append(content)
+        for subscriber in list(self.subscribers):
+            try:
+                await subscriber(content)
+            except Exception as e:
+                logger.debug(f"Dropping single-flight subscriber: {e}")
+                if subscriber in self.subscribers:
+                    self.subscribers.remove(subscriber)
+
+#SH: Runs one completion per key at a time; concurrent identical requests wait on it instead of starting their own
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.abandoned = 0
+
+    #SH: Returns (result, shared). `work` gets the delta callback to stream to, or None when the leader isn't streaming.
+    #SH: The work runs in its own task, a leader that disconnects doesn't take its followers' answer with it;
+    #SH: once the last waiter is cancelled nobody can use the answer, so the work is cancelled too.
+    async def do(
+        self,
+        key: Hashable,
+        work: Callable[[Optional[DeltaCallback]], Awaitable[Any]],
+        on_delta: Optional[DeltaCallback] = None
+    ) -> Tuple[Any, bool]:
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, work, on_delta is not None))
+            # Mark a failure retrieved even when every waiter has gone
+            flight.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            self.leaders += 1
+        else:
+            flight.followers += 1
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            if on_delta is not None:
+                # Catch up on what was already streamed, then follow live; no await between the last replay and subscribing
+                sent = 0
+                while sent < len(flight.parts):
+                    await on_delta(flight.parts[sent])
+                    sent += 1
+                flight.subscribers.append(on_delta)
+            return await asyncio.shield(flight.task), shared
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+                self.abandoned += 1
+                # Let the work unwind (close its stream, settle its tokens) before the caller accounts for it
+                await asyncio.wait({flight.task})
+            raise
+        finally:
+            flight.waiters -= 1
+            if on_delta in flight.subscribers:
+                flight.subscribers.remove(on_delta)
+
+    #SH: Whether a flight for the key is still running, e.g. one a cancelled leader left to its followers
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._flights
+
+    async def _run(self, key: Hashable, flight: _Flight, work, stream: bool):
+        try:
+            return await work(flight.publish if stream else None)
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            # Later requests start a fresh flight, finished answers are the response cache's job
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "abandoned": self.abandoned,
+            "coalesced_percent": round(self.coalesced / total * 100, 2) if total else 0.0,
+        }
+
+# Global instance
+single_flight = SingleFlight()
@@ -0,0 +1,112 @@
+import logging
+from dataclasses import dataclass
+from typing import Tuple
+from functools import lru_cache
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+#SH: Context window (prompt + completion tokens) of the models agents can use
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+#SH: Tokens the chat format adds around every message, and once to prime the reply
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+#SH: What RAG prompts put in front of the user's message, "Context: ...\n\nQuestion: <message>"
+QUESTION_MARKERS = ("\n\nQuestion:", "\n\nVisitor:")
+
+#SH: Rough stand-in (about 4 characters per token) for hosts that cannot download tiktoken files
+class ApproximateEncoding:
+    name = "approximate"
+    chars_per_token = 4
+
+    def encode(self, text: str, disallowed_special=()) -> list:
+        step = self.chars_per_token
+        return [text[i:i + step] for i in range(0, len(text), step)]
+
+    def decode(self, tokens: list) -> str:
+        return "".join(tokens)
+
+#SH: tiktoken encodings are expensive to build, so keep one per model for the whole process
+@lru_cache(maxsize=32)
+def get_encoding(model: str):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            logger.debug(f"No tiktoken encoding registered for {model}, using cl100k_base")
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # Encodings are fetched on first use, an offline host must still be able to count
+        logger.warning(f"Could not load tiktoken encoding for {model}, token counts are approximate: {e}")
+        return ApproximateEncoding()
+
+def count_tokens(text: str, model: str) -> int:
+    if not text:
+        return 0
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str) -> str:
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+def get_context_window(model: str) -> int:
+    if model in MODEL_CONTEXT_WINDOWS:
+        return MODEL_CONTEXT_WINDOWS[model]
+    # Dated snapshots (e.g. gpt-4o-2024-08-06) share the window of their family
+    for name in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(name):
+            return MODEL_CONTEXT_WINDOWS[name]
+    return DEFAULT_CONTEXT_WINDOW
+
+#SH: Prompt tokens of a system + user chat request, as the provider counts them
+def count_message_tokens(model: str, system_prompt: str, prompt: str) -> int:
+    return (
+        count_tokens(system_prompt, model)
+        + count_tokens(prompt, model)
+        + 2 * MESSAGE_OVERHEAD_TOKENS
+        + REPLY_PRIMING_TOKENS
+    )
+
+@dataclass
+class FittedPrompt:
+    prompt: str
+    prompt_tokens: int
+    trimmed_tokens: int = 0
+
+#SH: Split a prompt into what may be trimmed and the question that must stay whole. The question starts at the
+#SH: last question marker, the message may contain blank lines of its own. Prompts without one keep their last paragraph.
+def split_question(prompt: str) -> Tuple[str, str]:
+    start = max(prompt.rfind(marker) for marker in QUESTION_MARKERS)
+    if start < 0:
+        start = prompt.rfind("\n\n")
+    if start < 0:
+        return prompt, ""
+    return prompt[:start], prompt[start:]
+
+#SH: Trim the prompt so it and completion_tokens fit the model window, tokens are cut from the end of the
+#SH: history and context in front of the question so the question stays whole
+def fit_prompt(model: str, system_prompt: str, prompt: str, completion_tokens: int) -> FittedPrompt:
+    tokens = count_message_tokens(model, system_prompt, prompt)
+    over = tokens - (get_context_window(model) - completion_tokens)
+    if over <= 0:
+        return FittedPrompt(prompt, tokens)
+
+    head, tail = split_question(prompt)
+    head = truncate_to_tokens(head, max(count_tokens(head, model) - over, 0), model)
+    fitted = head + tail
+    fitted_tokens = count_message_tokens(model, system_prompt, fitted)
+    return FittedPrompt(fitted, fitted_tokens, tokens - fitted_tokens)
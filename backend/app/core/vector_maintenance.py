@@ -0,0 +1,466 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from typing import Callable, ContextManager, Dict, Iterable, List, Optional, Set, Tuple
+from langchain_community.vectorstores import Chroma
+from app.core.config import settings
+from app.core.vector_store import (
+    get_organization_dir,
+    get_organization_index_dir,
+    get_organization_vector_store,
+    load_manifest,
+    open_index,
+    save_manifest
+)
+from app.core.sharded_vector_store import SHARD_STRATEGIES, plan_shards, rebalance_shards, shard_collection_name
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "maintenance.json"
+COMPACTION_SUFFIX = "_compacting"
+LOCK_FILE = "maintenance.lock"
+SWAP_FILE = "swap.lock"
+WRITER_PREFIX = "writer-"
+
+_state_lock = threading.Lock()
+
+#SH: Organizations that have a persisted index under CHROMA_DIR
+def list_indexed_organizations() -> List[int]:
+    if not os.path.isdir(settings.CHROMA_DIR):
+        return []
+    return sorted(int(name) for name in os.listdir(settings.CHROMA_DIR) if name.isdigit())
+
+def get_index_dir(organization_id: int) -> str:
+    return get_organization_index_dir(organization_id)
+
+def _lock_path(organization_id: int) -> str:
+    return os.path.join(get_organization_dir(organization_id), LOCK_FILE)
+
+#SH: Compaction and resharding rewrite collections in place, only one worker may run either for an organization at a time
+def claim_maintenance(organization_id: int) -> bool:
+    lock_path = _lock_path(organization_id)
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    for _ in range(2):
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                # The holder touches the lock while it copies, an untouched lock belongs to a dead worker
+                if time.time() - os.path.getmtime(lock_path) < settings.VECTOR_MAINTENANCE_STALE_AFTER:
+                    return False
+                logger.warning(f"Breaking stale vector maintenance lock of org {organization_id}")
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+    return False
+
+def heartbeat_maintenance(organization_id: int) -> None:
+    try:
+        os.utime(_lock_path(organization_id))
+    except FileNotFoundError:
+        pass
+
+def release_maintenance(organization_id: int) -> None:
+    try:
+        os.remove(_lock_path(organization_id))
+    except FileNotFoundError:
+        pass
+
+def _org_file(organization_id: int, name: str) -> str:
+    return os.path.join(get_organization_dir(organization_id), name)
+
+def _is_fresh(path: str) -> bool:
+    try:
+        return time.time() - os.path.getmtime(path) < settings.VECTOR_MAINTENANCE_STALE_AFTER
+    except FileNotFoundError:
+        return False
+
+#SH: Announce a write to an organization's index, or wait while a rebuild swaps its collection. A writer first
+#SH: registers and then looks for the swap marker, the swapper first sets the marker and then waits for writers,
+#SH: so one of them always sees the other and no write lands between the last catch-up and the swap.
+def _register_writer(organization_id: int) -> str:
+    org_dir = get_organization_dir(organization_id)
+    os.makedirs(org_dir, exist_ok=True)
+    while True:
+        path = os.path.join(org_dir, f"{WRITER_PREFIX}{os.getpid()}-{threading.get_ident()}-{time.time_ns()}")
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        if not _is_fresh(os.path.join(org_dir, SWAP_FILE)):
+            return path
+        os.remove(path)
+        while _is_fresh(os.path.join(org_dir, SWAP_FILE)):
+            time.sleep(0.05)
+
+def _unregister_writer(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+#SH: Wrap every chunk write or delete of an organization index, a rebuild never swaps collections underneath it
+@contextmanager
+def index_write(organization_id: int):
+    path = _register_writer(organization_id)
+    try:
+        yield
+    finally:
+        _unregister_writer(path)
+
+@asynccontextmanager
+async def aindex_write(organization_id: int):
+    path = await asyncio.to_thread(_register_writer, organization_id)
+    try:
+        yield
+    finally:
+        _unregister_writer(path)
+
+#SH: Held by a rebuild for its final catch-up and the swap, new writes wait and running ones finish first
+@contextmanager
+def swap_window(organization_id: int):
+    org_dir = get_organization_dir(organization_id)
+    swap_path = os.path.join(org_dir, SWAP_FILE)
+    with open(swap_path, "w"):
+        pass
+    try:
+        while True:
+            writers = [
+                name for name in os.listdir(org_dir)
+                if name.startswith(WRITER_PREFIX) and _is_fresh(os.path.join(org_dir, name))
+            ]
+            if not writers:
+                break
+            os.utime(swap_path)
+            time.sleep(0.05)
+        yield
+    finally:
+        try:
+            os.remove(swap_path)
+        except FileNotFoundError:
+            pass
+
+#SH: Maintenance bookkeeping kept next to the index, HNSW only marks deletes so we count them ourselves
+def load_state(index_dir: str) -> dict:
+    try:
+        with open(os.path.join(index_dir, STATE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"deleted_since_rebuild": 0, "last_compacted": None}
+
+def save_state(index_dir: str, state: dict) -> None:
+    path = os.path.join(index_dir, STATE_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+def record_deleted(index_dir: str, count: int) -> None:
+    if count <= 0 or not os.path.isdir(index_dir):
+        return
+    with _state_lock:
+        state = load_state(index_dir)
+        state["deleted_since_rebuild"] = state.get("deleted_since_rebuild", 0) + count
+        save_state(index_dir, state)
+
+def _batched(items: List[str], size: int) -> Iterable[List[str]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+#SH: Remove every chunk of one knowledge base from a store, returns how many vectors were deleted
+def delete_knowledge_vectors(store: Chroma, knowledge_id: int, batch_size: int = 500) -> int:
+    collection = store._collection
+    ids = collection.get(where={"knowledge_id": knowledge_id}, include=[])["ids"]
+    for batch in _batched(ids, batch_size):
+        collection.delete(ids=batch)
+    return len(ids)
+
+#SH: Vector count per knowledge_id (None for chunks stored without one), paged so large indexes stay cheap
+def count_vectors_by_knowledge(store: Chroma, page_size: int = 1000) -> Counter:
+    collection = store._collection
+    counts: Counter = Counter()
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        metadatas = page["metadatas"] or []
+        for metadata in metadatas:
+            counts[(metadata or {}).get("knowledge_id")] += 1
+        if len(metadatas) < page_size:
+            return counts
+        offset += page_size
+
+#SH: Vectors whose knowledge base no longer exists in the database
+def find_orphans(store: Chroma, live_ids: Set[int]) -> dict:
+    counts = count_vectors_by_knowledge(store)
+    orphaned = {kid: n for kid, n in counts.items() if kid is not None and kid not in live_ids}
+    return {
+        "total_vectors": sum(counts.values()),
+        "live_vectors": sum(n for kid, n in counts.items() if kid in live_ids),
+        "orphaned_vectors": sum(orphaned.values()),
+        # Chunks ingested before knowledge_id metadata was stored cannot be attributed, so they are kept
+        "untracked_vectors": counts.get(None, 0),
+        "orphaned_knowledge_ids": sorted(orphaned)
+    }
+
+def _copy_collection(source, target, page_size: int, skip: Set[str], heartbeat: Optional[Callable[[], None]] = None) -> int:
+    copied = 0
+    offset = 0
+    while True:
+        if heartbeat is not None:
+            heartbeat()
+        page = source.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+        ids = page["ids"]
+        rows = [i for i, record_id in enumerate(ids) if record_id not in skip]
+        if rows:
+            target.add(
+                ids=[ids[i] for i in rows],
+                embeddings=[page["embeddings"][i] for i in rows],
+                documents=[page["documents"][i] for i in rows],
+                metadatas=[page["metadatas"][i] for i in rows]
+            )
+            skip.update(ids[i] for i in rows)
+            copied += len(rows)
+        if len(ids) < page_size:
+            return copied
+        offset += page_size
+
+def _all_ids(collection, page_size: int) -> Set[str]:
+    ids: Set[str] = set()
+    offset = 0
+    while True:
+        page = collection.get(include=[], limit=page_size, offset=offset)["ids"]
+        ids.update(page)
+        if len(page) < page_size:
+            return ids
+        offset += page_size
+
+#SH: Replay what changed in the source since it was copied: new chunks are copied, deleted ones dropped from the copy
+def _catch_up(source, target, page_size: int, heartbeat: Optional[Callable[[], None]] = None) -> int:
+    source_ids = _all_ids(source, page_size)
+    target_ids = _all_ids(target, page_size)
+    deleted = sorted(target_ids - source_ids)
+    added = sorted(source_ids - target_ids)
+    for batch in _batched(deleted, page_size):
+        target.delete(ids=batch)
+    for batch in _batched(added, page_size):
+        if heartbeat is not None:
+            heartbeat()
+        page = source.get(ids=batch, include=["embeddings", "documents", "metadatas"])
+        if page["ids"]:
+            target.add(ids=page["ids"], embeddings=page["embeddings"], documents=page["documents"], metadatas=page["metadatas"])
+    return len(deleted) + len(added)
+
+#SH: Rebuild the collection from its live records, the only way to drop deleted HNSW elements from disk.
+#SH: `exclusive` keeps writers out for the last catch-up and the swap, see swap_window.
+def rebuild_collection(
+    store: Chroma,
+    page_size: int = 500,
+    heartbeat: Optional[Callable[[], None]] = None,
+    exclusive: Callable[[], ContextManager] = nullcontext
+) -> int:
+    client = store._client
+    name = store._collection.name
+    staging_name = f"{name}{COMPACTION_SUFFIX}"
+    # A staging collection left by an interrupted rebuild is incomplete, start over
+    if staging_name in [c if isinstance(c, str) else c.name for c in client.list_collections()]:
+        client.delete_collection(staging_name)
+
+    source = client.get_collection(name)
+    target = client.create_collection(staging_name, metadata=source.metadata)
+    _copy_collection(source, target, page_size, set(), heartbeat)
+    # Writes keep coming in while the copy runs, replay them until a pass finds little left to do
+    for _ in range(3):
+        if _catch_up(source, target, page_size, heartbeat) < page_size:
+            break
+
+    with exclusive():
+        _catch_up(source, target, page_size, heartbeat)
+        client.delete_collection(name)
+        target.modify(name=name)
+    store._collection = client.get_collection(name)
+    return store._collection.count()
+
+#SH: Finish a rebuild that stopped between dropping the old collection and renaming the new one
+def recover_interrupted_rebuild(store: Chroma) -> None:
+    client = store._client
+    name = store._collection.name
+    names = [c if isinstance(c, str) else c.name for c in client.list_collections()]
+    staging_name = f"{name}{COMPACTION_SUFFIX}"
+    if staging_name in names and store._collection.count() == 0:
+        client.delete_collection(name)
+        client.get_collection(staging_name).modify(name=name)
+        store._collection = client.get_collection(name)
+        logger.warning(f"Recovered interrupted vector index rebuild for collection {name}")
+
+def vacuum_sqlite(index_dir: str) -> Tuple[int, int]:
+    path = os.path.join(index_dir, "chroma.sqlite3")
+    if not os.path.exists(path):
+        return 0, 0
+    before = os.path.getsize(path)
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+    return before, os.path.getsize(path)
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+#SH: Purge orphans, rebuild once enough of the index is dead, then reclaim sqlite pages. Knowledge rows are committed
+#SH: before their chunks are written, so `confirm_orphans` re-checks the candidates against the database right before
+#SH: deleting and returns the ids that really are gone; without it the `live_ids` snapshot is trusted.
+def compact_store(
+    store: Chroma,
+    index_dir: str,
+    live_ids: Set[int],
+    dead_ratio: float,
+    heartbeat: Optional[Callable[[], None]] = None,
+    confirm_orphans: Optional[Callable[[List[int]], Iterable[int]]] = None,
+    exclusive: Callable[[], ContextManager] = nullcontext
+) -> dict:
+    shards = getattr(store, "shards", [store])
+    for shard in shards:
+        recover_interrupted_rebuild(shard)
+    size_before = _directory_size(index_dir)
+    report = find_orphans(store, live_ids)
+    orphaned = report["orphaned_knowledge_ids"]
+    if orphaned and confirm_orphans is not None:
+        orphaned = sorted(confirm_orphans(orphaned))
+
+    purged = 0
+    for knowledge_id in orphaned:
+        purged += delete_knowledge_vectors(store, knowledge_id, settings.VECTOR_GC_BATCH_SIZE)
+
+    with _state_lock:
+        state = load_state(index_dir)
+        deleted = state.get("deleted_since_rebuild", 0) + purged
+        live = report["total_vectors"] - purged
+        rebuilt = deleted > 0 and deleted / max(live + deleted, 1) >= dead_ratio
+        if rebuilt:
+            for shard in shards:
+                rebuild_collection(shard, heartbeat=heartbeat, exclusive=exclusive)
+            deleted = 0
+        state.update({"deleted_since_rebuild": deleted, "last_compacted": time.time()})
+        save_state(index_dir, state)
+
+    vacuum_sqlite(index_dir)
+    return {
+        "purged_vectors": purged,
+        "rebuilt": rebuilt,
+        "live_vectors": report["total_vectors"] - purged,
+        "bytes_before": size_before,
+        "bytes_after": _directory_size(index_dir)
+    }
+
+#SH: Split an organization index into more shards (or change their placement) while reads keep working
+def reshard_index(
+    organization_id: int,
+    shards: Optional[int] = None,
+    shard_by: Optional[str] = None,
+    heartbeat: Optional[Callable[[], None]] = None
+) -> dict:
+    manifest = load_manifest(organization_id)
+    active = manifest["active"]
+    current = active.get("shards") or 1
+    current_by = active.get("shard_by") or settings.VECTOR_SHARD_BY
+    shard_by = shard_by or current_by
+    if shard_by not in SHARD_STRATEGIES:
+        raise ValueError(f"Unknown shard strategy {shard_by}. Allowed: {list(SHARD_STRATEGIES)}")
+    vectors = get_organization_vector_store(organization_id)._collection.count()
+    target = shards or plan_shards(vectors, current)
+    collections = max(current, target, active.get("shard_collections") or 1)
+    if target == current and shard_by == current_by and collections == current and not active.get("rebalancing"):
+        return {"shards": current, "shard_by": shard_by, "vectors": vectors, "moved": 0}
+
+    # Publish the new layout first: new chunks are placed by it and reads cover old and new shards
+    active.update({"shards": target, "shard_by": shard_by, "shard_collections": collections, "rebalancing": True})
+    save_manifest(organization_id, manifest)
+    store = open_index(organization_id, active)
+    moved = rebalance_shards(store, settings.VECTOR_GC_BATCH_SIZE, heartbeat)
+    # Shards left over from a larger layout are empty now
+    for index in range(target, collections):
+        store.shards[index]._client.delete_collection(shard_collection_name(index))
+
+    manifest = load_manifest(organization_id)
+    if manifest["active"].get("path") == active["path"]:
+        manifest["active"].update({"shards": target, "shard_by": shard_by})
+        manifest["active"].pop("shard_collections", None)
+        manifest["active"].pop("rebalancing", None)
+        save_manifest(organization_id, manifest)
+    logger.info(f"Resharded vector index of org {organization_id} into {target} shards by {shard_by}, moved {moved} chunks")
+    return {"shards": target, "shard_by": shard_by, "vectors": vectors, "moved": moved}
+
+class VectorGarbageCollector:
+    """Deletes the vectors of removed knowledge bases off the request path"""
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.deleted_vectors = 0
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        if self.worker is None or self.worker.done():
+            self.queue = self.queue or asyncio.Queue()
+            self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+    #SH: Queue cleanup of one knowledge base, the worker is started on demand
+    def enqueue(self, organization_id: int, knowledge_id: int):
+        self.start()
+        self.queue.put_nowait((organization_id, knowledge_id))
+
+    async def drain(self):
+        if self.queue is not None:
+            await self.queue.join()
+
+    async def _run(self):
+        while True:
+            organization_id, knowledge_id = await self.queue.get()
+            try:
+                deleted = await asyncio.to_thread(self.collect, organization_id, knowledge_id)
+                self.deleted_vectors += deleted
+                self.processed += 1
+                logger.info(f"Deleted {deleted} vectors of knowledge {knowledge_id} (org {organization_id})")
+            except Exception as e:
+                # Anything missed here is picked up as an orphan by the next compaction
+                self.failed += 1
+                logger.error(f"Vector cleanup failed for knowledge {knowledge_id} (org {organization_id}): {e}")
+            finally:
+                self.queue.task_done()
+
+    def collect(self, organization_id: int, knowledge_id: int) -> int:
+        index_dir = get_index_dir(organization_id)
+        if not os.path.isdir(index_dir):
+            return 0
+        store = get_organization_vector_store(organization_id)
+        with index_write(organization_id):
+            deleted = delete_knowledge_vectors(store, knowledge_id, self.batch_size)
+        record_deleted(index_dir, deleted)
+        return deleted
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": self.queue.qsize() if self.queue is not None else 0,
+            "processed": self.processed,
+            "failed": self.failed,
+            "deleted_vectors": self.deleted_vectors
+        }
+
+# Global instance
+vector_gc = VectorGarbageCollector(batch_size=settings.VECTOR_GC_BATCH_SIZE)
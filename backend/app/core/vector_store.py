@@ -1,14 +1,207 @@
 from langchain_community.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings
+from langchain_core.documents import Document
 from app.core.config import settings
+from app.core.embedding_cache import CachedEmbeddings, embedding_cache
+from app.core.embedding_batcher import CoalescingEmbeddings
+from app.core.embeddings import embedding_id, get_embeddings, resolve_embedding_config
+from app.core.sharded_vector_store import ShardedVectorStore, search_collection, search_pool, shard_collection_name
+from app.core.vector_tiers import vector_tiers
+from typing import Dict, List, Optional, Tuple
 import os
+import asyncio
+import json
+import time
+import threading
 
-#SH: This function returns a Chroma vector store for a specific organization
-def get_organization_vector_store(organization_id: int):
-    #SH: directory path for storing vectors for this organization
-    org_chroma_dir = os.path.join(settings.CHROMA_DIR, str(organization_id))
-    
-    return Chroma(
-        persist_directory=org_chroma_dir,
-        embedding_function=OpenAIEmbeddings()
+MANIFEST_FILE = "manifest.json"
+
+_embedding_functions: Dict[str, CachedEmbeddings] = {}
+_manifest_cache: Dict[int, tuple] = {}
+_manifest_lock = threading.Lock()
+
+#SH: One embeddings client per embedding profile and process: cache first, then concurrent misses share one provider call
+def get_embedding_function(
+    model: Optional[str] = None,
+    provider: Optional[str] = None,
+    dimensions: Optional[int] = None,
+    dtype: Optional[str] = None
+):
+    config = resolve_embedding_config({"provider": provider, "model": model, "dimensions": dimensions, "dtype": dtype})
+    space = embedding_id(config["provider"], config["model"], config["dimensions"])
+    # The dtype only changes how cached vectors are held, the cache keys stay per vector space
+    key = space if config["dtype"] == "float32" else f"{space}/{config['dtype']}"
+    if key not in _embedding_functions:
+        _embedding_functions[key] = CachedEmbeddings(
+            CoalescingEmbeddings(
+                get_embeddings(config["provider"], config["model"], config["dimensions"]),
+                max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+                max_wait_ms=settings.EMBEDDING_BATCH_MAX_WAIT_MS
+            ),
+            embedding_cache,
+            model=space,
+            dtype=config["dtype"]
+        )
+    return _embedding_functions[key]
+
+def get_embedding_batching_stats() -> Dict[str, dict]:
+    return {
+        key: function.embeddings.stats()
+        for key, function in _embedding_functions.items()
+        if isinstance(function.embeddings, CoalescingEmbeddings)
+    }
+
+#SH: Embedding function of an index generation, generations from before providers existed are OpenAI
+def get_generation_embedding_function(generation: dict):
+    return get_embedding_function(
+        generation["model"],
+        generation.get("provider", "openai"),
+        generation.get("dimensions"),
+        generation.get("dtype")
     )
+
+#SH: Root directory of an organization, it holds the index manifest and every index generation
+def get_organization_dir(organization_id: int) -> str:
+    return os.path.join(settings.CHROMA_DIR, str(organization_id))
+
+def _manifest_path(organization_id: int) -> str:
+    return os.path.join(get_organization_dir(organization_id), MANIFEST_FILE)
+
+#SH: The manifest says which index generation serves reads and which embedding model built it
+def load_manifest(organization_id: int) -> dict:
+    path = _manifest_path(organization_id)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        org_dir = get_organization_dir(organization_id)
+        # Indexes written before manifests existed sit in the org directory, embedded with the old default model
+        legacy = os.path.exists(os.path.join(org_dir, "chroma.sqlite3"))
+        config = resolve_embedding_config(
+            {"provider": "openai", "model": settings.EMBEDDING_LEGACY_MODEL} if legacy else None
+        )
+        manifest = {
+            "active": {
+                "path": ".",
+                "provider": config["provider"],
+                "model": config["model"],
+                "dimensions": config["dimensions"],
+                "dtype": config["dtype"],
+                "created_at": None if legacy else time.time()
+            },
+            "building": None,
+            "previous": None
+        }
+        if not legacy:
+            save_manifest(organization_id, manifest)
+        return manifest
+
+    with _manifest_lock:
+        cached = _manifest_cache.get(organization_id)
+        if cached and cached[0] == mtime:
+            return json.loads(cached[1])
+    with open(path) as f:
+        raw = f.read()
+    with _manifest_lock:
+        _manifest_cache[organization_id] = (mtime, raw)
+    return json.loads(raw)
+
+#SH: Write to a temp file and rename over the manifest, so readers switch generations atomically
+def save_manifest(organization_id: int, manifest: dict) -> None:
+    path = _manifest_path(organization_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+def get_index_dir(organization_id: int, generation: dict) -> str:
+    return os.path.normpath(os.path.join(get_organization_dir(organization_id), generation["path"]))
+
+#SH: Directory of the index generation currently serving an organization
+def get_organization_index_dir(organization_id: int) -> str:
+    return get_index_dir(organization_id, load_manifest(organization_id)["active"])
+
+#SH: Query embeddings must come from the model that built the organization's active index
+def get_organization_embedding_function(organization_id: int):
+    return get_generation_embedding_function(load_manifest(organization_id)["active"])
+
+#SH: Open an index generation, a generation split into shards comes back as one ShardedVectorStore
+def open_index(organization_id: int, generation: dict):
+    index_dir = get_index_dir(organization_id, generation)
+    embedding_function = get_generation_embedding_function(generation)
+    shard_count = generation.get("shards") or 1
+    # During a rebalance reads also cover shards that are being drained
+    collections = max(shard_count, generation.get("shard_collections") or 1)
+    if collections == 1:
+        return Chroma(persist_directory=index_dir, embedding_function=embedding_function)
+
+    shards = [
+        Chroma(
+            collection_name=shard_collection_name(index),
+            persist_directory=index_dir,
+            embedding_function=embedding_function
+        )
+        for index in range(collections)
+    ]
+    return ShardedVectorStore(
+        shards,
+        shard_count,
+        generation.get("shard_by") or settings.VECTOR_SHARD_BY,
+        search_pool,
+        rebalancing=collections != shard_count or bool(generation.get("rebalancing"))
+    )
+
+#SH: This function returns the vector store serving a specific organization
+def get_organization_vector_store(organization_id: int):
+    return open_index(organization_id, load_manifest(organization_id)["active"])
+
+def _search_hnsw(vector_store, embedding: List[float], k: int, filter: Optional[dict]):
+    if isinstance(vector_store, ShardedVectorStore):
+        return vector_store.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter)
+    return [(doc, distance) for distance, _, doc in search_collection(vector_store._collection, embedding, k, filter)]
+
+#SH: Nearest chunks as (document, distance). When the organization's hot tier is current its exact hits are merged
+#SH: with HNSW's, an index that fits in RAM entirely is answered from the tier alone.
+def _search_index(vector_store, embedding: List[float], k: int, filter: Optional[dict], organization_id: Optional[int]):
+    tier = None
+    if organization_id is not None and settings.VECTOR_TIERING_ENABLED:
+        tier = vector_tiers.get(organization_id, get_organization_index_dir(organization_id))
+    hot_hits = tier.search(embedding, k, filter) if tier is not None else None
+    if hot_hits is None:
+        results = _search_hnsw(vector_store, embedding, k, filter)
+        if organization_id is not None:
+            vector_tiers.record(organization_id, [doc.id for doc, _ in results])
+        return results
+
+    documents = {}
+    index_hits = []
+    if not tier.complete:
+        for doc, distance in _search_hnsw(vector_store, embedding, k, filter):
+            documents[doc.id] = doc
+            index_hits.append((distance, doc.id))
+    hits = vector_tiers.merge(hot_hits, index_hits, k)
+
+    # Only the hot winners HNSW did not return are read from Chroma's sqlite
+    missing = [record_id for _, record_id, _ in hits if record_id not in documents]
+    if missing:
+        records = vector_store._collection.get(ids=missing, include=["documents", "metadatas"])
+        for record_id, text, metadata in zip(records["ids"], records["documents"], records["metadatas"]):
+            documents[record_id] = Document(id=record_id, page_content=text, metadata=metadata or {})
+    hits = [hit for hit in hits if hit[1] in documents]
+    vector_tiers.record(organization_id, [record_id for _, record_id, _ in hits], [hot for _, _, hot in hits])
+    return [(documents[record_id], distance) for distance, record_id, _ in hits]
+
+#SH: The query is embedded on the event loop (cache and micro-batching), only the index lookup runs in a thread.
+#SH: langchain's async search would embed in a worker thread and skip both.
+async def search_with_relevance_scores(
+    vector_store: Chroma,
+    query: str,
+    k: int,
+    filter: Optional[dict] = None,
+    query_embedding: Optional[List[float]] = None,
+    organization_id: Optional[int] = None
+) -> List[Tuple[object, float]]:
+    embedding = query_embedding or await vector_store.embeddings.aembed_query(query)
+    results = await asyncio.to_thread(_search_index, vector_store, embedding, k, filter, organization_id)
+    # Chroma returns distances here, turn them into the 0-1 relevance the rest of the code expects
+    relevance = vector_store._select_relevance_score_fn()
+    return [(doc, relevance(distance)) for doc, distance in results]
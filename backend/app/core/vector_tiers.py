@@ -0,0 +1,353 @@
+import os
+import glob
+import json
+import time
+import logging
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+NO_KNOWLEDGE = -1
+USAGE_DIR = os.path.join(tempfile.gettempdir(), "vector-tiers")  # node local, RAM is a per node resource
+LOCK_STALE_AFTER = 30  # seconds, a reservation takes milliseconds so an older lock file was left by a dead worker
+
+#SH: Per-chunk retrieval counts, decayed on every tiering pass so the hot set follows current traffic
+class RetrievalStats:
+
+    def __init__(self):
+        self._hits: Dict[int, Counter] = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def record(self, organization_id: int, chunk_ids: Iterable[str]):
+        with self._lock:
+            self._hits[organization_id].update(chunk_id for chunk_id in chunk_ids if chunk_id)
+
+    def top(self, organization_id: int, n: int) -> List[str]:
+        with self._lock:
+            return [chunk_id for chunk_id, _ in self._hits[organization_id].most_common(n)]
+
+    def organizations(self) -> List[int]:
+        with self._lock:
+            return [org_id for org_id, hits in self._hits.items() if hits]
+
+    def decay(self, organization_id: int, factor: float):
+        with self._lock:
+            hits = self._hits[organization_id]
+            for chunk_id in list(hits):
+                hits[chunk_id] *= factor
+                if hits[chunk_id] < 0.05:
+                    del hits[chunk_id]
+
+    def tracked_chunks(self, organization_id: int) -> int:
+        with self._lock:
+            return len(self._hits.get(organization_id, ()))
+
+@dataclass
+class TierSegment:
+    ids: np.ndarray
+    vectors: np.ndarray
+    knowledge_ids: np.ndarray
+
+    def __len__(self):
+        return len(self.ids)
+
+#SH: Distances the way Chroma computes them for the collection's space, so relevance scores stay comparable
+def _distances(vectors: np.ndarray, query: np.ndarray, space: str) -> np.ndarray:
+    dots = vectors @ query
+    if space == "ip":
+        return 1.0 - dots
+    if space == "cosine":
+        norms = np.linalg.norm(vectors, axis=1) * max(float(np.linalg.norm(query)), 1e-12)
+        return 1.0 - dots / np.clip(norms, 1e-12, None)
+    # Chroma's l2 is the squared euclidean distance
+    return np.einsum("ij,ij->i", vectors, vectors) - 2 * dots + float(query @ query)
+
+#SH: The knowledge ids of a {"knowledge_id": id} or {"knowledge_id": {"$in": ids}} filter, None for anything else
+def _knowledge_filter(filter: Optional[dict]) -> Optional[List[int]]:
+    if not filter or set(filter) != {"knowledge_id"}:
+        return None
+    value = filter["knowledge_id"]
+    if isinstance(value, dict) and set(value) == {"$in"}:
+        value = value["$in"]
+    values = value if isinstance(value, list) else [value]
+    return values if all(isinstance(v, int) for v in values) else None
+
+#SH: The hot chunks of one organization as a RAM array. When the whole index fits it is `complete` and answers
+#SH: searches alone, otherwise its exact hits are merged with Chroma's HNSW results for the rest of the index.
+class TieredIndex:
+
+    def __init__(self, fingerprint: tuple, space: str, hot: TierSegment, complete: bool):
+        self.fingerprint = fingerprint
+        self.space = space
+        self.hot = hot
+        self.complete = complete
+        self.built_at = time.time()
+
+    #SH: Exact top-k over the hot chunks, None when the filter needs Chroma's metadata filtering
+    def search(self, embedding: List[float], k: int, filter: Optional[dict] = None) -> Optional[List[Tuple[float, str]]]:
+        knowledge_ids = _knowledge_filter(filter)
+        if filter and knowledge_ids is None:
+            return None
+        if not len(self.hot):
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        rows = np.arange(len(self.hot)) if knowledge_ids is None else np.flatnonzero(np.isin(self.hot.knowledge_ids, knowledge_ids))
+        if not len(rows):
+            return []
+        vectors = self.hot.vectors if knowledge_ids is None else self.hot.vectors[rows]
+        distances = _distances(vectors, query, self.space)
+        top = np.argpartition(distances, k - 1)[:k] if len(distances) > k else np.arange(len(distances))
+        return sorted((float(distances[i]), str(self.hot.ids[rows[i]])) for i in top)
+
+    def stats(self) -> dict:
+        return {
+            "hot_vectors": len(self.hot),
+            "hot_bytes": int(self.hot.vectors.nbytes),
+            "complete": self.complete,
+            "built_at": self.built_at
+        }
+
+#SH: Chroma touches its sqlite files on every write and never on reads, so their mtimes tell us when a tier is stale
+def index_fingerprint(index_dir: str) -> tuple:
+    mtimes = []
+    for name in ("chroma.sqlite3", "chroma.sqlite3-wal"):
+        try:
+            mtimes.append(os.stat(os.path.join(index_dir, name)).st_mtime_ns)
+        except FileNotFoundError:
+            mtimes.append(None)
+    return (os.path.normpath(index_dir), *mtimes)
+
+def _process_alive(pid: int) -> bool:
+    # os.kill terminates the process on Windows, there the usage file's age alone tells a dead worker
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+#SH: Node-wide lock around the RAM reservation, a lock file created with O_EXCL works on every platform
+@contextmanager
+def _node_lock(usage_dir: str):
+    path = os.path.join(usage_dir, ".lock")
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > LOCK_STALE_AFTER:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+class VectorTiering:
+    """Keeps each active organization's working set in RAM, the rest of its index is served by Chroma's HNSW index"""
+
+    def __init__(
+        self,
+        small_index_size: int,
+        hot_size: int,
+        max_index_size: int,
+        decay: float,
+        max_ram_bytes: int = 0,
+        usage_dir: str = USAGE_DIR
+    ):
+        self.small_index_size = small_index_size
+        self.hot_size = hot_size
+        self.max_index_size = max_index_size
+        self.decay = decay
+        self.max_ram_bytes = max_ram_bytes
+        self.usage_dir = usage_dir
+        self.reserved: Dict[int, int] = {}
+        self.retrieval_stats = RetrievalStats()
+        self.indexes: Dict[int, TieredIndex] = {}
+        self.served = 0
+        self.fallbacks = 0
+        self.hot_results = 0
+        self.cold_results = 0
+
+    def get(self, organization_id: int, index_dir: str) -> Optional[TieredIndex]:
+        index = self.indexes.get(organization_id)
+        if index is None:
+            return None
+        # Written to since the last pass, Chroma answers until the next one rebuilds the tiers
+        if index.fingerprint != index_fingerprint(index_dir):
+            return None
+        return index
+
+    def record(self, organization_id: int, chunk_ids: List[str], hot_flags: Optional[List[bool]] = None):
+        self.retrieval_stats.record(organization_id, chunk_ids)
+        if hot_flags is None:
+            self.fallbacks += 1
+            return
+        self.served += 1
+        self.hot_results += sum(hot_flags)
+        self.cold_results += len(hot_flags) - sum(hot_flags)
+
+    #SH: Hot hits and the HNSW hits for the rest of the index as one top-k, chunks found by both are kept once
+    @staticmethod
+    def merge(hot_hits: List[Tuple[float, str]], index_hits: List[Tuple[float, str]], k: int) -> List[Tuple[float, str, bool]]:
+        hot_ids = {record_id for _, record_id in hot_hits}
+        merged = [(distance, record_id, True) for distance, record_id in hot_hits]
+        merged.extend((distance, record_id, False) for distance, record_id in index_hits if record_id not in hot_ids)
+        return sorted(merged)[:k]
+
+    #SH: Promote the most retrieved chunks to RAM, only their vectors are read from the index
+    def refresh(self, organization_id: int, collection, index_dir: str, page_size: int = 1000) -> dict:
+        fingerprint = index_fingerprint(index_dir)
+        total = collection.count()
+        # No retrievals for several passes: the organization leaves RAM
+        if total == 0 or total > self.max_index_size or not self.retrieval_stats.tracked_chunks(organization_id):
+            self.drop(organization_id)
+            return {"organization_id": organization_id, "tiered": False, "vectors": total}
+
+        try:
+            dimensions = len(collection.get(include=["embeddings"], limit=1)["embeddings"][0])
+            max_hot = self._reserve_hot_rows(organization_id, dimensions)
+            everything_hot = total <= min(self.small_index_size, max_hot)
+            if everything_hot:
+                pages = self._pages(collection, page_size)
+            else:
+                hot_ids = self.retrieval_stats.top(organization_id, min(self.hot_size, max_hot))
+                pages = (
+                    collection.get(ids=hot_ids[start:start + page_size], include=["embeddings", "metadatas"])
+                    for start in range(0, len(hot_ids), page_size)
+                )
+
+            hot_rows: List[Tuple[str, np.ndarray, int]] = []
+            for page in pages:
+                # Chunks written since the count can push the index past its reservation, HNSW still has them
+                if len(hot_rows) + len(page["ids"]) > max_hot:
+                    everything_hot = False
+                for record_id, vector, metadata in zip(page["ids"][:max(max_hot - len(hot_rows), 0)], page["embeddings"], page["metadatas"]):
+                    knowledge_id = (metadata or {}).get("knowledge_id")
+                    knowledge_id = knowledge_id if isinstance(knowledge_id, int) else NO_KNOWLEDGE
+                    hot_rows.append((record_id, np.asarray(vector, dtype=np.float32), knowledge_id))
+        finally:
+            self.reserved.pop(organization_id, None)
+
+        hot = TierSegment(
+            ids=np.asarray([row[0] for row in hot_rows], dtype=object),
+            vectors=np.vstack([row[1] for row in hot_rows]) if hot_rows else np.zeros((0, 0), dtype=np.float32),
+            knowledge_ids=np.asarray([row[2] for row in hot_rows], dtype=np.int64)
+        )
+        space = (collection.metadata or {}).get("hnsw:space", "l2") if hasattr(collection, "metadata") else "l2"
+        self.indexes[organization_id] = TieredIndex(fingerprint, space, hot, complete=everything_hot)
+        self.retrieval_stats.decay(organization_id, self.decay)
+        self._publish_usage()
+        return {"organization_id": organization_id, "tiered": True, "vectors": total, **self.indexes[organization_id].stats()}
+
+    @staticmethod
+    def _pages(collection, page_size: int):
+        offset = 0
+        while True:
+            page = collection.get(include=["embeddings", "metadatas"], limit=page_size, offset=offset)
+            yield page
+            if len(page["ids"]) < page_size:
+                return
+            offset += page_size
+
+    def drop(self, organization_id: int):
+        self.indexes.pop(organization_id, None)
+        self._publish_usage()
+
+    #SH: Hot vectors of this worker, including RAM reserved for a pass that is still building
+    def ram_bytes(self) -> int:
+        return sum(index.hot.vectors.nbytes for index in self.indexes.values()) + sum(self.reserved.values())
+
+    #SH: Hot vectors other workers on this node published, entries of exited or stuck workers are ignored
+    def _other_workers_ram(self) -> int:
+        total = 0
+        stale_after = max(3 * settings.VECTOR_TIER_INTERVAL, 60)
+        for path in glob.glob(os.path.join(self.usage_dir, "*.json")):
+            pid = int(os.path.basename(path)[:-len(".json")])
+            if pid == os.getpid():
+                continue
+            try:
+                with open(path) as f:
+                    usage = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if time.time() - usage.get("updated_at", 0) > stale_after or not _process_alive(pid):
+                continue
+            total += usage.get("ram_bytes", 0)
+        return total
+
+    def _write_usage(self):
+        path = os.path.join(self.usage_dir, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"ram_bytes": self.ram_bytes(), "updated_at": time.time()}, f)
+        os.replace(tmp_path, path)
+
+    def _publish_usage(self):
+        if not self.max_ram_bytes:
+            return
+        os.makedirs(self.usage_dir, exist_ok=True)
+        self._write_usage()
+
+    #SH: Hot rows an organization may keep under the node-wide RAM cap, reserved before the pass reads the index
+    def _reserve_hot_rows(self, organization_id: int, dimensions: int) -> int:
+        if not self.max_ram_bytes or not dimensions:
+            return max(self.small_index_size, self.hot_size)
+        row_bytes = dimensions * np.dtype(np.float32).itemsize
+        os.makedirs(self.usage_dir, exist_ok=True)
+        # Check and reserve under one node-wide lock, so two workers can't both claim the same free RAM
+        with _node_lock(self.usage_dir):
+            current = self.indexes.get(organization_id)
+            # The organization's current hot set is rebuilt by this pass, its RAM is free to reuse
+            own = self.ram_bytes() - (current.hot.vectors.nbytes if current is not None else 0)
+            available = max(self.max_ram_bytes - self._other_workers_ram() - own, 0)
+            rows = min(available // row_bytes, max(self.small_index_size, self.hot_size))
+            self.reserved[organization_id] = rows * row_bytes
+            self._write_usage()
+        return rows
+
+    #SH: Organizations worth a pass: tiered ones and those retrieved from since the last pass
+    def active_organizations(self) -> List[int]:
+        return sorted(set(self.indexes) | set(self.retrieval_stats.organizations()))
+
+    def stats(self) -> dict:
+        results = self.hot_results + self.cold_results
+        return {
+            "searches_served": self.served,
+            "searches_fallback": self.fallbacks,
+            "hot_result_percent": round(self.hot_results / results * 100, 2) if results else 0.0,
+            "ram_bytes": sum(index.hot.vectors.nbytes for index in self.indexes.values()),
+            "ram_cap_bytes": self.max_ram_bytes,
+            "node_ram_bytes": self.ram_bytes() + self._other_workers_ram() if self.max_ram_bytes else None,
+            "organizations": {
+                org_id: {**index.stats(), "tracked_chunks": self.retrieval_stats.tracked_chunks(org_id)}
+                for org_id, index in self.indexes.items()
+            }
+        }
+
+# Global instance
+vector_tiers = VectorTiering(
+    small_index_size=settings.VECTOR_TIER_SMALL_INDEX_SIZE,
+    hot_size=settings.VECTOR_TIER_HOT_SIZE,
+    max_index_size=settings.VECTOR_TIER_MAX_INDEX_SIZE,
+    decay=settings.VECTOR_TIER_DECAY,
+    max_ram_bytes=settings.VECTOR_TIER_MAX_RAM_MB * 1024 * 1024
+)
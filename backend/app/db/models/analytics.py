@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, JSON, Index
+from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, JSON, Index, Boolean
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.db.database import Base
@@ -9,15 +9,23 @@ class ChatMetrics(Base):
     id = Column(Integer, primary_key=True, index=True)
     
     # Core metrics
-    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=True)  # Empty for public widget visitors
     agent_id = Column(Integer, ForeignKey("agents.id"), nullable=False)
-    user_id = Column(String, ForeignKey("users.user_id"), nullable=False)
+    user_id = Column(String, ForeignKey("users.user_id"), nullable=True)  # Empty for public widget visitors
     organization_id = Column(Integer, ForeignKey("organizations.id"), nullable=False)
     
     # Performance metrics
     response_time_ms = Column(Float, nullable=False)  # Agent response time in milliseconds
+    time_to_first_token_ms = Column(Float, nullable=True)  # Streamed responses: time until the first token reached the client
     message_length = Column(Integer, nullable=False)  # Character count of user message
     tokens_used = Column(Integer, default=0)  # LLM tokens consumed
+    prompt_tokens = Column(Integer, default=0)  # Prompt share of tokens_used
+    context_tokens = Column(Integer, default=0)  # RAG context tokens after packing
+    raw_context_tokens = Column(Integer, default=0)  # RAG context tokens of the selected chunks before packing
+    uncompressed_context_tokens = Column(Integer, default=0)  # RAG context tokens before query-relevance compression
+    context_compressed = Column(Boolean, default=False)  # Context went through query-relevance compression
+    reranked = Column(Boolean, default=False)  # Candidates were reranked by the cross-encoder
+    rerank_ms = Column(Float, default=0.0)  # Time spent reranking
     cost = Column(Float, default=0.0)  # Processing cost
     
     # Session metrics
@@ -27,6 +35,14 @@ class ChatMetrics(Base):
     # Quality indicators
     knowledge_base_hits = Column(Integer, default=0)  # RAG context retrievals
     model_used = Column(String(50))  # LLM model identifier
+    route = Column(String(20))  # Model router path that served the answer (primary, fallback, circuit_open, hedge_primary, hedge_fallback)
+
+    # Response cache
+    cache_hit = Column(Boolean, default=False)  # Answer served from the semantic response cache
+    tokens_saved = Column(Integer, default=0)  # Tokens the cached answer originally cost
+    latency_saved_ms = Column(Float, default=0.0)  # Original response time minus cached response time
+    coalesced = Column(Boolean, default=False)  # Answer shared from an identical request already in flight
+    cancelled = Column(Boolean, default=False)  # Client disconnected or cancelled mid-generation, tokens and cost are partial
     
     # Metadata
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Index
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.db.database import Base
@@ -14,6 +14,8 @@ class Conversation(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     user_id = Column(String, ForeignKey("users.user_id"))
     agent_id = Column(Integer, ForeignKey("agents.id"))
+    summary = Column(Text)  # Rolling summary of the turns older than the recent window
+    summarized_through = Column(Integer, default=0, server_default="0")  # Sequence id of the last message in the summary
 
     #SH: Relationships
     user = relationship("User", back_populates="conversations")
@@ -38,6 +40,7 @@ class ChatMessage(Base):
     # Status flags
     delivered = Column(Boolean, default=False)
     read = Column(Boolean, default=False)   
+    cancelled = Column(Boolean, default=False)  # Turn whose reply was cancelled, left out of history and summaries
 
     #SH: Foreign keys / relations
     user_id = Column(String, ForeignKey("users.user_id"))
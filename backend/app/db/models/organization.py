@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import JSON, Column, Integer, String
 from sqlalchemy.orm import relationship
 from app.db.database import Base
 
@@ -9,6 +9,7 @@ class Organization(Base):
     id = Column(Integer, primary_key=True, index=True, nullable=False)
     name = Column(String, nullable=False) 
     user_id = Column(String, nullable=False)
+    embedding_config = Column(JSON, nullable=True)  # {"provider": ..., "model": ...}, defaults from settings
     
     # SH:Relationships with user and agent table
     users = relationship("User", back_populates="organization") 
@@ -103,6 +103,19 @@ async def create_chat_message(db: AsyncSession, message_data: dict):
         await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
+#SH: Close a turn whose reply was cancelled: what was generated so far is saved as the reply and both messages are
+#SH: flagged, so sequence ids move on as after any reply while history and summaries leave the turn out
+async def save_cancelled_reply(db: AsyncSession, message_data: dict):
+    await db.execute(
+        update(ChatMessage)
+        .where(
+            ChatMessage.conversation_id == message_data["conversation_id"],
+            ChatMessage.sequence_id == message_data["sequence_id"] - 1
+        )
+        .values(cancelled=True)
+    )
+    return await create_chat_message(db, {**message_data, "cancelled": True})
+
 #SH: Retrieve the latest chat history for a specific user-agent pair
 async def fetch_chat_history(
     db: AsyncSession, 
@@ -198,3 +211,30 @@ async def get_all_user_conversations(
         .order_by(Conversation.updated_at.desc())
     )
     return result.scalars().all()
+
+#SH: Messages of a conversation after the last summarized one, oldest first, optionally only those before a sequence id
+async def get_unsummarized_messages(
+    db: AsyncSession,
+    conversation_id: int,
+    after_sequence: int = 0,
+    before_sequence: int = None
+) -> list[ChatMessage]:
+    query = select(ChatMessage).where(
+        ChatMessage.conversation_id == conversation_id,
+        ChatMessage.sequence_id > after_sequence,
+        ChatMessage.cancelled.isnot(True)
+    )
+    if before_sequence is not None:
+        query = query.where(ChatMessage.sequence_id < before_sequence)
+    result = await db.execute(query.order_by(ChatMessage.sequence_id))
+    return result.scalars().all()
+
+#SH: Store a conversation's rolling summary and the last message folded into it
+async def update_conversation_summary(db: AsyncSession, conversation_id: int, summary: str, summarized_through: int):
+    result = await db.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(summary=summary, summarized_through=summarized_through)
+    )
+    await db.commit()
+    return result.rowcount
@@ -1,4 +1,5 @@
 from datetime import datetime
+import hashlib
 from urllib.parse import urlparse
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.models.knowledge_base import KnowledgeBase, TextKnowledge, URLKnowledge, YouTubeKnowledge, Category, Tag, knowledge_tag
@@ -6,12 +7,13 @@ from app.models.knowledge_base import KnowledgeBaseCreate, KnowledgeUpdate
 from app.db.models.agent import agent_knowledge
 from fastapi import HTTPException, logger, status
 from sqlalchemy import or_, select, func
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional
 from app.core.youtube_processor import YouTubeProcessor
 from sqlalchemy.orm import aliased
 from sqlalchemy.orm import selectinload
 from app.services.dashboard_events import trigger_kb_update
 from app.models.user import UserOut
+from app.core.vector_maintenance import vector_gc
 
 # SH: This file will contain all the database operations related to the Knowledge base Models
 
@@ -68,6 +70,18 @@ async def get_organization_knowledge_bases(
     )
     return result.scalars().all()
 
+#SH: Get the knowledge bases an agent answers from
+async def get_agent_knowledge_bases(
+    db: AsyncSession,
+    agent_id: int
+) -> list[KnowledgeBase]:
+    result = await db.execute(
+        select(KnowledgeBase)
+        .join(agent_knowledge, agent_knowledge.c.knowledge_id == KnowledgeBase.id)
+        .where(agent_knowledge.c.agent_id == agent_id)
+    )
+    return result.scalars().all()
+
 #SH: Get organization knowledge count
 async def get_organization_knowledge_count(
     db: AsyncSession, 
@@ -79,6 +93,41 @@ async def get_organization_knowledge_count(
     )
     return result.scalar_one()
 
+#SH: Ids of the knowledge bases that still exist for an organization
+async def get_live_knowledge_ids(
+    db: AsyncSession,
+    organization_id: int,
+    knowledge_ids: Optional[Iterable[int]] = None
+) -> set[int]:
+    query = select(KnowledgeBase.id).where(KnowledgeBase.organization_id == organization_id)
+    if knowledge_ids is not None:
+        query = query.where(KnowledgeBase.id.in_(list(knowledge_ids)))
+    result = await db.execute(query)
+    return set(result.scalars().all())
+
+#SH: Fingerprint of the knowledge an agent answers from, changes whenever org knowledge or agent links change
+async def get_knowledge_version(
+    db: AsyncSession,
+    organization_id: int,
+    agent_id: int
+) -> str:
+    org_result = await db.execute(
+        select(
+            func.count(KnowledgeBase.id),
+            func.max(KnowledgeBase.id),
+            func.sum(KnowledgeBase.chunk_count),
+            func.max(KnowledgeBase.uploaded_at)
+        )
+        .where(KnowledgeBase.organization_id == organization_id)
+    )
+    linked_result = await db.execute(
+        select(agent_knowledge.c.knowledge_id)
+        .where(agent_knowledge.c.agent_id == agent_id)
+        .order_by(agent_knowledge.c.knowledge_id)
+    )
+    fingerprint = f"{tuple(org_result.one())}|{linked_result.scalars().all()}"
+    return hashlib.sha256(fingerprint.encode()).hexdigest()
+
 #SH: For Url_knowledge 
 async def create_url_knowledge(
     db: AsyncSession,
@@ -303,9 +352,13 @@ async def delete_knowledge_base(
             
         await db.delete(kb)
         await db.commit()
+        #SH: Chunks are removed from the org's vector store in the background
+        vector_gc.enqueue(user.organization_id, kb_id)
         count = await get_organization_knowledge_count(db, user.organization_id)
         await trigger_kb_update(count, user.organization_id)
         
+    except HTTPException:
+        raise
     except Exception as e:
         await db.rollback()
         raise HTTPException(
@@ -313,6 +366,16 @@ async def delete_knowledge_base(
             detail=f"Failed to delete knowledge base: {str(e)}"
         )
 
+#SH: Remove the row of a knowledge base whose chunks could not be embedded, chunks already stored are collected too
+async def discard_knowledge(db: AsyncSession, knowledge: KnowledgeBase) -> None:
+    knowledge_id, organization_id = knowledge.id, knowledge.organization_id
+    await db.rollback()
+    kb = await db.get(KnowledgeBase, knowledge_id)
+    if kb is not None:
+        await db.delete(kb)
+        await db.commit()
+    vector_gc.enqueue(organization_id, knowledge_id)
+
 # ==================== CATEGORY AND TAGGING SYSTEM ====================
 
 # Category CRUD operations
@@ -80,4 +80,49 @@ async def update_organization(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Organization update error: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+# SH: Change the embedding provider/model an organization's knowledge is indexed with
+async def update_organization_embedding_config(
+    db: AsyncSession,
+    organization_id: int,
+    embedding_config: dict,
+    current_user_id: str
+):
+    try:
+        result = await db.execute(select(Organization).where(Organization.id == organization_id))
+        db_organization = result.scalars().first()
+
+        if not db_organization:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Organization not found."
+            )
+
+        if db_organization.user_id != current_user_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="You don't have permission to update this organization."
+            )
+
+        db_organization.embedding_config = embedding_config
+
+        await db.commit()
+        await db.refresh(db_organization)
+
+        return db_organization
+
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Organization update error: {str(e)}"
+        )
+
+# SH: Embedding config of every organization that overrides the defaults
+async def get_embedding_configs(db: AsyncSession) -> dict:
+    result = await db.execute(
+        select(Organization.id, Organization.embedding_config)
+        .where(Organization.embedding_config.isnot(None))
+    )
+    return {row.id: row.embedding_config for row in result.all()}
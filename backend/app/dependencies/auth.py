@@ -61,6 +61,17 @@ async def get_current_user(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Authentication error: {str(e)}"
         )
+# SH: Operator-only routes, admins are listed by Clerk user id in ADMIN_USER_IDS
+async def get_current_admin(
+        user: User = Depends(get_current_user)
+) -> User:
+    if user.user_id not in settings.ADMIN_USER_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return user
+
 # SH: Validate if the current user has access to the provided knowledge base IDs
 async def validate_kb_access(
 
@@ -1,4 +1,5 @@
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from dotenv import load_dotenv
 from tenacity import RetryError
@@ -19,6 +20,7 @@ from app.core.dasboard_ws import DashboardWSManager
 from app.routes.endpoints.dashboard_ws import router as dashboard_ws_router
 from app.core.performance_middleware import PerformanceMiddleware
 from app.core.background_task import background_monitor
+from app.core.llm_pool import llm_providers
 from app.routes.endpoints.performance import router as performance_router
 from app.routes.endpoints.dashboard_analytics import router as dashboard_analytics_router
 
@@ -33,8 +35,17 @@ logging.basicConfig(
 # Load environment variables
 load_dotenv()
 
+#SH: The pooled LLM clients and background jobs (vector maintenance, opt-in alerts and metrics cleanup) live as long as the app
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await llm_providers.start()
+    await background_monitor.start()
+    yield
+    await background_monitor.stop()
+    await llm_providers.close()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # ADD PERFORMANCE MIDDLEWARE
 app.add_middleware(PerformanceMiddleware)
@@ -1,11 +1,9 @@
-from typing import List, Optional, Literal
+from typing import List, Optional
 from pydantic import BaseModel, Field, field_validator as validator
 
-ALLOWED_MODELS = ["gpt-4", "gpt-3.5-turbo"]
-
 # MJ: These are Pydantic Models used for Request & Response Validation
 class AgentConfigSchema(BaseModel):
-    model_name: Literal["gpt-4", "gpt-3.5-turbo"] = Field(default="gpt-4", description="Selected LLM model")
+    model_name: str = Field(default="gpt-4", description="Selected LLM model, one of the models the configured providers serve")
     temperature: float = Field(default=0.7, ge=0, le=1)
     max_length: int = Field(default=500, gt=0)
     system_prompt: str = Field(default="You are a helpful assistant")
@@ -17,6 +15,12 @@ class AgentConfigSchema(BaseModel):
     domain_focus: str = Field(default="general",description="Primary domain specialization (e.g., finance, healthcare, customer support)")
     enable_fallback: bool = Field(default=True,description="Enable fallback to simpler model when context is too large")
     max_retries: int = Field(default=2,ge=0,le=5,description="Maximum retries for failed operations")
+    context_compression: Optional[bool] = Field(default=None,description="Keep only the retrieved sentences relevant to the question (None uses the server default)")
+    context_compression_tokens: Optional[int] = Field(default=None,ge=50,le=8000,description="Token budget for compressed context")
+    rerank: Optional[bool] = Field(default=None,description="Rerank a wider candidate set with a cross-encoder (None uses the server default)")
+    rerank_top_n: Optional[int] = Field(default=None,ge=1,le=20,description="Chunks kept after reranking")
+    hedge: Optional[bool] = Field(default=None,description="Also ask the fallback model when the primary runs past its p95 latency (None uses the server default)")
+    single_flight: Optional[bool] = Field(default=None,description="Let identical public widget questions in flight share one answer (None uses the server default)")
     
     # SH: advanced settings for widget
     greeting_message: str = Field(default="Hello! How can I help?", min_length=1, max_length=200)
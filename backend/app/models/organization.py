@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field
+from typing import Any, Dict, Optional
 
 #SH: These are Pydanitc Models used for request & response validation
 class OrganizationBase(BaseModel):
@@ -10,9 +11,17 @@ class OrganizationCreate(OrganizationBase):
 class OrganizationUpdate(OrganizationBase):
     pass
 
+#SH: Embedding provider of an organization, changing it re-embeds the organization's knowledge
+class EmbeddingConfigUpdate(BaseModel):
+    provider: str = Field(..., description="Embedding provider, e.g. openai or local")
+    model: Optional[str] = Field(None, description="Provider model, defaults to the provider's configured model")
+    dimensions: Optional[int] = Field(None, gt=0, description="Reduced vector size, only for models trained for it (text-embedding-3)")
+    dtype: Optional[str] = Field(None, description="float32 or float16, how vectors are held in process")
+
 class OrganizationOut(OrganizationBase):
     id: int
     user_id: str
+    embedding_config: Optional[Dict[str, Any]] = None
 
     class Config:
         from_attributes = True
\ No newline at end of file
@@ -7,6 +7,7 @@ from app.routes.endpoints.widget import router as widget_router
 from app.routes.endpoints.users import router as users_router
 from app.routes.endpoints.analytics import router as analytics_router
 from app.routes.endpoints.dashboard_analytics import router as dashboard_analytics_router
+from app.routes.endpoints.admin import router as admin_router
 
 
 
@@ -21,4 +22,5 @@ router.include_router(users_router, tags=["users"])
 router.include_router(chat_router, tags=["chat"])
 router.include_router(widget_router, tags=["widget"])
 router.include_router(analytics_router, tags=["analytics"])
-router.include_router(dashboard_analytics_router, tags=["dashboard_analytics"])
\ No newline at end of file
+router.include_router(dashboard_analytics_router, tags=["dashboard_analytics"])
+router.include_router(admin_router, tags=["admin"])
\ No newline at end of file
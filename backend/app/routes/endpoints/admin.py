@@ -0,0 +1,111 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from app.db.database import get_db
+from app.dependencies.auth import get_current_admin
+from app.db.models.user import User
+from app.services.vector_maintenance_services import VectorMaintenanceService
+from app.core.vector_maintenance import list_indexed_organizations
+from app.core.reindex import reindex_manager
+from app.db.repository.organization import get_embedding_configs
+from app.core.responses import success_response, error_response
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/admin", tags=["Admin"])
+
+@router.get("/vectors/orphans")
+async def get_orphaned_vectors(
+    organization_id: Optional[int] = Query(None, description="Limit the report to one organization"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_admin)
+):
+    """Report vectors left in organization indexes by deleted knowledge"""
+    try:
+        report = await VectorMaintenanceService.get_orphan_report(db, organization_id)
+        return success_response("Orphaned vector report retrieved successfully", report)
+    except Exception as e:
+        logger.error(f"Error in get_orphaned_vectors: {str(e)}")
+        return error_response(f"Failed to build orphaned vector report: {str(e)}", 500)
+
+@router.post("/vectors/compact")
+async def compact_vector_indexes(
+    organization_id: Optional[int] = Query(None, description="Limit compaction to one organization"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_admin)
+):
+    """Run vector index compaction now instead of waiting for the periodic job"""
+    try:
+        results = await VectorMaintenanceService.compact_indexes(db, organization_id)
+        return success_response("Vector indexes compacted", {"organizations": results})
+    except Exception as e:
+        logger.error(f"Error in compact_vector_indexes: {str(e)}")
+        return error_response(f"Failed to compact vector indexes: {str(e)}", 500)
+
+@router.post("/vectors/shards")
+async def rebalance_vector_shards(
+    organization_id: Optional[int] = Query(None, description="Limit rebalancing to one organization"),
+    shards: Optional[int] = Query(None, gt=0, description="Shard count, defaults to what the index size needs"),
+    shard_by: Optional[str] = Query(None, description="hash or knowledge_base"),
+    current_user: User = Depends(get_current_admin)
+):
+    """Split organization indexes into shards that are searched in parallel, chunks move while reads keep working"""
+    try:
+        results = await VectorMaintenanceService.rebalance_shards(organization_id, shards, shard_by)
+        return success_response("Vector shards rebalanced", {"organizations": results})
+    except ValueError as e:
+        return error_response(str(e), 400)
+    except Exception as e:
+        logger.error(f"Error in rebalance_vector_shards: {str(e)}")
+        return error_response(f"Failed to rebalance vector shards: {str(e)}", 500)
+
+@router.get("/vectors/profiles")
+async def get_index_profiles(
+    organization_id: Optional[int] = Query(None, description="Limit the report to one organization"),
+    current_user: User = Depends(get_current_admin)
+):
+    """Estimated index RAM, disk and recall of organization indexes under smaller embedding profiles"""
+    try:
+        organizations = await VectorMaintenanceService.get_profile_report(organization_id)
+        return success_response("Index profile report retrieved successfully", {"organizations": organizations})
+    except Exception as e:
+        logger.error(f"Error in get_index_profiles: {str(e)}")
+        return error_response(f"Failed to build index profile report: {str(e)}", 500)
+
+@router.get("/vectors/reindex")
+async def get_reindex_status(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_admin)
+):
+    """Embedding model and re-index progress of every organization index"""
+    try:
+        configs = await get_embedding_configs(db)
+        statuses = [reindex_manager.status(org_id, configs.get(org_id)) for org_id in list_indexed_organizations()]
+        return success_response("Re-index status retrieved successfully", {"organizations": statuses})
+    except Exception as e:
+        logger.error(f"Error in get_reindex_status: {str(e)}")
+        return error_response(f"Failed to get re-index status: {str(e)}", 500)
+
+@router.post("/vectors/reindex")
+async def start_reindex(
+    organization_id: Optional[int] = Query(None, description="Re-index one organization, defaults to every stale index"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_admin)
+):
+    """Re-embed organization indexes with their configured embedding model, reads keep using the old index until the swap"""
+    try:
+        configs = await get_embedding_configs(db)
+        organizations = list_indexed_organizations()
+        if organization_id is not None:
+            if organization_id not in organizations:
+                return error_response("Organization has no vector index", 404)
+            organizations = [organization_id]
+        started = [
+            org_id for org_id in reindex_manager.stale_organizations(organizations, configs)
+            if reindex_manager.start(org_id, configs.get(org_id))
+        ]
+        return success_response("Re-index started", {"started": started})
+    except Exception as e:
+        logger.error(f"Error in start_reindex: {str(e)}")
+        return error_response(f"Failed to start re-index: {str(e)}", 500)
@@ -3,7 +3,8 @@ from fastapi import APIRouter, status, Depends, HTTPException, Body
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.responses import success_response, error_response
 from app.dependencies.auth import get_current_user
-from app.models.agent import AgentCreate, AgentOut, ALLOWED_MODELS, AgentConfigSchema
+from app.models.agent import AgentCreate, AgentOut, AgentConfigSchema
+from app.core.llm_pool import llm_providers
 from app.models.knowledge_base import KnowledgeBaseCreate, KnowledgeLinkRequest
 from app.db.repository.agent import get_agents, get_agent, create_agent, update_agent_config, get_agent_count
 from app.db.repository.knowledge_base import create_knowledge_entry
@@ -159,9 +160,9 @@ async def update_agent_configuration(
     current_user: User = Depends(get_current_user)
 ):
     #SH: Validate configuration
-    if config.model_name not in ALLOWED_MODELS:
+    if config.model_name not in llm_providers.models():
         return error_response(
-            message=f"Invalid model selected. Allowed models: {ALLOWED_MODELS}",
+            message=f"Invalid model selected. Allowed models: {llm_providers.models()}",
             http_status=status.HTTP_400_BAD_REQUEST
         )
     if not (0 <= config.temperature <= 1):
@@ -264,7 +265,8 @@ async def chat_with_agent(
             prompt=prompt,
             db= db,
             agent_config=agent.config,
-            knowledge_bases=knowledge_bases  
+            knowledge_bases=knowledge_bases,
+            organization_id=agent.organization_id
         )
         return success_response(
             message="Chat response generated",
@@ -1,6 +1,7 @@
 import logging
 import json
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status, WebSocketException, Depends, HTTPException
+from app.core.cancellation import CANCEL_FRAME, SocketInbox, run_cancellable
 from app.core.websocket_manager import websocket_manager
 from app.dependencies.auth import get_current_user_ws, get_current_user
 from app.db.repository.agent import get_agent
@@ -20,6 +21,26 @@ from app.db.repository.chat import get_user_conversation_count as repo_count
 router = APIRouter(tags=["chat"])
 logger = logging.getLogger(__name__)
 
+#SH: Forwards streamed answer chunks as delta frames of one message
+def delta_sender(websocket: WebSocket, sequence_id: int):
+    async def send_delta(content: str):
+        await websocket.send_json({
+            "type": "delta",
+            "sequence_id": sequence_id,
+            "content": content,
+            "sender": "agent"
+        })
+    return send_delta
+
+#SH: Sent instead of the message frame when the client cancelled the reply, nothing was saved for it
+def cancelled_frame(sequence_id: int) -> dict:
+    return {
+        "type": "cancelled",
+        "sequence_id": sequence_id,
+        "sender": "agent",
+        "timestamp": datetime.datetime.now().isoformat()
+    }
+
 #SH: WebSocket endpoint for chat
 @router.websocket("/ws/chat/{agent_id}")
 async def websocket_endpoint(websocket: WebSocket, agent_id: int):
@@ -123,11 +144,13 @@ async def websocket_endpoint(websocket: WebSocket, agent_id: int):
                 return
 
             last_status_check = datetime.datetime.now()
+            #SH: Messages sent while a reply is generating wait here and are answered in order
+            inbox = SocketInbox(websocket)
 
             #SH: Modified message handling loop
             while True:
                 try:
-                    message = await websocket.receive()
+                    message = await inbox.receive()
                     if "text" not in message:
                         continue
 
@@ -136,6 +159,9 @@ async def websocket_endpoint(websocket: WebSocket, agent_id: int):
                         logger.debug(f"Received raw data: {data}")
                     except json.JSONDecodeError:
                         data = {"content": message["text"], "sequence_id": None}
+                    #SH: Nothing is being generated, a late cancel has nothing to stop
+                    if data.get("type") == CANCEL_FRAME:
+                        continue
                     #SH: Don't process empty messages
                     if "content" not in data:
                         await websocket.send_json({
@@ -169,19 +195,27 @@ async def websocket_endpoint(websocket: WebSocket, agent_id: int):
                         await update_conversation_title(db, conversation_id, new_title)
                         is_new_conversation = False  # Only update once
 
-                    response = await service_process_agent_message(
+                    stream = data.get("stream", settings.LLM_STREAMING_ENABLED)
+                    #SH: Generation runs as a task the client can stop with a cancel frame or by leaving
+                    response = await run_cancellable(inbox, service_process_agent_message(
                         user_id=user.user_id,
                         agent_id=agent_id,
                         message=message_content,
                         sequence_id=seq_id,
                         db=db,
-                        conversation_id=conversation_id
-                    )
+                        conversation_id=conversation_id,
+                        on_delta=delta_sender(websocket, seq_id) if stream else None
+                    ))
+                    if response is None:
+                        await websocket.send_json(cancelled_frame(seq_id))
+                        continue
+                    #SH: The final frame carries the full text and metadata, streamed or not
                     await websocket.send_json({
                         "type": "message",
                         "sequence_id": seq_id,
                         "content": response["content"],
                         "sender": "agent",
+                        "streamed": bool(stream),
                         "timestamp": datetime.datetime.now().isoformat(),
                         "metadata": response.get("metadata", {})
                     })
@@ -330,10 +364,12 @@ async def continue_conversation_endpoint(websocket: WebSocket, conversation_id:
             return
 
         last_status_check = datetime.datetime.now()
+        #SH: Messages sent while a reply is generating wait here and are answered in order
+        inbox = SocketInbox(websocket)
 
         while True:
             try:
-                message = await websocket.receive()
+                message = await inbox.receive()
                 if "text" not in message:
                     continue
 
@@ -343,6 +379,8 @@ async def continue_conversation_endpoint(websocket: WebSocket, conversation_id:
                 except json.JSONDecodeError:
                     data = {"content": message["text"], "sequence_id": None}
 
+                if data.get("type") == CANCEL_FRAME:
+                    continue
                 if "content" not in data:
                     await websocket.send_json({
                         "type": "error",
@@ -367,19 +405,27 @@ async def continue_conversation_endpoint(websocket: WebSocket, conversation_id:
 
                 logger.info(f"Processing message seq {seq_id}: {message_content[:50]}...")
 
-                response = await service_process_agent_message(
+                stream = data.get("stream", settings.LLM_STREAMING_ENABLED)
+                #SH: Generation runs as a task the client can stop with a cancel frame or by leaving
+                response = await run_cancellable(inbox, service_process_agent_message(
                     user_id=user.user_id,
                     agent_id=agent_id,
                     message=message_content,
                     sequence_id=seq_id,
                     db=db,
-                    conversation_id=conversation_id
-                )
+                    conversation_id=conversation_id,
+                    on_delta=delta_sender(websocket, seq_id) if stream else None
+                ))
+                if response is None:
+                    await websocket.send_json(cancelled_frame(seq_id))
+                    continue
+                #SH: The final frame carries the full text and metadata, streamed or not
                 await websocket.send_json({
                     "type": "message",
                     "sequence_id": seq_id,
                     "content": response["content"],
                     "sender": "agent",
+                    "streamed": bool(stream),
                     "timestamp": datetime.datetime.now().isoformat(),
                     "metadata": response.get("metadata", {})
                 })
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.database import get_db
-from app.db.repository.organization import create_organization, get_organization, update_organization
-from app.models.organization import OrganizationCreate, OrganizationOut, OrganizationUpdate
+from app.db.repository.organization import create_organization, get_organization, update_organization, update_organization_embedding_config
+from app.models.organization import EmbeddingConfigUpdate, OrganizationCreate, OrganizationOut, OrganizationUpdate
 from app.dependencies.auth import get_current_user
+from app.core.embeddings import resolve_embedding_config
+from app.core.reindex import reindex_manager
 
 # SH: This is our Main Router for all the routes related to Organization
 router = APIRouter(
@@ -67,3 +69,26 @@ async def update_existing_organization(
     )
     
     return updated_organization
+
+#SH: Route to pick the embedding provider, knowledge is re-embedded in the background and swapped in when done
+@router.put("/{organization_id}/embedding", response_model=OrganizationOut)
+async def update_organization_embedding(
+    organization_id: int,
+    embedding: EmbeddingConfigUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    try:
+        embedding_config = resolve_embedding_config(embedding.model_dump(exclude_none=True))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    updated_organization = await update_organization_embedding_config(
+        db,
+        organization_id,
+        embedding_config,
+        current_user.user_id
+    )
+    reindex_manager.start(organization_id, embedding_config)
+
+    return updated_organization
@@ -6,6 +6,18 @@ from app.dependencies.auth import get_current_user
 from app.db.models.user import User
 from app.services.performance_services import PerformanceService
 from app.core.responses import success_response, error_response
+from app.core.embedding_cache import embedding_cache
+from app.core.response_cache import response_cache
+from app.core.conversation_context import conversation_retrieval_cache
+from app.core.context_compressor import context_compressor
+from app.core.reranker import reranker
+from app.core.single_flight import single_flight
+from app.core.model_router import model_router
+from app.services.memory_services import conversation_summarizer
+from app.core.llm_admission import llm_admission, llm_retry_policy
+from app.core.llm_pool import llm_providers
+from app.core.vector_store import get_embedding_batching_stats
+from app.core.vector_tiers import vector_tiers
 import logging
 
 logger = logging.getLogger(__name__)
@@ -89,6 +101,126 @@ async def get_time_series_metrics(
             }
         )
 
+@router.get("/embedding-cache")
+async def get_embedding_cache_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Get hit-rate metrics for the query embedding cache of this worker"""
+    return success_response(
+        "Embedding cache stats retrieved successfully",
+        embedding_cache.stats()
+    )
+
+@router.get("/response-cache")
+async def get_response_cache_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Get hit-rate metrics for the public agent response cache of this worker"""
+    return success_response(
+        "Response cache stats retrieved successfully",
+        response_cache.stats()
+    )
+
+@router.get("/conversation-retrieval")
+async def get_conversation_retrieval_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Get how often follow-up messages reused or extended the retrieved context of their conversation in this worker"""
+    return success_response(
+        "Conversation retrieval stats retrieved successfully",
+        conversation_retrieval_cache.stats()
+    )
+
+@router.get("/context-compression")
+async def get_context_compression_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Get how much retrieved context this worker's sentence compression removed and what it cost in latency"""
+    return success_response(
+        "Context compression stats retrieved successfully",
+        context_compressor.stats()
+    )
+
+@router.get("/reranker")
+async def get_reranker_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Get how many candidates this worker's cross-encoder reranked and how long it took"""
+    return success_response(
+        "Reranker stats retrieved successfully",
+        reranker.stats()
+    )
+
+@router.get("/llm-pool")
+async def get_llm_pool_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Get connection reuse and pool wait times of this worker's LLM clients, per provider"""
+    return success_response(
+        "LLM pool stats retrieved successfully",
+        llm_providers.stats()
+    )
+
+@router.get("/single-flight")
+async def get_single_flight_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Get how many public widget requests shared an identical in-flight answer on this worker"""
+    return success_response(
+        "Single-flight stats retrieved successfully",
+        single_flight.stats()
+    )
+
+@router.get("/model-router")
+async def get_model_router_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Get circuit state, error rate and p95 latency per model and how often each route served on this worker"""
+    return success_response(
+        "Model router stats retrieved successfully",
+        model_router.stats()
+    )
+
+@router.get("/conversation-memory")
+async def get_conversation_memory_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Get how often this worker refreshed rolling conversation summaries"""
+    return success_response(
+        "Conversation memory stats retrieved successfully",
+        conversation_summarizer.stats()
+    )
+
+@router.get("/llm-admission")
+async def get_llm_admission_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Get queueing, rate limiting and retry numbers of this worker's LLM admission control"""
+    return success_response(
+        "LLM admission stats retrieved successfully",
+        {**llm_admission.stats(), "retry": llm_retry_policy.stats()}
+    )
+
+@router.get("/embedding-batching")
+async def get_embedding_batching_stats_route(
+    current_user: User = Depends(get_current_user)
+):
+    """Get how many query embeddings were coalesced per provider call in this worker"""
+    return success_response(
+        "Embedding batching stats retrieved successfully",
+        get_embedding_batching_stats()
+    )
+
+@router.get("/vector-tiers")
+async def get_vector_tier_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """Get how much of each organization index this worker holds in RAM and how often searches hit it"""
+    return success_response(
+        "Vector tier stats retrieved successfully",
+        vector_tiers.stats()
+    )
+
 @router.post("/alerts/check")
 async def trigger_alert_check(
     db: AsyncSession = Depends(get_db),
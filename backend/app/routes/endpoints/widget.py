@@ -1,4 +1,5 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status, logger
+from app.core.cancellation import CANCEL_FRAME, SocketInbox, run_cancellable
 from app.core.websocket_manager import widget_manager
 from app.services.widget_services import WidgetService
 from app.db.database import get_db
@@ -13,6 +14,12 @@ widget_service = WidgetService()
 
 logger = logging.getLogger(__name__)
 
+# SH: Streamed answer chunks go out as delta frames, the final message frame still carries the full text
+def delta_sender(websocket: WebSocket):
+    async def send_delta(content: str):
+        await websocket.send_json({"type": "delta", "content": content, "sender": "agent"})
+    return send_delta
+
 # SH: This is our WebSocket endpoint for the public widget
 @router.websocket("/ws/public/{agent_id}")
 async def public_widget_websocket(
@@ -45,10 +52,16 @@ async def public_widget_websocket(
             "timestamp": datetime.now().isoformat()
         })
 
+        # SH: Messages sent while a reply is generating wait here and are answered in order
+        inbox = SocketInbox(websocket)
+
         while True:
             try:
-                data = await websocket.receive_json()
-                
+                data = await inbox.receive_json()
+
+                # SH: Nothing is being generated, a late cancel has nothing to stop
+                if data.get("type") == CANCEL_FRAME:
+                    continue
                 if "content" not in data:
                     await websocket.send_json({
                         "type": "error",
@@ -56,14 +69,25 @@ async def public_widget_websocket(
                     })
                     continue
 
-                response = await widget_service.process_public_widget_message(
+                stream = data.get("stream", settings.LLM_STREAMING_ENABLED)
+                # SH: Generation runs as a task the visitor can stop with a cancel frame or by closing the widget
+                response = await run_cancellable(inbox, widget_service.process_public_widget_message(
                     db=db,
                     agent_id=agent_id,
-                    message=data["content"]
-                )
+                    message=data["content"],
+                    on_delta=delta_sender(websocket) if stream else None
+                ))
+                if response is None:
+                    await websocket.send_json({
+                        "type": "cancelled",
+                        "sender": "agent",
+                        "timestamp": datetime.now().isoformat()
+                    })
+                    continue
                 await websocket.send_json({
                     "type": "message",
                     "content": response["content"],
+                    "streamed": bool(stream),
                     "sender": "agent",
                     "timestamp": datetime.now().isoformat(),
                     "metadata": response.get("metadata", {})
@@ -9,6 +9,7 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 import logging
 from app.core.config import settings
+from app.core.llm import GenerationProgress, get_model_pricing
 from fastapi import HTTPException, status
 
 logger = logging.getLogger(__name__)
@@ -18,16 +19,30 @@ class AnalyticsService:
     @staticmethod
     async def record_chat_metric(
         db: AsyncSession,
-        conversation_id: int,
+        conversation_id: Optional[int],
         agent_id: int,
-        user_id: str,
+        user_id: Optional[str],
         organization_id: int,
         response_time_ms: float,
         message_length: int,
         tokens_used: int = 0,
         cost: float = 0.0,
         knowledge_base_hits: int = 0,
-        model_used: str = None
+        model_used: str = None,
+        cache_hit: bool = False,
+        tokens_saved: int = 0,
+        latency_saved_ms: float = 0.0,
+        coalesced: bool = False,
+        cancelled: bool = False,
+        route: Optional[str] = None,
+        prompt_tokens: int = 0,
+        context_tokens: int = 0,
+        raw_context_tokens: int = 0,
+        uncompressed_context_tokens: Optional[int] = None,
+        context_compressed: bool = False,
+        reranked: bool = False,
+        rerank_ms: float = 0.0,
+        time_to_first_token_ms: Optional[float] = None
     ):
         """Record individual chat interaction metrics"""
         try:
@@ -39,11 +54,25 @@ class AnalyticsService:
                 user_id=user_id,
                 organization_id=organization_id,
                 response_time_ms=response_time_ms,
+                time_to_first_token_ms=time_to_first_token_ms,
                 message_length=message_length,
                 tokens_used=tokens_used,
+                prompt_tokens=prompt_tokens,
+                context_tokens=context_tokens,
+                raw_context_tokens=raw_context_tokens,
+                uncompressed_context_tokens=context_tokens if uncompressed_context_tokens is None else uncompressed_context_tokens,
+                context_compressed=context_compressed,
+                reranked=reranked,
+                rerank_ms=rerank_ms,
                 cost=cost,
                 knowledge_base_hits=knowledge_base_hits,
                 model_used=model_used or settings.FALLBACK_MODEL,
+                cache_hit=cache_hit,
+                tokens_saved=tokens_saved,
+                latency_saved_ms=latency_saved_ms,
+                coalesced=coalesced,
+                cancelled=cancelled,
+                route=route,
                 date_bucket=now.strftime("%Y-%m-%d"),
                 hour_bucket=now.hour
             )
@@ -56,6 +85,27 @@ class AnalyticsService:
             await db.rollback()
             logger.error(f"Failed to record chat metric: {str(e)}")
 
+    @staticmethod
+    async def record_cancelled_chat(
+        db: AsyncSession,
+        progress: GenerationProgress,
+        started_at: datetime,
+        **fields
+    ):
+        """Record a reply the client abandoned, with the tokens and cost it had used when it was cancelled"""
+        usage = progress.usage()
+        await AnalyticsService.record_chat_metric(
+            db=db,
+            response_time_ms=(datetime.utcnow() - started_at).total_seconds() * 1000,
+            tokens_used=usage["total_tokens"],
+            prompt_tokens=usage["prompt_tokens"],
+            cost=progress.cost(),
+            model_used=progress.model_used(),
+            cancelled=True,
+            **fields
+        )
+        logger.info(f"Reply for agent {fields.get('agent_id')} cancelled after {usage['total_tokens']} tokens")
+
     @staticmethod
     async def get_agent_performance_summary(
         db: AsyncSession,
@@ -87,10 +137,19 @@ class AnalyticsService:
                     func.avg(ChatMetrics.response_time_ms).label('avg_response_time'),
                     func.min(ChatMetrics.response_time_ms).label('min_response_time'),
                     func.max(ChatMetrics.response_time_ms).label('max_response_time'),
+                    func.avg(ChatMetrics.time_to_first_token_ms).label('avg_time_to_first_token'),
                     func.sum(ChatMetrics.tokens_used).label('total_tokens'),
                     func.sum(ChatMetrics.cost).label('total_cost'),
                     func.avg(ChatMetrics.message_length).label('avg_message_length'),
-                    func.sum(ChatMetrics.knowledge_base_hits).label('total_kb_hits')
+                    func.sum(ChatMetrics.knowledge_base_hits).label('total_kb_hits'),
+                    func.count(ChatMetrics.id).filter(ChatMetrics.cache_hit == True).label('cache_hits'),
+                    func.sum(ChatMetrics.tokens_saved).label('total_tokens_saved'),
+                    func.sum(ChatMetrics.latency_saved_ms).label('total_latency_saved'),
+                    func.count(ChatMetrics.id).filter(ChatMetrics.coalesced == True).label('coalesced'),
+                    func.count(ChatMetrics.id).filter(ChatMetrics.cancelled == True).label('cancelled'),
+                    func.avg(ChatMetrics.prompt_tokens).label('avg_prompt_tokens'),
+                    func.sum(ChatMetrics.context_tokens).label('total_context_tokens'),
+                    func.sum(ChatMetrics.raw_context_tokens).label('total_raw_context_tokens')
                 ).where(
                     and_(
                         ChatMetrics.agent_id == agent_id,
@@ -115,6 +174,87 @@ class AnalyticsService:
                 )
             )
             conv_metrics = conv_result.first()
+
+            # Compression savings per model, context tokens are billed at the model's input price
+            compression_result = await db.execute(
+                select(
+                    ChatMetrics.model_used,
+                    func.count(ChatMetrics.id).label('messages'),
+                    func.sum(ChatMetrics.uncompressed_context_tokens).label('uncompressed_tokens'),
+                    func.sum(ChatMetrics.context_tokens).label('context_tokens')
+                ).where(
+                    and_(
+                        ChatMetrics.agent_id == agent_id,
+                        ChatMetrics.context_compressed == True,
+                        ChatMetrics.date_bucket >= start_date,
+                        ChatMetrics.date_bucket <= end_date
+                    )
+                ).group_by(ChatMetrics.model_used)
+            )
+            compressed_messages = uncompressed_tokens = compressed_tokens = 0
+            compression_cost_saved = 0.0
+            for row in compression_result:
+                saved = (row.uncompressed_tokens or 0) - (row.context_tokens or 0)
+                compressed_messages += row.messages
+                uncompressed_tokens += row.uncompressed_tokens or 0
+                compressed_tokens += row.context_tokens or 0
+                compression_cost_saved += saved * get_model_pricing(row.model_used)["input"]
+
+            # Reranked against plain retrieval side by side, the net effect on prompt size and latency
+            rerank_result = await db.execute(
+                select(
+                    ChatMetrics.reranked,
+                    func.count(ChatMetrics.id).label('messages'),
+                    func.avg(ChatMetrics.prompt_tokens).label('avg_prompt_tokens'),
+                    func.avg(ChatMetrics.context_tokens).label('avg_context_tokens'),
+                    func.avg(ChatMetrics.response_time_ms).label('avg_response_time'),
+                    func.avg(ChatMetrics.rerank_ms).label('avg_rerank_ms')
+                ).where(
+                    and_(
+                        ChatMetrics.agent_id == agent_id,
+                        ChatMetrics.cache_hit == False,
+                        ChatMetrics.coalesced == False,
+                        ChatMetrics.cancelled == False,
+                        ChatMetrics.date_bucket >= start_date,
+                        ChatMetrics.date_bucket <= end_date
+                    )
+                ).group_by(ChatMetrics.reranked)
+            )
+            reranking = {
+                ("reranked" if row.reranked else "not_reranked"): {
+                    "messages": row.messages,
+                    "avg_prompt_tokens": round(row.avg_prompt_tokens or 0, 1),
+                    "avg_context_tokens": round(row.avg_context_tokens or 0, 1),
+                    "avg_response_time_ms": round(row.avg_response_time or 0, 2),
+                    "avg_rerank_ms": round(row.avg_rerank_ms or 0, 2)
+                }
+                for row in rerank_result
+            }
+
+            # Model router paths, tail latency per route shows what fallback and hedging bought
+            route_result = await db.execute(
+                select(
+                    ChatMetrics.route,
+                    func.count(ChatMetrics.id).label('messages'),
+                    func.avg(ChatMetrics.response_time_ms).label('avg_response_time'),
+                    func.max(ChatMetrics.response_time_ms).label('max_response_time')
+                ).where(
+                    and_(
+                        ChatMetrics.agent_id == agent_id,
+                        ChatMetrics.route.isnot(None),
+                        ChatMetrics.date_bucket >= start_date,
+                        ChatMetrics.date_bucket <= end_date
+                    )
+                ).group_by(ChatMetrics.route)
+            )
+            routes = {
+                row.route: {
+                    "messages": row.messages,
+                    "avg_response_time_ms": round(row.avg_response_time or 0, 2),
+                    "max_response_time_ms": round(row.max_response_time or 0, 2)
+                }
+                for row in route_result
+            }
             
             # Get daily trends
             daily_trends = await db.execute(
@@ -142,14 +282,40 @@ class AnalyticsService:
                     "avg_response_time_ms": round(metrics.avg_response_time or 0, 2),
                     "min_response_time_ms": metrics.min_response_time or 0,
                     "max_response_time_ms": metrics.max_response_time or 0,
+                    "avg_time_to_first_token_ms": round(metrics.avg_time_to_first_token or 0, 2),
                     "total_tokens_used": metrics.total_tokens or 0,
                     "total_cost_usd": round(metrics.total_cost or 0, 4),
                     "avg_message_length": round(metrics.avg_message_length or 0, 1),
                     "avg_messages_per_conversation": round(conv_metrics.avg_messages_per_conversation or 0, 1),
                     "knowledge_base_usage_rate": round(
                         (metrics.total_kb_hits or 0) / max(metrics.total_interactions or 1, 1) * 100, 1
-                    )
+                    ),
+                    "cache_hits": metrics.cache_hits or 0,
+                    "cache_hit_rate": round(
+                        (metrics.cache_hits or 0) / max(metrics.total_interactions or 1, 1) * 100, 1
+                    ),
+                    "total_tokens_saved": metrics.total_tokens_saved or 0,
+                    "total_latency_saved_ms": round(metrics.total_latency_saved or 0, 2),
+                    "coalesced_requests": metrics.coalesced or 0,
+                    "coalesced_rate": round(
+                        (metrics.coalesced or 0) / max(metrics.total_interactions or 1, 1) * 100, 1
+                    ),
+                    "cancelled_requests": metrics.cancelled or 0,
+                    "avg_prompt_tokens": round(metrics.avg_prompt_tokens or 0, 1),
+                    "context_token_reduction_percent": round(
+                        (1 - (metrics.total_context_tokens or 0) / metrics.total_raw_context_tokens) * 100, 1
+                    ) if metrics.total_raw_context_tokens else 0.0,
+                    "compressed_messages": compressed_messages,
+                    "avg_compression_tokens_saved": round(
+                        (uncompressed_tokens - compressed_tokens) / compressed_messages, 1
+                    ) if compressed_messages else 0.0,
+                    "compression_reduction_percent": round(
+                        (1 - compressed_tokens / uncompressed_tokens) * 100, 1
+                    ) if uncompressed_tokens else 0.0,
+                    "compression_cost_saved_usd": round(compression_cost_saved, 4)
                 },
+                "reranking": reranking,
+                "routes": routes,
                 "daily_trends": [
                     {
                         "date": row.date_bucket,
@@ -291,7 +457,9 @@ class AnalyticsService:
                     ChatMetrics.tokens_used,
                     ChatMetrics.cost,
                     ChatMetrics.knowledge_base_hits,
-                    ChatMetrics.model_used
+                    ChatMetrics.model_used,
+                    ChatMetrics.cache_hit,
+                    ChatMetrics.tokens_saved
                 ).select_from(
                     ChatMetrics.__table__.join(Agent, ChatMetrics.agent_id == Agent.id)
                 ).where(
@@ -313,7 +481,9 @@ class AnalyticsService:
                     "tokens_used": row.tokens_used,
                     "cost_usd": row.cost,
                     "knowledge_base_hits": row.knowledge_base_hits,
-                    "model_used": row.model_used
+                    "model_used": row.model_used,
+                    "cache_hit": bool(row.cache_hit),
+                    "tokens_saved": row.tokens_saved or 0
                 }
                 for row in result
             ]
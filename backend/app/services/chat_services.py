@@ -1,11 +1,12 @@
-from tenacity import retry, stop_after_attempt, wait_exponential
+import asyncio
 from fastapi import HTTPException, WebSocketException, status
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from app.core.llm import OpenAIClient
+from app.core.llm import GenerationProgress, llm_client
+from app.core.model_router import route_options
 import openai
-from app.db.repository.chat import create_chat_message, create_conversation, get_conversation_by_id
+from app.db.repository.chat import create_chat_message, create_conversation, get_conversation_by_id, save_cancelled_reply
 from app.db.database import AsyncSession
-from app.core.vector_store import get_organization_vector_store
+from app.services.rag_services import build_rag_context
 from app.core.config import settings
 from sqlalchemy import select, func
 from app.db.models.chat import ChatMessage, Conversation
@@ -14,23 +15,20 @@ import logging
 from sqlalchemy.orm import selectinload
 from app.core.exceptions import network_exception
 from datetime import datetime  
+from typing import Awaitable, Callable, Optional
 from app.services.analytics_services import AnalyticsService
+from app.services.memory_services import build_history, conversation_summarizer, with_history
 
 logger = logging.getLogger(__name__)
 
-
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-    reraise=True
-)
 async def process_agent_response(
     user_id: str,
     agent_id: int,
     message: str,
     sequence_id: int,
     db: AsyncSession,
-    conversation_id: int
+    conversation_id: int,
+    on_delta: Optional[Callable[[str], Awaitable[None]]] = None
 ) -> dict:
     # Step 1: Start time for response duration
     start_time = datetime.utcnow()
@@ -64,12 +62,17 @@ async def process_agent_response(
                 reason=f"Invalid message sequence. Expected {last_seq + 1}, but received {sequence_id}."
             )
 
-        # Step 5: Create RAG context
-        logger.debug(f"Initializing vector store for org {agent.organization_id}")
-        vector_store = get_organization_vector_store(agent.organization_id)
-        docs = await vector_store.asimilarity_search(message, k=3)
-        context = "\n".join([doc.page_content for doc in docs])
-        full_prompt = f"Context: {context}\n\nQuestion: {message}"
+        # Step 5: Create RAG context, packed into the agent's token budget
+        model = agent.config.get("model_name", "gpt-4")
+        system_prompt = agent.config.get("system_prompt", "You are a helpful assistant")
+        max_tokens = agent.config.get("max_length", 500)
+        # Earlier turns go in as a rolling summary plus the last few messages, so the prompt stays the same size
+        history = await build_history(db, conversation_id, sequence_id, model)
+        logger.debug(f"Building RAG context from vector store of org {agent.organization_id}")
+        packed = await build_rag_context(
+            agent, message, model, system_prompt, max_tokens, conversation_id=conversation_id, history_tokens=history.tokens
+        )
+        full_prompt = with_history(history, f"Context: {packed.text}\n\nQuestion: {message}")
 
         # Step 6: Save user message
         await create_chat_message(db, {
@@ -81,15 +84,43 @@ async def process_agent_response(
             "conversation_id": conversation_id
         })
 
-        # Step 7: Generate agent response using LLM
-        llm_client = OpenAIClient()
-        response = await llm_client.generate(
-            model=agent.config.get("model_name", "gpt-4"),
+        # Step 7: Generate agent response using LLM, streamed to on_delta when the caller wants deltas, routed to
+        # the fallback model when the agent's model is failing or slow
+        completion = dict(
+            model=model,
             prompt=full_prompt,
-            system_prompt=agent.config.get("system_prompt", "You are a helpful assistant"),
+            system_prompt=system_prompt,
             temperature=agent.config.get("temperature", 0.7),
-            max_tokens=agent.config.get("max_length", 500)
+            max_tokens=max_tokens,
+            organization_id=agent.organization_id
         )
+        progress = GenerationProgress()
+        try:
+            response = await llm_client.generate_routed(on_delta=on_delta, progress=progress, **route_options(agent), **completion)
+        except asyncio.CancelledError:
+            # The client left or cancelled: the partial reply closes the turn, flagged so the next prompt skips it
+            await save_cancelled_reply(db, {
+                "content": progress.text(),
+                "sender": "agent",
+                "user_id": user_id,
+                "agent_id": agent_id,
+                "sequence_id": sequence_id + 1,
+                "conversation_id": conversation_id
+            })
+            await AnalyticsService.record_cancelled_chat(
+                db,
+                progress,
+                start_time,
+                conversation_id=conversation_id,
+                agent_id=agent_id,
+                user_id=user_id,
+                organization_id=agent.organization_id,
+                message_length=len(message),
+                knowledge_base_hits=len(packed.documents),
+                context_tokens=packed.tokens,
+                raw_context_tokens=packed.raw_tokens
+            )
+            raise
 
         # Calculate response time
         end_time = datetime.utcnow()
@@ -104,6 +135,7 @@ async def process_agent_response(
             "sequence_id": sequence_id + 1,
             "conversation_id": conversation_id
         })
+        conversation_summarizer.schedule(conversation_id, agent.organization_id)
 
         # Step 9: Record analytics
         await AnalyticsService.record_chat_metric(
@@ -116,18 +148,30 @@ async def process_agent_response(
             message_length=len(message),
             tokens_used=response.get("usage", {}).get("total_tokens", 0),
             cost=response.get("cost", 0),
-            knowledge_base_hits=len(docs),
-            model_used=agent.config.get("model_name", "gpt-4")
+            knowledge_base_hits=len(packed.documents),
+            model_used=response.get("model", model),
+            route=response.get("route"),
+            prompt_tokens=response.get("usage", {}).get("prompt_tokens", 0),
+            context_tokens=packed.tokens,
+            raw_context_tokens=packed.raw_tokens,
+            time_to_first_token_ms=response.get("time_to_first_token_ms"),
+            uncompressed_context_tokens=packed.uncompressed_tokens,
+            context_compressed=packed.compressed,
+            reranked=packed.reranked,
+            rerank_ms=packed.rerank_ms
         )
 
         # Step 10: Return response to frontend
         return {
             "content": response["content"],
             "metadata": {
-                "model": agent.config.get("model_name"),
+                "model": response.get("model", model),
+                "route": response.get("route"),
                 "tokens_used": response.get("usage", {}).get("total_tokens", 0),
+                "context_tokens": packed.tokens,
                 "cost": response.get("cost", 0),
                 "response_time_ms": round(response_time_ms, 2),  # Return response time
+                "time_to_first_token_ms": round(response["time_to_first_token_ms"], 2) if response.get("time_to_first_token_ms") else None,
                 "sources": await get_knowledge_sources(agent.knowledge_bases),
                 "theme_color": agent.theme_color,
                 "greeting": agent.greeting_message,
@@ -145,7 +189,7 @@ async def process_agent_response(
         raise WebSocketException(
             code=status.WS_1011_INTERNAL_ERROR,
             reason=str(e)
-        )
+        ) from e
 
 #SH: Validate message sequence against DB history
 async def validate_message_sequence(db: AsyncSession, user_id: str, agent_id: int, received_seq: int, conversation_id: int):
@@ -1,3 +1,4 @@
+import re
 import logging
 from fastapi import HTTPException
 from langchain_community.document_loaders import(
@@ -9,19 +10,19 @@ from langchain_community.document_loaders import(
     UnstructuredExcelLoader  # XLS/XLSX
 )
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
 from sqlalchemy import select
-from app.core import vector_store
 from app.core.config import settings
 from app.core.exceptions import openai_exception
-from app.core.vector_store import get_organization_vector_store
+from app.core.vector_store import get_organization_vector_store, search_with_relevance_scores
+from app.core.vector_maintenance import aindex_write, index_write
+from app.core.embedding_cache import TTLCache
 import chardet # type: ignore
 from typing import Optional, List
 from app.models.knowledge_base import KnowledgeSearchRequest, KnowledgeURL, TextKnowledgeRequest, YouTubeKnowledgeRequest
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.core.url_processor import URLProcessor
+from app.core.url_processer import URLProcessor
 from app.core.pdf_utils import save_content_as_pdf
-from app.db.repository.knowledge_base import create_category, create_tag, create_text_knowledge, create_url_knowledge, create_youtube_knowledge, delete_category, delete_tag, get_categories, get_category, get_category_tree, get_knowledge_by_category, get_knowledge_by_tag, get_tag, get_tags, search_knowledge, update_category, update_knowledge_categories_tags, update_tag
+from app.db.repository.knowledge_base import create_category, create_tag, create_text_knowledge, create_url_knowledge, create_youtube_knowledge, delete_category, discard_knowledge, delete_tag, get_categories, get_category, get_category_tree, get_knowledge_by_category, get_knowledge_by_tag, get_tag, get_tags, search_knowledge, update_category, update_knowledge_categories_tags, update_tag
 import os
 from app.core.youtube_processor import YouTubeProcessor
 import hashlib
@@ -33,9 +34,6 @@ from app.models.knowledge_base import (
 
 logger = logging.getLogger(__name__)
 
-#SH: Initialize OpenAI Embeddings using API key
-embeddings = OpenAIEmbeddings(openai_api_key=settings.OPENAI_API_KEY)
-
 #SH: Setup text splitter: splits large documents into smaller overlapping chunks
 text_splitter = RecursiveCharacterTextSplitter(
     chunk_size=1000,
@@ -104,6 +102,35 @@ def get_safe_loader(file_path: str, content_type: str):
                 continue
         raise ValueError(f"Could not decode file with any supported encoding")
 
+#SH: Chunk metadata, knowledge_id is what lets retrieval merge chunks and deletion find them again
+def chunk_metadatas(chunk_count: int, knowledge_id: int, organization_id: int, source: str) -> List[dict]:
+    return [
+        {
+            "chunk_index": i,
+            "knowledge_id": knowledge_id,
+            "organization_id": organization_id,
+            "source": source
+        }
+        for i in range(chunk_count)
+    ]
+
+#SH: Embed and store the chunks of a knowledge base, its row is removed again if that fails so no orphan is left
+async def add_knowledge_chunks(db: AsyncSession, knowledge, chunks: List[str], organization_id: int, source: str):
+    knowledge_id = knowledge.id
+    vector_store = get_organization_vector_store(organization_id)
+    try:
+        async with aindex_write(organization_id):
+            await vector_store.aadd_texts(
+                chunks,
+                metadatas=chunk_metadatas(len(chunks), knowledge_id, organization_id, source)
+            )
+    except Exception:
+        try:
+            await discard_knowledge(db, knowledge)
+        except Exception as e:
+            logger.error(f"Could not remove knowledge {knowledge_id} after a failed ingestion: {e}")
+        raise
+
 #SH: Main function to process a file and store its embeddings
 def process_file(file_path: str, content_type: str, organization_id: int, knowledge_base_id: int) -> int:
     try:
@@ -119,16 +146,12 @@ def process_file(file_path: str, content_type: str, organization_id: int, knowle
             chunks = text_splitter.split_documents(documents)
 
             # SH: Add the processed chunks into the organization's vector store with metadata
-            for i, chunk in enumerate(chunks):
-                vector_store.add_texts(
-                    texts=[chunk.page_content],
-                    metadatas=[{
-                        "chunk_index": i,
-                        "knowledge_id": knowledge_base_id,
-                        "organization_id": organization_id,
-                        "source": file_path
-                    }]
-                )
+            if chunks:
+                with index_write(organization_id):
+                    vector_store.add_texts(
+                        texts=[chunk.page_content for chunk in chunks],
+                        metadatas=chunk_metadatas(len(chunks), knowledge_base_id, organization_id, file_path)
+                    )
 
             # SH: Return number of chunks created
             return len(chunks)
@@ -162,10 +185,6 @@ async def process_url(url_data: KnowledgeURL, organization_id: int, db: AsyncSes
         #SH: Split the content into chunks for vector storage
         chunks = text_splitter.split_text(content)
         chunk_count = len(chunks)
-        
-        #SH: Store in vector store
-        vector_store = get_organization_vector_store(organization_id)
-        await vector_store.aadd_texts(chunks)
 
         #SH: Save PDF in domain-specific subfolder
         pdf_relative_path = save_content_as_pdf(
@@ -201,6 +220,9 @@ async def process_url(url_data: KnowledgeURL, organization_id: int, db: AsyncSes
             format=url_data.format
         )
 
+        #SH: Store in vector store
+        await add_knowledge_chunks(db, url_knowledge, chunks, organization_id, pdf_relative_path)
+
         return {
             "url": url_data.url,
             "chunk_count": chunk_count,
@@ -277,13 +299,9 @@ async def process_youtube(
         chunk_count = len(chunks)
         logger.info(f"Created {chunk_count} chunks for video {video_id}")
 
-        if chunk_count > 0:
-            vector_store = get_organization_vector_store(organization_id)
-            await vector_store.aadd_texts(chunks)
-
         #SH: Save to database
         filename = os.path.basename(pdf_relative_path)
-        await create_youtube_knowledge(
+        youtube_knowledge = await create_youtube_knowledge(
             db=db,
             name=youtube_data.name or metadata.get('title', 'YouTube Video'),
             video_url=str(youtube_data.video_url),
@@ -294,6 +312,11 @@ async def process_youtube(
             format=youtube_data.format
         )
 
+        if chunk_count > 0:
+            await add_knowledge_chunks(db, youtube_knowledge, chunks, organization_id, pdf_relative_path)
+            youtube_knowledge.chunk_count = chunk_count
+            await db.commit()
+
         return {
             "status": "success",
             "message": "YouTube video transcript added successfully",
@@ -346,12 +369,10 @@ async def process_text(
         #SH: Process chunks
         chunks = text_splitter.split_text(text_data.text_content)
         chunk_count = len(chunks)
-        vector_store = get_organization_vector_store(organization_id)
-        await vector_store.aadd_texts(chunks)
         
         #SH: Create database entry
         filename = os.path.basename(pdf_relative_path)
-        await create_text_knowledge(
+        text_knowledge = await create_text_knowledge(
             db=db,
             name=text_data.name,
             text_content=text_data.text_content,
@@ -361,6 +382,11 @@ async def process_text(
             content_hash=content_hash,
             format=text_data.format 
         )
+
+        #SH: Store chunks in vector store
+        await add_knowledge_chunks(db, text_knowledge, chunks, organization_id, pdf_relative_path)
+        text_knowledge.chunk_count = chunk_count
+        await db.commit()
         
         return {
             "content_hash": content_hash,
@@ -540,29 +566,76 @@ async def get_knowledge_by_tag_service(
             detail=f"Failed to get knowledge bases: {str(e)}"
         )
         
-# Add snippet generation function
-def generate_snippet(query: str, knowledge_base_id: int, organization_id: int) -> str:
-    try:
-        # Search vector store for most relevant chunk
-        results = vector_store.similarity_search(
-            query=query,
-            k=1,
-            filter={
-                "knowledge_id": knowledge_base_id,
-                "organization_id": organization_id
-            }
-        )
-        
-        if results:
-            # Extract and truncate snippet
-            content = results[0].page_content
-            return (content[:200] + '...') if len(content) > 200 else content
-        
-        return f"Relevant content containing '{query}'"
-        
-    except Exception as e:
-        logger.error(f"Snippet generation failed: {str(e)}")
-        return f"Document related to '{query}'"
+#SH: Snippets per (query, knowledge_id), so paging through the same search doesn't hit the vector store again
+snippet_cache = TTLCache(maxsize=settings.SNIPPET_CACHE_SIZE, ttl=settings.SNIPPET_CACHE_TTL)
+
+def _truncate_snippet(content: str) -> str:
+    limit = settings.SNIPPET_LENGTH
+    return (content[:limit] + '...') if len(content) > limit else content
+
+#SH: Compile one pattern for all query terms so highlighting is a single pass per snippet
+def compile_highlight_pattern(query: str) -> Optional[re.Pattern]:
+    terms = sorted({term for term in query.split() if term}, key=len, reverse=True)
+    if not terms:
+        return None
+    return re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+
+def highlight_snippet(snippet: str, pattern: Optional[re.Pattern]) -> str:
+    if pattern is None:
+        return snippet
+    return pattern.sub(lambda match: f"<mark>{match.group(0)}</mark>", snippet)
+
+#SH: Best chunk for every knowledge_id with one query embedding and one filtered vector search
+async def generate_snippets(query: str, knowledge_ids: List[int], organization_id: int) -> dict:
+    snippets = {}
+    normalized_query = " ".join(query.split()).casefold()
+    missing = []
+    for knowledge_id in knowledge_ids:
+        cached = snippet_cache.get((organization_id, normalized_query, knowledge_id))
+        if cached is not None:
+            snippets[knowledge_id] = cached
+        else:
+            missing.append(knowledge_id)
+
+    if missing:
+        try:
+            vector_store = get_organization_vector_store(organization_id)
+            embedding = await vector_store.embeddings.aembed_query(query)
+            best = {}
+            pending = missing
+            # A dominant document can take every slot of the first search, so starved ids get one more try
+            for _ in range(2):
+                results = await search_with_relevance_scores(
+                    vector_store,
+                    query,
+                    k=len(pending) * settings.SNIPPET_CANDIDATES_PER_RESULT,
+                    filter={"knowledge_id": {"$in": pending}},
+                    query_embedding=embedding,
+                    organization_id=organization_id
+                )
+                for doc, score in results:
+                    knowledge_id = (doc.metadata or {}).get("knowledge_id")
+                    if knowledge_id in pending and (knowledge_id not in best or score > best[knowledge_id][1]):
+                        best[knowledge_id] = (doc.page_content, score)
+                pending = [kid for kid in missing if kid not in best]
+                if not pending:
+                    break
+
+            for knowledge_id in missing:
+                if knowledge_id in best:
+                    snippet = _truncate_snippet(best[knowledge_id][0])
+                    snippet_cache.set((organization_id, normalized_query, knowledge_id), snippet)
+                else:
+                    snippet = f"Relevant content containing '{query}'"
+                snippets[knowledge_id] = snippet
+
+        except Exception as e:
+            logger.error(f"Snippet generation failed: {str(e)}")
+            for knowledge_id in missing:
+                snippets[knowledge_id] = f"Document related to '{query}'"
+
+    return snippets
+
 # Add new search service
 async def search_knowledge_service(
     db: AsyncSession,
@@ -581,20 +654,17 @@ async def search_knowledge_service(
         tag_id=search_request.tag_id
     )
     
-    # Format results with snippets
+    # Format results with snippets, generated for the whole page at once
+    snippets = await generate_snippets(
+        query=search_request.query,
+        knowledge_ids=[kb.id for kb in knowledge_bases],
+        organization_id=organization_id
+    ) if knowledge_bases else {}
+    pattern = compile_highlight_pattern(search_request.query or "")
+
     results = []
     for kb in knowledge_bases:
-        # In a real implementation, you would generate actual content snippets
-        # For this example, we're using a placeholder
-        snippet = generate_snippet(
-            query=search_request.query,
-            knowledge_base_id=kb.id,
-            organization_id=organization_id
-        )
-
-        if search_request.query:
-            for term in search_request.query.split():
-                snippet = snippet.replace(term, f"<mark>{term}</mark>")
+        snippet = highlight_snippet(snippets.get(kb.id, ""), pattern)
 
         results.append({
             "id": kb.id,
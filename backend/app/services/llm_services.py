@@ -1,10 +1,11 @@
-from langchain_openai import OpenAIEmbeddings
 from app.core.config import settings
-from app.core.llm import OpenAIClient
+from app.core.llm import llm_client
+from app.core.vector_store import get_embedding_function
 from fastapi import HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.models.knowledge_base import agent_knowledge
 import os
+from typing import Optional
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import openai  # Added for error handling
@@ -23,20 +24,16 @@ async def generate_embeddings(text: str):
     """
     Generate embeddings for the given text using OpenAI's embeddings model.
     """
-    #SH: Create OpenAI embeddings instance using API key
-    embeddings = OpenAIEmbeddings(
-        model=settings.EMBEDDING_MODEL,
-        openai_api_key=settings.OPENAI_API_KEY
-    )
-    #SH: Return the embeddings for the provided text
-    return await embeddings.embed_query(text)
+    #SH: Shared EMBEDDING_MODEL client, repeated texts are served from the cache
+    return await get_embedding_function().aembed_query(text)
 
 #SH: Generate a response from the LLM 
 async def generate_llm_response(
     prompt: str,
     agent_config: dict,
     knowledge_bases: list,
-    db: AsyncSession
+    db: AsyncSession,
+    organization_id: Optional[int] = None
 ) -> dict:
     
     # Generate a response using the agent's configuration and knowledge base.
@@ -56,16 +53,16 @@ async def generate_llm_response(
             context += "\n".join([chunk.page_content for chunk in chunks]) + "\n\n"
 
         #SH: Combine the context with the user prompt
-        full_prompt = f"{context}\n\n{prompt}"
+        full_prompt = f"{context}\n\nQuestion: {prompt}"
 
         #SH: Call the OpenAIClient to generate the response using the combined context and prompt
-        client = OpenAIClient()
-        response = await client.generate(
+        response = await llm_client.generate(
             model=agent_config.get("model_name", "gpt-4"),
             prompt=full_prompt,
             system_prompt=agent_config.get("system_prompt", "You are a helpful assistant"),
             temperature=agent_config.get("temperature", 0.7),
-            max_tokens=agent_config.get("max_length", 500)
+            max_tokens=agent_config.get("max_length", 500),
+            organization_id=organization_id
         )
         return response
 
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Set
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.llm import llm_client
+from app.core.llm_admission import BACKGROUND
+from app.core.tokenizer import count_tokens, truncate_to_tokens
+from app.db.database import SessionLocal
+from app.db.models.chat import ChatMessage, Conversation
+from app.db.repository.chat import get_unsummarized_messages, update_conversation_summary
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You keep a running summary of a conversation between a user and an assistant. "
+    "Merge the new messages into the existing summary. Keep names, numbers, decisions, preferences "
+    "and open questions; drop greetings and small talk. Reply with the updated summary only."
+)
+
+@dataclass
+class ConversationHistory:
+    text: str = ""
+    tokens: int = 0
+    recent_messages: int = 0
+    summarized: bool = False
+
+def format_message(message: ChatMessage) -> str:
+    return f"{'User' if message.sender == 'user' else 'Assistant'}: {message.content}"
+
+#SH: Summary plus the newest messages that fit the budget, newest kept first so the oldest are what gets dropped
+def select_history(summary: Optional[str], messages: Sequence[ChatMessage], budget_tokens: int, model: str) -> ConversationHistory:
+    parts: List[str] = []
+    used = 0
+    if summary:
+        summary = truncate_to_tokens(summary, min(settings.CONVERSATION_SUMMARY_TOKENS, budget_tokens), model)
+        used = count_tokens(summary, model)
+
+    recent: List[str] = []
+    for message in reversed(messages[-settings.CONVERSATION_RECENT_MESSAGES:]):
+        line = format_message(message)
+        tokens = count_tokens(line, model)
+        if used + tokens > budget_tokens:
+            break
+        recent.append(line)
+        used += tokens
+
+    if summary:
+        parts.append(f"Summary of earlier conversation:\n{summary}")
+    if recent:
+        parts.append("Recent messages:\n" + "\n".join(reversed(recent)))
+    text = "\n\n".join(parts)
+    return ConversationHistory(
+        text=text,
+        tokens=count_tokens(text, model),
+        recent_messages=len(recent),
+        summarized=bool(summary)
+    )
+
+#SH: Messages that fell out of the recent window and aren't in the summary yet, empty until there are enough to fold in
+def messages_to_summarize(unsummarized: Sequence[ChatMessage]) -> List[ChatMessage]:
+    older = list(unsummarized[:-settings.CONVERSATION_RECENT_MESSAGES]) if settings.CONVERSATION_RECENT_MESSAGES else list(unsummarized)
+    return older if len(older) >= settings.CONVERSATION_SUMMARY_MIN_MESSAGES else []
+
+#SH: History for the prompt of the message at `sequence_id`, read before that message's reply exists
+async def build_history(
+    db: AsyncSession,
+    conversation_id: Optional[int],
+    sequence_id: Optional[int],
+    model: str
+) -> ConversationHistory:
+    if not settings.CONVERSATION_MEMORY_ENABLED or not conversation_id:
+        return ConversationHistory()
+    conversation = await db.get(Conversation, conversation_id)
+    if conversation is None:
+        return ConversationHistory()
+    messages = await get_unsummarized_messages(
+        db, conversation_id, conversation.summarized_through or 0, before_sequence=sequence_id
+    )
+    return select_history(conversation.summary, messages, settings.CONVERSATION_HISTORY_TOKENS, model)
+
+#SH: Prompt with the conversation history in front. The question stays last, where prompt fitting never cuts.
+def with_history(history: ConversationHistory, prompt: str) -> str:
+    return f"{history.text}\n\n{prompt}" if history.text else prompt
+
+#SH: Folds older messages into Conversation.summary off the request path, one refresh per conversation at a time
+class ConversationSummarizer:
+    def __init__(self):
+        self._running: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.refreshes = 0
+        self.messages_summarized = 0
+        self.failures = 0
+
+    #SH: Called once the reply is saved; runs behind it at background priority so it never delays a chat
+    def schedule(self, conversation_id: Optional[int], organization_id: Optional[int]):
+        if not settings.CONVERSATION_MEMORY_ENABLED or not conversation_id or conversation_id in self._running:
+            return
+        self._running.add(conversation_id)
+        task = asyncio.create_task(self._refresh(conversation_id, organization_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, conversation_id: int, organization_id: Optional[int]):
+        try:
+            async with SessionLocal() as db:
+                await self.refresh(db, conversation_id, organization_id)
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Summary refresh failed for conversation {conversation_id}: {e}")
+        finally:
+            self._running.discard(conversation_id)
+
+    async def refresh(self, db: AsyncSession, conversation_id: int, organization_id: Optional[int]) -> bool:
+        conversation = await db.get(Conversation, conversation_id)
+        if conversation is None:
+            return False
+        older = messages_to_summarize(
+            await get_unsummarized_messages(db, conversation_id, conversation.summarized_through or 0)
+        )
+        if not older:
+            return False
+
+        model = settings.CONVERSATION_SUMMARY_MODEL or settings.FALLBACK_MODEL
+        transcript = "\n".join(format_message(message) for message in older)
+        response = await llm_client.generate(
+            model=model,
+            prompt=f"Summary so far:\n{conversation.summary or '(none)'}\n\nNew messages:\n{transcript}",
+            system_prompt=SUMMARY_SYSTEM_PROMPT,
+            temperature=0,
+            max_tokens=settings.CONVERSATION_SUMMARY_TOKENS,
+            organization_id=organization_id,
+            priority=BACKGROUND
+        )
+        await update_conversation_summary(db, conversation_id, response["content"].strip(), older[-1].sequence_id)
+        self.refreshes += 1
+        self.messages_summarized += len(older)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": len(self._running),
+            "refreshes": self.refreshes,
+            "messages_summarized": self.messages_summarized,
+            "failures": self.failures,
+        }
+
+# Global instance
+conversation_summarizer = ConversationSummarizer()
@@ -0,0 +1,169 @@
+import time
+import asyncio
+import logging
+from functools import partial
+from types import SimpleNamespace
+from typing import List, Optional, Tuple
+from app.core.config import settings
+from app.core.context_compressor import context_compressor
+from app.core.context_packer import PackedContext, pack_context
+from app.core.conversation_context import AUGMENT, REUSE, conversation_retrieval_cache, merge_scored_docs
+from app.core.reranker import reranker
+from app.core.tokenizer import count_tokens, get_context_window
+from app.core.vector_store import (
+    get_organization_embedding_function,
+    get_organization_index_dir,
+    get_organization_vector_store,
+    search_with_relevance_scores
+)
+from app.core.vector_tiers import index_fingerprint
+from app.db.models.agent import Agent
+
+logger = logging.getLogger(__name__)
+
+#SH: The agent fields retrieval reads, as plain values that stay valid after the request's session is closed
+def agent_settings(agent: Agent) -> SimpleNamespace:
+    return SimpleNamespace(
+        id=agent.id,
+        organization_id=agent.organization_id,
+        config=dict(agent.config or {}),
+        context_window_size=agent.context_window_size
+    )
+
+#SH: Tokens available for retrieved context, bounded by the agent setting and what the model window leaves free
+def get_context_budget(
+    agent: Agent,
+    model: str,
+    message: str,
+    system_prompt: str,
+    max_tokens: int,
+    history_tokens: int = 0
+) -> int:
+    agent_budget = (agent.config or {}).get("context_window_size") or agent.context_window_size or 2000
+    free_in_window = (
+        get_context_window(model)
+        - min(max_tokens, settings.MAX_TOKENS_LIMIT)
+        - count_tokens(system_prompt, model)
+        - count_tokens(message, model)
+        - history_tokens
+        - settings.PROMPT_SAFETY_MARGIN
+    )
+    return max(0, min(agent_budget, free_in_window))
+
+#SH: How many chunks retrieval fetches for adaptive selection to choose from
+def get_candidate_k() -> int:
+    return max(settings.RAG_CANDIDATE_K, settings.RAG_K)
+
+#SH: Candidate chunks for a message, follow-ups close to a recent turn of the conversation reuse or extend its chunks
+async def retrieve_candidates(
+    agent: Agent,
+    message: str,
+    query_embedding: Optional[List[float]] = None,
+    conversation_id: Optional[int] = None,
+    k: Optional[int] = None
+) -> List[Tuple[object, float]]:
+    vector_store = get_organization_vector_store(agent.organization_id)
+    k = k or get_candidate_k()
+    if not conversation_id or not settings.RAG_REUSE_ENABLED:
+        return await search_with_relevance_scores(
+            vector_store, message, k=k, query_embedding=query_embedding, organization_id=agent.organization_id
+        )
+
+    embedding = query_embedding or await vector_store.embeddings.aembed_query(message)
+    # Any write to the index or a switch of embedding model makes the remembered chunks stale
+    index_version = (
+        getattr(vector_store.embeddings, "model", None),
+        index_fingerprint(get_organization_index_dir(agent.organization_id))
+    )
+    key = (agent.id, conversation_id)
+    decision = conversation_retrieval_cache.lookup(key, index_version, embedding)
+    if decision.mode == REUSE:
+        logger.debug(f"Conversation {conversation_id}: reusing retrieved context (similarity {decision.similarity:.3f})")
+        return decision.scored_docs
+
+    # A related follow-up only needs the few chunks the earlier turns didn't already bring
+    scored_docs = await search_with_relevance_scores(
+        vector_store,
+        message,
+        k=settings.RAG_K if decision.mode == AUGMENT else k,
+        query_embedding=embedding,
+        organization_id=agent.organization_id
+    )
+    if decision.mode == AUGMENT:
+        scored_docs = merge_scored_docs(scored_docs, decision.scored_docs)[:k]
+    conversation_retrieval_cache.store(key, index_version, embedding, scored_docs)
+    return scored_docs
+
+#SH: Per-agent switch for query-relevance compression, returns its token budget or None when it is off
+def get_compression_budget(agent: Agent, context_budget: int) -> Optional[int]:
+    config = agent.config or {}
+    enabled = config.get("context_compression")
+    if not (settings.CONTEXT_COMPRESSION_ENABLED if enabled is None else enabled):
+        return None
+    return min(config.get("context_compression_tokens") or settings.CONTEXT_COMPRESSION_TOKENS, context_budget)
+
+#SH: Per-agent switch for cross-encoder reranking, returns how many chunks it keeps or None when it is off
+def get_rerank_top_n(agent: Agent) -> Optional[int]:
+    config = agent.config or {}
+    enabled = config.get("rerank")
+    if not (settings.RERANK_ENABLED if enabled is None else enabled):
+        return None
+    return config.get("rerank_top_n") or settings.RERANK_TOP_N
+
+#SH: Retrieve candidate chunks for a message and pack them into the agent's token budget
+async def build_rag_context(
+    agent: Agent,
+    message: str,
+    model: str,
+    system_prompt: str,
+    max_tokens: int,
+    query_embedding: Optional[List[float]] = None,
+    conversation_id: Optional[int] = None,
+    history_tokens: int = 0
+) -> PackedContext:
+    budget = get_context_budget(agent, model, message, system_prompt, max_tokens, history_tokens)
+    compression_budget = get_compression_budget(agent, budget)
+    embeddings = None
+    if compression_budget is not None:
+        # Compression scores sentences against the same query vector retrieval searches with
+        embeddings = get_organization_embedding_function(agent.organization_id)
+        query_embedding = query_embedding or await embeddings.aembed_query(message)
+
+    rerank_top_n = get_rerank_top_n(agent)
+    # Reranking picks from a wider, cheaply retrieved candidate set
+    k = max(settings.RERANK_CANDIDATE_K, rerank_top_n) if rerank_top_n else None
+    scored_docs = await retrieve_candidates(agent, message, query_embedding, conversation_id, k=k)
+
+    max_k, score_cutoff = get_candidate_k(), settings.RAG_SCORE_CUTOFF
+    reranked, rerank_ms = None, 0.0
+    if rerank_top_n:
+        started = time.perf_counter()
+        # Cross-encoder inference is CPU bound, keep it off the event loop
+        reranked = await asyncio.to_thread(reranker.rerank, message, scored_docs, rerank_top_n)
+        rerank_ms = (time.perf_counter() - started) * 1000
+        if reranked is not None:
+            scored_docs, max_k, score_cutoff = reranked, rerank_top_n, settings.RERANK_SCORE_CUTOFF
+
+    pack = partial(
+        pack_context,
+        scored_docs,
+        budget_tokens=budget,
+        model=model,
+        score_cutoff=score_cutoff,
+        max_k=max_k,
+        min_passage_tokens=settings.RAG_MIN_PASSAGE_TOKENS
+    )
+    if compression_budget is None:
+        packed = pack()
+    else:
+        def compress(passages, _budget):
+            return context_compressor.compress(
+                passages, compression_budget, query=message, model=model,
+                query_embedding=query_embedding, embeddings=embeddings
+            )
+
+        # Sentence embedding calls block, keep them off the event loop
+        packed = await asyncio.to_thread(pack, compress=compress)
+    if reranked is not None:
+        packed.reranked, packed.rerank_ms = True, rerank_ms
+    return packed
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from functools import partial
+from typing import Dict, List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.vector_store import get_organization_vector_store, load_manifest
+from app.core.index_profile import profile_index
+from app.core.vector_tiers import vector_tiers
+from app.core.vector_maintenance import (
+    claim_maintenance,
+    compact_store,
+    find_orphans,
+    get_index_dir,
+    heartbeat_maintenance,
+    list_indexed_organizations,
+    load_state,
+    release_maintenance,
+    reshard_index,
+    swap_window,
+    vector_gc
+)
+from app.db.repository.knowledge_base import get_live_knowledge_ids
+
+logger = logging.getLogger(__name__)
+
+class VectorMaintenanceService:
+
+    @staticmethod
+    def _organizations(organization_id: Optional[int]) -> List[int]:
+        indexed = list_indexed_organizations()
+        if organization_id is None:
+            return indexed
+        return [organization_id] if organization_id in indexed else []
+
+    @staticmethod
+    async def get_orphan_report(db: AsyncSession, organization_id: Optional[int] = None) -> Dict:
+        """Orphaned vector counts for every persisted organization index"""
+        organizations = []
+        for org_id in VectorMaintenanceService._organizations(organization_id):
+            live_ids = await get_live_knowledge_ids(db, org_id)
+            store = get_organization_vector_store(org_id)
+            report = await asyncio.to_thread(find_orphans, store, live_ids)
+            state = load_state(get_index_dir(org_id))
+            organizations.append({
+                "organization_id": org_id,
+                **report,
+                "deleted_since_rebuild": state.get("deleted_since_rebuild", 0),
+                "last_compacted": state.get("last_compacted")
+            })
+
+        return {
+            "organizations": organizations,
+            "total_orphaned_vectors": sum(org["orphaned_vectors"] for org in organizations),
+            "garbage_collector": vector_gc.stats()
+        }
+
+    @staticmethod
+    async def compact_indexes(db: AsyncSession, organization_id: Optional[int] = None) -> List[Dict]:
+        """Purge orphaned vectors and reclaim disk space in the persisted organization indexes"""
+        # Let queued deletions land first so they count towards the rebuild decision
+        await vector_gc.drain()
+        results = []
+        for org_id in VectorMaintenanceService._organizations(organization_id):
+            # A shadow index is being built from this one, the re-index catch-up handles deletions
+            if (load_manifest(org_id).get("building") or {}).get("status") == "building":
+                results.append({"organization_id": org_id, "skipped": "re-index in progress"})
+                continue
+            # Every worker runs the compaction loop, the first to claim an organization compacts it
+            if not claim_maintenance(org_id):
+                results.append({"organization_id": org_id, "skipped": "maintenance running in another worker"})
+                continue
+            try:
+                live_ids = await get_live_knowledge_ids(db, org_id)
+                store = get_organization_vector_store(org_id)
+                loop = asyncio.get_running_loop()
+
+                # Rows committed after the snapshot may already have chunks, only purge ids still missing now
+                def confirm_orphans(candidates: List[int], org_id: int = org_id) -> List[int]:
+                    live = asyncio.run_coroutine_threadsafe(
+                        get_live_knowledge_ids(db, org_id, knowledge_ids=candidates), loop
+                    ).result()
+                    return [knowledge_id for knowledge_id in candidates if knowledge_id not in live]
+
+                result = await asyncio.to_thread(
+                    compact_store,
+                    store,
+                    get_index_dir(org_id),
+                    live_ids,
+                    settings.VECTOR_COMPACTION_DEAD_RATIO,
+                    partial(heartbeat_maintenance, org_id),
+                    confirm_orphans,
+                    partial(swap_window, org_id)
+                )
+                logger.info(f"Compacted vector index of org {org_id}: {result}")
+                results.append({"organization_id": org_id, **result})
+            except Exception as e:
+                logger.error(f"Vector index compaction failed for org {org_id}: {e}")
+                results.append({"organization_id": org_id, "error": str(e)})
+            finally:
+                release_maintenance(org_id)
+        return results
+
+    @staticmethod
+    async def rebalance_shards(
+        organization_id: Optional[int] = None,
+        shards: Optional[int] = None,
+        shard_by: Optional[str] = None
+    ) -> List[Dict]:
+        """Split grown organization indexes into more shards, or apply an explicit shard layout"""
+        results = []
+        for org_id in VectorMaintenanceService._organizations(organization_id):
+            if (load_manifest(org_id).get("building") or {}).get("status") == "building":
+                results.append({"organization_id": org_id, "skipped": "re-index in progress"})
+                continue
+            if not claim_maintenance(org_id):
+                results.append({"organization_id": org_id, "skipped": "maintenance running in another worker"})
+                continue
+            try:
+                result = await asyncio.to_thread(
+                    reshard_index, org_id, shards, shard_by, partial(heartbeat_maintenance, org_id)
+                )
+                results.append({"organization_id": org_id, **result})
+            except ValueError:
+                raise
+            except Exception as e:
+                logger.error(f"Shard rebalance failed for org {org_id}: {e}")
+                results.append({"organization_id": org_id, "error": str(e)})
+            finally:
+                release_maintenance(org_id)
+        return results
+
+    @staticmethod
+    async def refresh_vector_tiers() -> List[Dict]:
+        """Promote the most retrieved chunks of active organizations to RAM and demote the rest to disk"""
+        results = []
+        for org_id in vector_tiers.active_organizations():
+            try:
+                store = get_organization_vector_store(org_id)
+                result = await asyncio.to_thread(vector_tiers.refresh, org_id, store._collection, get_index_dir(org_id))
+                results.append(result)
+            except Exception as e:
+                logger.error(f"Vector tier refresh failed for org {org_id}: {e}")
+                vector_tiers.drop(org_id)
+                results.append({"organization_id": org_id, "error": str(e)})
+        return results
+
+    @staticmethod
+    async def get_profile_report(organization_id: Optional[int] = None) -> List[Dict]:
+        """Index RAM and disk of every organization under candidate embedding profiles"""
+        organizations = []
+        for org_id in VectorMaintenanceService._organizations(organization_id):
+            active = load_manifest(org_id)["active"]
+            report = await asyncio.to_thread(
+                profile_index,
+                get_organization_vector_store(org_id),
+                get_index_dir(org_id),
+                active,
+                settings.PROFILE_REPORT_DIMENSIONS
+            )
+            organizations.append({"organization_id": org_id, **report})
+        return organizations
@@ -1,20 +1,28 @@
 import os
+import asyncio
 import logging
 import datetime
-from typing import Dict, Any, Optional, List
+from typing import Awaitable, Callable, Dict, Any, Optional, List
 from fastapi import HTTPException, status, WebSocketException
 from sqlalchemy import select, func
 from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
-from tenacity import retry, stop_after_attempt, wait_exponential
-from app.core.llm import OpenAIClient
+from app.core.llm import GenerationProgress, StreamInterrupted, llm_client
 from app.core.config import settings
-from app.core.vector_store import get_organization_vector_store
+from app.core.vector_store import get_organization_embedding_function
+from app.core.response_cache import CachedResponse, agent_config_hash, response_cache
+from app.core.model_router import route_options
+from app.core.single_flight import flight_key, single_flight, single_flight_allowed
 from app.db.models.agent import Agent
 from app.db.models.chat import ChatMessage, Conversation
+from app.db.database import SessionLocal
 from app.db.models.knowledge_base import KnowledgeBase
-from app.db.repository.chat import create_chat_message, create_conversation
+from app.db.repository.chat import create_chat_message, create_conversation, save_cancelled_reply
 from app.db.repository.agent import get_agent, get_public_agent
+from app.db.repository.knowledge_base import get_agent_knowledge_bases, get_knowledge_version
+from app.services.analytics_services import AnalyticsService
+from app.services.memory_services import build_history, conversation_summarizer, with_history
+from app.services.rag_services import agent_settings, build_rag_context
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
@@ -84,7 +92,7 @@ async def get_knowledge_sources(knowledge_bases: List[KnowledgeBase]) -> List[Di
 #SH: Widget service
 class WidgetService:
     def __init__(self):
-        self.llm_client = OpenAIClient()
+        self.llm_client = llm_client
 
     #SH: Verify public agent
     async def verify_public_agent(self, db: AsyncSession, agent_id: int):
@@ -96,11 +104,6 @@ class WidgetService:
         return result.scalar_one_or_none()
 
     #SH: Process widget message 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        reraise=True
-    )
     async def process_widget_message(
         self,
         agent_id: int,
@@ -109,7 +112,8 @@ class WidgetService:
         metadata: Optional[Dict[str, Any]] = None,
         user_id: Optional[str] = None,
         sequence_id: Optional[int] = None,
-        conversation_id: Optional[int] = None
+        conversation_id: Optional[int] = None,
+        on_delta: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Dict[str, Any]:
         if not message.strip():
             return {"type": "error", "error_type": "validation_error", "content": "Message cannot be empty"}
@@ -121,15 +125,20 @@ class WidgetService:
         if sequence_id and conversation_id:
             await validate_message_sequence(db, user_id, agent_id, sequence_id, conversation_id)
 
+        model = agent.config.get("model_name", settings.FALLBACK_MODEL)
+        system_prompt = agent.config.get("system_prompt", "You are a helpful assistant")
+        max_tokens = agent.config.get("max_length", settings.MAX_TOKENS)
+        history = await build_history(db, conversation_id, sequence_id, model)
         try:
-            vector_store = get_organization_vector_store(agent.organization_id)
-            docs = await vector_store.asimilarity_search(message, k=settings.RAG_K)
-            context = "\n".join([doc.page_content for doc in docs])
+            packed = await build_rag_context(
+                agent, message, model, system_prompt, max_tokens, conversation_id=conversation_id, history_tokens=history.tokens
+            )
+            context = packed.text
         except Exception as e:
             logger.warning(f"RAG context failed: {e}")
             context = await self._fallback_context(agent.knowledge_bases)
 
-        full_prompt = f"Context:\n{context}\n\nVisitor: {message}"
+        full_prompt = with_history(history, f"Context:\n{context}\n\nVisitor: {message}")
 
         if conversation_id:
             await create_chat_message(db, {
@@ -157,14 +166,43 @@ class WidgetService:
                 "sequence_id": sequence_id
             })
 
+        started_at = datetime.datetime.utcnow()
+        progress = GenerationProgress()
         try:
-            llm_response = await self.llm_client.generate(
-                model=agent.config.get("model_name", settings.FALLBACK_MODEL),
+            llm_response = await self._generate(
+                on_delta,
+                route_options(agent),
+                model=model,
                 prompt=full_prompt,
-                system_prompt=agent.config.get("system_prompt", "You are a helpful assistant"),
+                system_prompt=system_prompt,
                 temperature=agent.config.get("temperature", 0.7),
-                max_tokens=agent.config.get("max_length", settings.MAX_TOKENS)
+                max_tokens=max_tokens,
+                organization_id=agent.organization_id,
+                progress=progress
+            )
+        except asyncio.CancelledError:
+            # The partial reply closes the turn, flagged so the next prompt and the summary skip it
+            await save_cancelled_reply(db, {
+                "conversation_id": conversation_id,
+                "content": progress.text(),
+                "sender": "agent",
+                "user_id": user_id,
+                "agent_id": agent_id,
+                "sequence_id": sequence_id + 1
+            })
+            await AnalyticsService.record_cancelled_chat(
+                db,
+                progress,
+                started_at,
+                conversation_id=conversation_id,
+                agent_id=agent_id,
+                user_id=user_id,
+                organization_id=agent.organization_id,
+                message_length=len(message)
             )
+            raise
+        except StreamInterrupted:
+            raise
         except Exception as e:
             logger.error(f"LLM generation error: {e}")
             return {"type": "error", "error_type": "generation_error", "content": "Failed to generate response"}
@@ -177,6 +215,7 @@ class WidgetService:
             "agent_id": agent_id,
             "sequence_id": sequence_id + 1
         })
+        conversation_summarizer.schedule(conversation_id, agent.organization_id)
 
         return {
             "type": "response",
@@ -184,13 +223,19 @@ class WidgetService:
             "agent_id": agent_id,
             "metadata": {
                 "model": llm_response.get("model"),
+                "route": llm_response.get("route"),
                 "tokens_used": llm_response.get("usage", {}).get("total_tokens", 0),
                 "cost": llm_response.get("cost", 0),
                 "timestamp": datetime.datetime.now().isoformat(),
+                "time_to_first_token_ms": llm_response.get("time_to_first_token_ms"),
                 "sources": await get_knowledge_sources(agent.knowledge_bases)
             }
         }
 
+    #SH: One completion, streamed to on_delta when the caller forwards deltas, routed by the agent's route_options
+    async def _generate(self, on_delta: Optional[Callable[[str], Awaitable[None]]], routing: Dict[str, Any], **completion) -> Dict[str, Any]:
+        return await self.llm_client.generate_routed(on_delta=on_delta, **routing, **completion)
+
     #SH: Fallback context
     async def _fallback_context(self, knowledge_bases: List[KnowledgeBase]) -> str:
         texts = []
@@ -210,8 +255,10 @@ class WidgetService:
         self,
         db: AsyncSession,
         agent_id: int,
-        message: str
+        message: str,
+        on_delta: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Dict[str, Any]:
+        start_time = datetime.datetime.utcnow()
         try:
             if len(message) > settings.WIDGET_MAX_MESSAGE_LENGTH:
                 return {
@@ -231,31 +278,207 @@ class WidgetService:
             greeting    = agent.greeting_message
             is_public   = agent.is_public
 
-            try:
-                vector_store = get_organization_vector_store(agent.organization_id)
-                docs = await vector_store.asimilarity_search(message, k=3)
-                context = "\n".join(doc.page_content for doc in docs)
-            except Exception as e:
-                logger.warning(f"RAG context failed: {e}")
-                context = await self._fallback_context(agent.knowledge_bases)
+            #SH: Serve near-identical questions from the semantic response cache
+            cache_key = None
+            query_embedding = None
+            if settings.RESPONSE_CACHE_ENABLED:
+                try:
+                    embedder = get_organization_embedding_function(agent.organization_id)
+                    query_embedding = await embedder.aembed_query(message)
+                    # Vectors of different embedding models can't be compared, a re-index starts a new namespace
+                    knowledge_version = await get_knowledge_version(db, agent.organization_id, agent.id)
+                    cache_key = (agent_config_hash(agent), f"{knowledge_version}:{embedder.model}")
+                    cached = response_cache.lookup(agent.id, *cache_key, query_embedding)
+                except Exception as e:
+                    logger.warning(f"Response cache lookup failed: {e}")
+                    cached = None
 
-            llm_resp = await self.llm_client.generate(
-                model=agent.config.get("model_name", settings.WIDGET_DEFAULT_MODEL),
-                prompt=f"Context: {context}\n\nQuestion: {message}",
-                system_prompt=agent.config.get("system_prompt", "You are a helpful assistant"),
-                temperature=agent.config.get("temperature", 0.7),
-                max_tokens=agent.config.get("max_length", 500)
+                if cached:
+                    response_time_ms = (datetime.datetime.utcnow() - start_time).total_seconds() * 1000
+                    await AnalyticsService.record_chat_metric(
+                        db=db,
+                        conversation_id=None,
+                        agent_id=agent.id,
+                        user_id=None,
+                        organization_id=agent.organization_id,
+                        response_time_ms=response_time_ms,
+                        message_length=len(message),
+                        knowledge_base_hits=len(cached.sources),
+                        model_used=cached.model,
+                        cache_hit=True,
+                        tokens_saved=cached.tokens_used,
+                        latency_saved_ms=max(cached.response_time_ms - response_time_ms, 0.0)
+                    )
+                    return {
+                        "content": cached.content,
+                        "metadata": {
+                            "model":          cached.model,
+                            "tokens_used":    0,
+                            "sources":        cached.sources,
+                            "theme_color":    theme_color,
+                            "greeting_message": greeting,
+                            "is_public":      is_public,
+                            "cached":         True
+                        }
+                    }
+
+            model = agent.config.get("model_name", settings.WIDGET_DEFAULT_MODEL)
+            system_prompt = agent.config.get("system_prompt", "You are a helpful assistant")
+            max_tokens = agent.config.get("max_length", 500)
+            temperature = agent.config.get("temperature", 0.7)
+
+            # A shared flight outlives the request that started it: it gets plain values, never this request's
+            # session or ORM objects, and opens a session of its own for what it writes
+            rag_agent = agent_settings(agent)
+            routing = route_options(agent)
+            agent_id, organization_id = agent.id, agent.organization_id
+
+            async def answer(stream_to: Optional[Callable[[str], Awaitable[None]]]) -> Dict[str, Any]:
+                result = {
+                    "docs": [], "context_tokens": 0, "raw_context_tokens": 0, "uncompressed_context_tokens": 0,
+                    "context_compressed": False, "reranked": False, "rerank_ms": 0.0, "recorded": False
+                }
+                try:
+                    packed = await build_rag_context(
+                        rag_agent, message, model, system_prompt, max_tokens, query_embedding=query_embedding
+                    )
+                    context = packed.text
+                    result.update(
+                        docs=packed.documents,
+                        context_tokens=packed.tokens,
+                        raw_context_tokens=packed.raw_tokens,
+                        uncompressed_context_tokens=packed.uncompressed_tokens,
+                        context_compressed=packed.compressed,
+                        reranked=packed.reranked,
+                        rerank_ms=packed.rerank_ms
+                    )
+                except Exception as e:
+                    logger.warning(f"RAG context failed: {e}")
+                    async with SessionLocal() as flight_db:
+                        context = await self._fallback_context(await get_agent_knowledge_bases(flight_db, agent_id))
+
+                progress = GenerationProgress()
+                try:
+                    result["llm_resp"] = await self._generate(
+                        stream_to,
+                        routing,
+                        model=model,
+                        prompt=f"Context: {context}\n\nQuestion: {message}",
+                        system_prompt=system_prompt,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        organization_id=organization_id,
+                        progress=progress
+                    )
+                except asyncio.CancelledError:
+                    # Only cancelled once nobody is waiting for the answer (a shared flight outlives its leader)
+                    async with SessionLocal() as flight_db:
+                        await AnalyticsService.record_cancelled_chat(
+                            flight_db,
+                            progress,
+                            start_time,
+                            conversation_id=None,
+                            agent_id=agent_id,
+                            user_id=None,
+                            organization_id=organization_id,
+                            message_length=len(message),
+                            knowledge_base_hits=len(result["docs"]),
+                            context_tokens=result["context_tokens"],
+                            raw_context_tokens=result["raw_context_tokens"]
+                        )
+                    raise
+                return result
+
+            #SH: Visitors asking the same question at the same time share one retrieval and completion
+            if single_flight_allowed(agent):
+                result, _ = await single_flight.do(flight_key(agent, message, temperature), answer, on_delta)
+            else:
+                result = await answer(on_delta)
+            llm_resp, docs = result["llm_resp"], result["docs"]
+            # The first request to read the answer records its cost: the leader, or a follower when the leader was cancelled
+            coalesced = result["recorded"]
+            result["recorded"] = True
+
+            response_time_ms = (datetime.datetime.utcnow() - start_time).total_seconds() * 1000
+            tokens_used = llm_resp.get("usage", {}).get("total_tokens", 0)
+            sources = [d.metadata.get("source", "") for d in docs]
+
+            if coalesced:
+                # Another request records the completion, this one only saved it
+                await AnalyticsService.record_chat_metric(
+                    db=db,
+                    conversation_id=None,
+                    agent_id=agent.id,
+                    user_id=None,
+                    organization_id=agent.organization_id,
+                    response_time_ms=response_time_ms,
+                    message_length=len(message),
+                    knowledge_base_hits=len(docs),
+                    model_used=llm_resp.get("model"),
+                    coalesced=True,
+                    tokens_saved=tokens_used
+                )
+                return {
+                    "content": llm_resp["content"],
+                    "metadata": {
+                        "model":          llm_resp.get("model"),
+                        "tokens_used":    0,
+                        "sources":        sources,
+                        "theme_color":    theme_color,
+                        "greeting_message": greeting,
+                        "is_public":      is_public,
+                        "cached":         False,
+                        "coalesced":      True
+                    }
+                }
+
+            if cache_key:
+                response_cache.store(agent.id, *cache_key, query_embedding, CachedResponse(
+                    content=llm_resp["content"],
+                    model=llm_resp.get("model"),
+                    tokens_used=tokens_used,
+                    cost=llm_resp.get("cost", 0),
+                    response_time_ms=response_time_ms,
+                    sources=sources
+                ))
+
+            await AnalyticsService.record_chat_metric(
+                db=db,
+                conversation_id=None,
+                agent_id=agent.id,
+                user_id=None,
+                organization_id=agent.organization_id,
+                response_time_ms=response_time_ms,
+                time_to_first_token_ms=llm_resp.get("time_to_first_token_ms"),
+                message_length=len(message),
+                tokens_used=tokens_used,
+                cost=llm_resp.get("cost", 0),
+                knowledge_base_hits=len(docs),
+                model_used=llm_resp.get("model"),
+                route=llm_resp.get("route"),
+                prompt_tokens=llm_resp.get("usage", {}).get("prompt_tokens", 0),
+                context_tokens=result["context_tokens"],
+                raw_context_tokens=result["raw_context_tokens"],
+                uncompressed_context_tokens=result["uncompressed_context_tokens"],
+                context_compressed=result["context_compressed"],
+                reranked=result["reranked"],
+                rerank_ms=result["rerank_ms"]
             )
 
             return {
                 "content": llm_resp["content"],
                 "metadata": {
                     "model":          llm_resp.get("model"),
-                    "tokens_used":    llm_resp.get("usage", {}).get("total_tokens", 0),
-                    "sources":        [d.metadata.get("source", "") for d in docs],
+                    "route":          llm_resp.get("route"),
+                    "tokens_used":    tokens_used,
+                    "cost":           llm_resp.get("cost", 0),
+                    "time_to_first_token_ms": llm_resp.get("time_to_first_token_ms"),
+                    "sources":        sources,
                     "theme_color":    theme_color,
                     "greeting_message": greeting,
-                    "is_public":      is_public
+                    "is_public":      is_public,
+                    "cached":         False,
+                    "coalesced":      False
                 }
             }
 
@@ -264,4 +487,4 @@ class WidgetService:
             return {
                 "content": "Sorry, I encountered an error processing your message",
                 "error": str(e)
-            }
\ No newline at end of file
+            }
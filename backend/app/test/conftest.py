@@ -0,0 +1,6 @@
+import os
+
+#SH: Settings are read at import time, the app modules need these before any test imports them
+for key in ("CLERK_JWKS_URL", "CLERK_ISSUER", "CLERK_SECRET_KEY", "CLERK_PUBLISHABLE_KEY", "OPENAI_API_KEY"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
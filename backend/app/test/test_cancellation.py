@@ -0,0 +1,214 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import pytest
+from fastapi import WebSocketDisconnect
+from app.core.llm import GenerationProgress, OpenAIClient
+from app.core.llm_admission import AdmissionController
+from app.core.single_flight import SingleFlight
+from app.core.cancellation import SocketInbox, run_cancellable
+
+
+class FakeSocket:
+    def __init__(self, frames):
+        self.frames = asyncio.Queue()
+        for frame in frames:
+            self.frames.put_nowait(frame)
+        self.sent = []
+
+    async def receive(self):
+        return await self.frames.get()
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+def text(data):
+    return {"type": "websocket.receive", "text": json.dumps(data)}
+
+
+async def slow_reply(state, delay=10):
+    try:
+        await asyncio.sleep(delay)
+        return {"content": "late"}
+    except asyncio.CancelledError:
+        state["cancelled"] = True
+        raise
+
+
+def test_cancel_frame_stops_the_reply():
+    state = {}
+
+    async def run():
+        socket = FakeSocket([text({"type": "cancel"})])
+        return await run_cancellable(SocketInbox(socket), slow_reply(state))
+
+    assert asyncio.run(run()) is None
+    assert state["cancelled"]
+
+
+def test_disconnect_cancels_the_reply_and_raises():
+    state = {}
+
+    async def run():
+        socket = FakeSocket([{"type": "websocket.disconnect", "code": 1001}])
+        await run_cancellable(SocketInbox(socket), slow_reply(state))
+
+    with pytest.raises(WebSocketDisconnect):
+        asyncio.run(run())
+    assert state["cancelled"]
+
+
+def test_messages_sent_while_a_reply_runs_are_answered_afterwards():
+    state = {}
+
+    async def run():
+        socket = FakeSocket([text({"content": "another question"}), text({"content": "and one more"})])
+        inbox = SocketInbox(socket)
+        response = await run_cancellable(inbox, slow_reply(state, delay=0.05))
+        # The receive loop picks the queued messages up in the order they were sent
+        return response, socket.sent, [await inbox.receive_json(), await inbox.receive_json()]
+
+    response, sent, queued = asyncio.run(run())
+    assert response == {"content": "late"}
+    assert sent == [] and "cancelled" not in state
+    assert [data["content"] for data in queued] == ["another question", "and one more"]
+
+
+def test_queue_of_waiting_messages_is_bounded():
+    async def run():
+        socket = FakeSocket([text({"content": str(i)}) for i in range(3)])
+        inbox = SocketInbox(socket, max_queued=2)
+        await run_cancellable(inbox, slow_reply({}, delay=0.05))
+        return len(inbox.frames), socket.sent
+
+    queued, sent = asyncio.run(run())
+    assert queued == 2 and [frame["type"] for frame in sent] == ["error"]
+
+
+class HangingStream:
+    def __init__(self, first):
+        self.first = first
+        self.closed = False
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=self.first))], usage=None)
+        await asyncio.Event().wait()
+
+    async def close(self):
+        self.closed = True
+
+
+def test_cancelled_stream_closes_the_connection_and_settles_partial_usage(monkeypatch):
+    import app.core.llm as llm
+
+    controller = AdmissionController(
+        global_rpm=600, global_tpm=600, global_concurrency=4,
+        org_rpm=600, org_tpm=600, org_concurrency=4, queue_timeout=1
+    )
+    monkeypatch.setattr(llm, "llm_admission", controller)
+    stream = HangingStream("Partial answer")
+
+    async def create(**kwargs):
+        return stream
+
+    client = OpenAIClient(client=SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))))
+    progress = GenerationProgress()
+    deltas = []
+
+    async def on_delta(content):
+        deltas.append(content)
+
+    async def run():
+        task = asyncio.create_task(client.generate_streamed(
+            on_delta, model="gpt-4", prompt="hi", system_prompt="sys", temperature=0, max_tokens=50, progress=progress
+        ))
+        while not deltas:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    usage = progress.usage()
+    assert stream.closed
+    assert usage["completion_tokens"] > 0 and progress.cost() > 0
+    assert controller.global_limits.active == 0
+    # Only what was used stays taken from the bucket, not the whole max_tokens estimate
+    assert controller.global_limits.tokens.tokens == pytest.approx(600 - usage["total_tokens"], abs=2)
+
+
+def test_flight_is_cancelled_only_when_its_last_waiter_leaves():
+    flights = SingleFlight()
+    state = {}
+
+    async def run():
+        leader = asyncio.create_task(flights.do("key", lambda stream_to: slow_reply(state, delay=0.05)))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("key", lambda stream_to: slow_reply(state, delay=0.05)))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        await asyncio.sleep(0)
+        # The follower still wants the answer
+        assert flights.in_flight("key")
+        result = await follower
+
+        lonely = asyncio.create_task(flights.do("other", lambda stream_to: slow_reply(state)))
+        await asyncio.sleep(0.01)
+        lonely.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await lonely
+        return result
+
+    assert asyncio.run(run()) == ({"content": "late"}, True)
+    assert state["cancelled"]
+    assert not flights.in_flight("other")
+    assert flights.stats()["abandoned"] == 1
+
+
+def test_hedged_calls_each_account_for_their_own_tokens(monkeypatch):
+    import app.core.llm as llm
+    from app.core.model_router import ModelRouter
+
+    monkeypatch.setattr(llm, "model_router", ModelRouter(
+        window=20, min_samples=4, error_threshold=0.5, open_seconds=60, hedge_multiplier=1.0, hedge_min_ms=10
+    ))
+    delays = {"gpt-4": 0.001, "gpt-3.5-turbo": 0.001}
+    started = []
+
+    async def create(model, **kwargs):
+        started.append(model)
+        await asyncio.sleep(delays[model])
+        usage = {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11}
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))],
+            usage=SimpleNamespace(**usage, prompt_tokens_details=None, model_dump=lambda: usage)
+        )
+
+    client = OpenAIClient(client=SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))))
+    completion = dict(model="gpt-4", prompt="hi", system_prompt="sys", temperature=0, max_tokens=50)
+    progress = GenerationProgress()
+
+    async def run():
+        for _ in range(4):
+            await client.generate_routed(fallback_model="gpt-3.5-turbo", hedge=True, **completion)
+        delays.update({"gpt-4": 10, "gpt-3.5-turbo": 10})
+        task = asyncio.create_task(client.generate_routed(
+            fallback_model="gpt-3.5-turbo", hedge=True, progress=progress, **completion
+        ))
+        while started.count("gpt-3.5-turbo") < 1:
+            await asyncio.sleep(0.005)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    primary, hedge = progress.calls
+    assert (primary.model, hedge.model) == ("gpt-4", "gpt-3.5-turbo")
+    # Both prompts were sent, so both count
+    assert progress.usage()["prompt_tokens"] == primary.prompt_tokens + hedge.prompt_tokens > primary.prompt_tokens
+    assert progress.cost() == pytest.approx(sum(call.cost() for call in progress.calls))
+    assert progress.model_used() == "gpt-4"
@@ -0,0 +1,91 @@
+from langchain_core.documents import Document
+from app.core.context_packer import merge_passages, pack_context, select_adaptive
+from app.core.tokenizer import count_tokens
+
+TEXT = " ".join(f"Sentence number {i} explains the refund policy in detail." for i in range(60))
+
+
+def chunk(start, end, index, knowledge_id=1):
+    return Document(page_content=TEXT[start:end], metadata={"knowledge_id": knowledge_id, "chunk_index": index})
+
+
+def test_adaptive_selection_drops_low_scores_but_keeps_best():
+    docs = [(chunk(0, 100, 0), 0.9), (chunk(100, 200, 1), 0.1)]
+    assert len(select_adaptive(docs, score_cutoff=0.3, max_k=5)) == 1
+    assert len(select_adaptive([(chunk(0, 100, 0), 0.1)], score_cutoff=0.3, max_k=5)) == 1
+
+
+def test_overlapping_chunks_are_merged_without_repeating_text():
+    first, second = chunk(0, 1000, 0), chunk(800, 1800, 1)
+    passages = merge_passages([(first, 0.8), (second, 0.7)])
+    assert len(passages) == 1
+    assert passages[0].text == TEXT[0:1800]
+
+
+def test_packed_context_respects_budget_and_saves_tokens():
+    docs = [(chunk(0, 1000, 0), 0.9), (chunk(800, 1800, 1), 0.8), (chunk(1600, 2600, 2), 0.7)]
+    packed = pack_context(docs, budget_tokens=5000, model="gpt-4", score_cutoff=0.3, max_k=8)
+    assert packed.tokens < packed.raw_tokens
+
+    small = pack_context(docs, budget_tokens=120, model="gpt-4", score_cutoff=0.3, max_k=8)
+    assert count_tokens(small.text, "gpt-4") <= 120
+
+
+def test_compression_keeps_the_sentences_that_answer_the_query():
+    from app.core.context_compressor import ContextCompressor
+
+    filler = " ".join(f"Our office number {i} opens at nine and closes at five." for i in range(20))
+    docs = [
+        (Document(page_content=f"{filler} Refunds are issued within 14 days of a return. {filler}", metadata={"knowledge_id": 1}), 0.9),
+        (Document(page_content=f"Shipping is free above 50 dollars. {filler}", metadata={"knowledge_id": 2}), 0.8),
+    ]
+    compressor = ContextCompressor(cache_size=100, cache_ttl=60)
+    compress = lambda passages, _: compressor.compress(passages, 30, query="How many days do refunds take?", model="gpt-4")
+    packed = pack_context(docs, budget_tokens=2000, model="gpt-4", score_cutoff=0.3, max_k=8, compress=compress)
+
+    assert packed.compressed and "Refunds are issued within 14 days" in packed.text
+    assert packed.tokens <= 30 < packed.uncompressed_tokens
+    # No query embedding from retrieval, tf-idf is the fallback
+    assert compressor.stats()["lexically_scored"] == 1 and compressor.runs == 1
+
+
+def test_compression_scores_with_the_retrieval_embedding():
+    from langchain_core.embeddings import Embeddings
+    from app.core.context_compressor import ContextCompressor
+    from app.core.context_packer import Passage
+
+    class KeywordEmbeddings(Embeddings):
+        model = "keyword"
+
+        def __init__(self):
+            self.embedded = []
+
+        def embed_documents(self, texts):
+            self.embedded.extend(texts)
+            return [[float("refund" in text.lower()), 1.0] for text in texts]
+
+        def embed_query(self, text):
+            raise AssertionError("the query embedding comes from retrieval")
+
+    embeddings = KeywordEmbeddings()
+    compressor = ContextCompressor(cache_size=100, cache_ttl=60)
+    passages = [Passage("Our office opens at nine. We pay back money within 14 days. A refund needs a receipt.", 0.9, 1, None, None)]
+    compressed = compressor.compress(passages, 8, query="How long until I get my money?", model="gpt-4", query_embedding=[1.0, 0.0], embeddings=embeddings)
+
+    # Lexically "money" would win, the embedding space prefers the refund sentence
+    assert compressed[0].text == "A refund needs a receipt."
+    assert compressor.stats()["embedding_scored"] == 1 and len(embeddings.embedded) == 3
+    # Sentences are cached per vector space
+    compressor.score("again", ["A refund needs a receipt."], [1.0, 0.0], embeddings)
+    assert len(embeddings.embedded) == 3
+
+
+def test_duplicate_sentences_are_dropped_across_passages_only():
+    from app.core.context_packer import Passage, remove_duplicate_spans
+
+    first = Passage("Step one.\nStep two.\nStep one.", 0.9, 1, None, None)
+    second = Passage("Step two.\n\nReturns take a week.", 0.8, 2, None, None)
+    passages = remove_duplicate_spans([first, second])
+    # Repeats inside one passage and the original line breaks are kept
+    assert passages[0].text == "Step one.\nStep two.\nStep one."
+    assert passages[1].text == "Returns take a week."
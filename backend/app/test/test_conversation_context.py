@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from app.core import vector_store
+from app.core.config import settings
+from app.core.conversation_context import ConversationRetrievalCache
+from app.services import rag_services
+
+
+def test_follow_ups_reuse_or_augment_the_conversation_context(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "CHROMA_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "EMBEDDING_MODEL", "fake-model")
+    monkeypatch.setattr(settings, "VECTOR_TIERING_ENABLED", False)
+    embedder = DeterministicFakeEmbedding(size=16)
+    monkeypatch.setattr(vector_store, "_embedding_functions", {"fake-model": embedder})
+    cache = ConversationRetrievalCache(reuse_threshold=0.9, augment_threshold=0.6, turns=2, max_conversations=10, ttl=60)
+    monkeypatch.setattr(rag_services, "conversation_retrieval_cache", cache)
+
+    searches = []
+    search = rag_services.search_with_relevance_scores
+    async def counting_search(*args, **kwargs):
+        searches.append(kwargs["k"])
+        return await search(*args, **kwargs)
+    monkeypatch.setattr(rag_services, "search_with_relevance_scores", counting_search)
+
+    store = vector_store.get_organization_vector_store(4)
+    store.add_texts([f"chunk {i}" for i in range(30)], metadatas=[{"knowledge_id": 1, "chunk_index": i} for i in range(30)])
+    agent = SimpleNamespace(id=1, organization_id=4)
+
+    rng = np.random.default_rng(0)
+    first = rng.normal(size=16)
+    close = first + 0.05 * rng.normal(size=16)
+    related = first + 0.6 * rng.normal(size=16)
+    unrelated = -first
+
+    def retrieve(vector, conversation_id=7):
+        return asyncio.run(rag_services.retrieve_candidates(agent, "q", list(vector), conversation_id))
+
+    full = retrieve(first)
+    assert searches == [settings.RAG_CANDIDATE_K] and cache.misses == 1
+
+    # Nearly the same question: the earlier chunks are served without a search
+    assert [doc.id for doc, _ in retrieve(close)] == [doc.id for doc, _ in full]
+    assert len(searches) == 1 and cache.reused == 1
+
+    # A related follow-up runs a smaller search merged with what the conversation already has
+    augmented = retrieve(related)
+    assert searches[-1] == settings.RAG_K and cache.augmented == 1
+    assert len({doc.id for doc, _ in augmented}) == len(augmented) <= settings.RAG_CANDIDATE_K
+
+    retrieve(unrelated)
+    assert searches[-1] == settings.RAG_CANDIDATE_K and cache.misses == 2
+
+    # Other conversations never share context
+    retrieve(close, conversation_id=8)
+    assert cache.misses == 3
+
+    # A write to the index invalidates what was remembered
+    store.add_texts(["chunk 30"], metadatas=[{"knowledge_id": 1, "chunk_index": 30}])
+    retrieve(first)
+    assert cache.invalidations == 1 and cache.misses == 4
@@ -0,0 +1,76 @@
+import asyncio
+from langchain_core.embeddings import Embeddings
+from app.core.embedding_cache import CachedEmbeddings, EmbeddingCache, TTLCache
+from app.core.embedding_batcher import CoalescingEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    model = "fake-model"
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [float(len(text)), 1.0]
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1, ttl=-1)
+    assert cache.get("a") is None
+
+
+def test_repeated_queries_skip_embedding_call():
+    inner = CountingEmbeddings()
+    embeddings = CachedEmbeddings(inner, EmbeddingCache(maxsize=10, ttl=60))
+    first = embeddings.embed_query("What are your  opening hours?")
+    second = embeddings.embed_query("what are your opening hours? ")
+    assert first == second
+    assert inner.calls == 1
+    assert embeddings.cache.stats()["hits"] == 1
+
+
+def test_shared_store_serves_other_workers(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    worker_a = CachedEmbeddings(CountingEmbeddings(), EmbeddingCache(maxsize=10, ttl=60, shared_path=path))
+    inner_b = CountingEmbeddings()
+    worker_b = CachedEmbeddings(inner_b, EmbeddingCache(maxsize=10, ttl=60, shared_path=path))
+    vector = worker_a.embed_query("pricing")
+    assert worker_b.embed_query("pricing") == vector
+    assert inner_b.calls == 0
+
+
+class SlowEmbeddings(CountingEmbeddings):
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(0.02)
+        self.calls += 1
+        return [[float(len(t)), 1.0] for t in texts]
+
+
+def test_coalescing_embeddings_batch_concurrent_queries():
+    inner = SlowEmbeddings()
+    batcher = CoalescingEmbeddings(inner, max_batch_size=64, max_wait_ms=5)
+
+    async def run():
+        # An idle batcher dispatches at once
+        assert await batcher.aembed_query("hello") == [5.0, 1.0]
+        return await asyncio.gather(*(batcher.aembed_query("q" * (i % 10 + 1)) for i in range(100)))
+
+    vectors = asyncio.run(run())
+    assert [v[0] for v in vectors] == [float(i % 10 + 1) for i in range(100)]
+    assert inner.calls <= 4
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from app.core.embedding_cache import CachedEmbeddings, EmbeddingCache
+from app.core.embeddings import LocalOnnxEmbeddings, ReducedDimensionEmbeddings, embedding_id, resolve_embedding_config
+from app.core.index_profile import profile_index
+
+
+class FakeEncoding:
+    def __init__(self, ids, length):
+        self.ids = ids + [0] * (length - len(ids))
+        self.attention_mask = [1] * len(ids) + [0] * (length - len(ids))
+
+
+class FakeTokenizer:
+    padding = None
+
+    def enable_truncation(self, max_length):
+        self.max_length = max_length
+
+    def enable_padding(self):
+        self.padding = {"pad_id": 0}
+
+    def encode_batch(self, texts):
+        ids = [[len(word) for word in text.split()] for text in texts]
+        length = max(len(row) for row in ids)
+        return [FakeEncoding(row, length) for row in ids]
+
+
+class FakeInput:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeSession:
+    """Hidden state of a token is (token id, 1), so pooling can be checked by hand"""
+
+    def get_inputs(self):
+        return [FakeInput("input_ids"), FakeInput("attention_mask")]
+
+    def run(self, outputs, feeds):
+        ids = feeds["input_ids"].astype(np.float32)
+        return [np.stack([ids, np.ones_like(ids)], axis=-1)]
+
+
+def test_local_embeddings_mean_pool_real_tokens_and_keep_order():
+    embeddings = LocalOnnxEmbeddings(FakeSession(), FakeTokenizer(), "fake", batch_size=2, threads=2)
+    texts = ["aaa", "a bbb", "cc cc cc", "dddd"]
+    vectors = embeddings.embed_documents(texts)
+
+    assert len(vectors) == 4
+    # "a bbb" -> token vectors (1, 1) and (3, 1), padding ignored -> mean (2, 1)
+    expected = np.array([2.0, 1.0]) / np.linalg.norm([2.0, 1.0])
+    assert np.allclose(vectors[1], expected)
+    assert np.allclose(vectors[3], np.array([4.0, 1.0]) / np.linalg.norm([4.0, 1.0]))
+    assert np.allclose(embeddings.embed_query("cc cc cc"), vectors[2])
+
+
+def test_embedding_config_defaults_and_validation():
+    config = resolve_embedding_config({"provider": "local"})
+    assert config["model"]
+    assert embedding_id("local", config["model"]) == f"local:{config['model']}"
+    assert embedding_id("openai", "text-embedding-3-small") == "text-embedding-3-small"
+    with pytest.raises(ValueError):
+        resolve_embedding_config({"provider": "nope"})
+
+
+def test_embedding_profile_dimensions_and_dtype():
+    config = resolve_embedding_config({"provider": "openai", "model": "text-embedding-3-small", "dimensions": 512, "dtype": "float16"})
+    assert (config["dimensions"], config["dtype"]) == (512, "float16")
+    assert embedding_id("openai", "text-embedding-3-small", 512) == "text-embedding-3-small@512"
+    with pytest.raises(ValueError):
+        resolve_embedding_config({"provider": "openai", "model": "text-embedding-ada-002", "dimensions": 512})
+    with pytest.raises(ValueError):
+        resolve_embedding_config({"provider": "local", "dtype": "int8"})
+
+    reduced = ReducedDimensionEmbeddings(DeterministicFakeEmbedding(size=16), 4)
+    vector = reduced.embed_query("hello")
+    assert len(vector) == 4 and np.isclose(np.linalg.norm(vector), 1.0)
+
+    cached = CachedEmbeddings(reduced, EmbeddingCache(maxsize=10, ttl=60), model="fake@4", dtype="float16")
+    first = cached.embed_query("hello")
+    again = cached.embed_query("hello")
+    assert isinstance(again, list) and np.allclose(first, again, atol=1e-3)
+
+
+def test_profile_report_estimates_memory_per_profile(tmp_path):
+    store = Chroma(persist_directory=str(tmp_path), embedding_function=DeterministicFakeEmbedding(size=64))
+    store.add_texts([f"chunk {i}" for i in range(40)])
+
+    report = profile_index(store, str(tmp_path), {"provider": "openai", "model": "text-embedding-3-small"}, [32, 16, 128])
+    assert report["vectors"] == 40 and report["current"]["dimensions"] == 64
+    by_profile = {p["dimensions"]: p for p in report["profiles"]}
+    assert set(by_profile) == {64, 32, 16}
+    # Chroma keeps float32 whatever the profile dtype, the report does not claim savings from it
+    assert "dtype" not in by_profile[64] and "dtype" not in report["current"]
+    assert by_profile[64]["recall_at_10"] == 1.0
+    assert by_profile[16]["index_ram_bytes"] < by_profile[32]["index_ram_bytes"]
+    assert by_profile[16]["ram_reduction"] > 1.5
+
+    # Truncating a model that was not trained for it would wreck recall, only its native size is listed
+    report = profile_index(store, str(tmp_path), {"provider": "openai", "model": "text-embedding-ada-002"}, [32])
+    assert {p["dimensions"] for p in report["profiles"]} == {64}
@@ -0,0 +1,287 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from app.core.llm import OpenAIClient, StreamInterrupted
+
+
+def chunk(content=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=content))] if content is not None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class FakeCompletions:
+    def __init__(self, chunks, fail_after=None, error=None, failures=None):
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.error = error or RuntimeError("connection reset")
+        self.failures = failures
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        fails = self.failures is None or len(self.calls) <= self.failures
+
+        async def stream():
+            for i, item in enumerate(self.chunks):
+                if i == self.fail_after and fails:
+                    raise self.error
+                yield item
+        return stream()
+
+
+def client_with(completions):
+    return OpenAIClient(client=SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+
+def usage(prompt, completion):
+    return SimpleNamespace(
+        prompt_tokens=prompt, completion_tokens=completion, total_tokens=prompt + completion,
+        model_dump=lambda: {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+    )
+
+
+def test_stream_forwards_deltas_and_ends_with_usage_and_cost():
+    completions = FakeCompletions([chunk("Hel"), chunk("lo"), chunk(""), chunk(" world"), chunk(usage=usage(100, 3))])
+    client = client_with(completions)
+    deltas = []
+
+    async def on_delta(content):
+        deltas.append(content)
+
+    response = asyncio.run(client.generate_streamed(
+        on_delta, model="gpt-4", prompt="hi", system_prompt="sys", temperature=0, max_tokens=50
+    ))
+    assert deltas == ["Hel", "lo", " world"]
+    assert response["content"] == "Hello world"
+    assert response["usage"]["total_tokens"] == 103
+    assert response["cost"] == pytest.approx(100 * 0.03 / 1000 + 3 * 0.06 / 1000)
+    assert response["time_to_first_token_ms"] is not None
+    assert completions.calls[0]["stream"] and completions.calls[0]["stream_options"] == {"include_usage": True}
+
+
+def connection_error():
+    import httpx
+    import openai
+    return openai.APIConnectionError(request=httpx.Request("POST", "http://llm.test/v1/chat/completions"))
+
+
+def test_stream_failure_after_first_delta_is_not_retried(monkeypatch):
+    from app.core.llm_admission import llm_retry_policy
+
+    monkeypatch.setattr(llm_retry_policy, "base_delay", 0)
+    completions = FakeCompletions([chunk("partial"), chunk("more")], fail_after=1, error=connection_error())
+    client = client_with(completions)
+
+    async def on_delta(content):
+        pass
+
+    with pytest.raises(StreamInterrupted):
+        asyncio.run(client.generate_streamed(
+            on_delta, model="gpt-4", prompt="hi", system_prompt="sys", temperature=0, max_tokens=50
+        ))
+    assert len(completions.calls) == 1
+
+
+def test_stream_connection_error_is_wrapped_like_generate(monkeypatch):
+    import openai
+    from fastapi import HTTPException
+    from app.core.llm_admission import llm_retry_policy
+    from app.core.model_router import is_model_failure
+
+    monkeypatch.setattr(llm_retry_policy, "next_delay", lambda error, attempt: None)
+    completions = FakeCompletions([chunk("ok")], fail_after=0, error=connection_error(), failures=1)
+    client = client_with(completions)
+
+    async def on_delta(content):
+        pass
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(client.generate_streamed(
+            on_delta, model="gpt-4", prompt="hi", system_prompt="sys", temperature=0, max_tokens=50
+        ))
+    assert isinstance(raised.value.__cause__, openai.APIConnectionError)
+    # The router still sees the provider failure through the cause and fails over
+    assert is_model_failure(raised.value)
+
+
+def test_stream_is_retried_before_its_first_delta(monkeypatch):
+    from app.core.llm_admission import llm_retry_policy
+
+    monkeypatch.setattr(llm_retry_policy, "base_delay", 0)
+    completions = FakeCompletions([chunk("ok"), chunk(usage=usage(10, 1))], fail_after=0, error=connection_error(), failures=1)
+    client = client_with(completions)
+    deltas = []
+
+    async def on_delta(content):
+        deltas.append(content)
+
+    response = asyncio.run(client.generate_streamed(
+        on_delta, model="gpt-4", prompt="hi", system_prompt="sys", temperature=0, max_tokens=50
+    ))
+    assert deltas == ["ok"] and response["content"] == "ok"
+    assert len(completions.calls) == 2
+
+
+def test_pooled_client_reuses_one_keep_alive_connection(monkeypatch):
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from app.core.llm_pool import LLMClientPool
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            body = json.dumps({
+                "id": "cmpl", "object": "chat.completion", "created": 0, "model": "gpt-4",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}}],
+                "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6}
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    pool = LLMClientPool()
+
+    async def run():
+        client = OpenAIClient(client=pool.client)
+        for _ in range(3):
+            response = await client.generate(model="gpt-4", prompt="hi", system_prompt="sys", temperature=0, max_tokens=5)
+            assert response["content"] == "ok"
+        await pool.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.shutdown()
+    stats = pool.metrics.stats()
+    assert stats["requests"] == 3 and stats["new_connections"] == 1
+    assert stats["connection_reuse_percent"] > 60 and stats["max_pool_wait_ms"] >= 0
+
+
+def test_oversized_prompt_is_trimmed_before_the_call_keeping_the_question():
+    class Completions:
+        def __init__(self):
+            self.calls = []
+
+        async def create(self, **kwargs):
+            self.calls.append(kwargs)
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))],
+                usage=SimpleNamespace(
+                    prompt_tokens=10, completion_tokens=1, total_tokens=11, prompt_tokens_details=None,
+                    model_dump=lambda: {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11}
+                )
+            )
+
+    from app.core.tokenizer import count_message_tokens, get_context_window
+
+    completions = Completions()
+    prompt = "Context: " + "lorem ipsum dolor " * 6000 + "\n\nQuestion: what is it?"
+    response = asyncio.run(client_with(completions).generate(
+        model="gpt-4", prompt=prompt, system_prompt="sys", temperature=0, max_tokens=500
+    ))
+    sent = completions.calls[0]["messages"][1]["content"]
+    assert response["prompt_trimmed_tokens"] > 0
+    assert sent.startswith("Context: ") and sent.endswith("\n\nQuestion: what is it?")
+    assert count_message_tokens("gpt-4", "sys", sent) + completions.calls[0]["max_tokens"] <= get_context_window("gpt-4")
+
+
+
+def test_question_with_blank_lines_is_kept_whole_when_trimming():
+    from app.core.tokenizer import fit_prompt
+
+    question = "\n\nVisitor: My order is late.\n\nIt was placed a week ago, where is it?"
+    prompt = "Earlier turns\n\nContext:\n" + "lorem ipsum dolor " * 6000 + question
+    fitted = fit_prompt("gpt-4", "sys", prompt, 500)
+    assert fitted.trimmed_tokens > 0
+    assert fitted.prompt.startswith("Earlier turns") and fitted.prompt.endswith(question)
+
+def test_cost_uses_cached_prompt_pricing_and_family_prices():
+    from app.core.llm import get_model_pricing
+
+    cached = SimpleNamespace(
+        prompt_tokens=1000, completion_tokens=100, prompt_tokens_details=SimpleNamespace(cached_tokens=800)
+    )
+    pricing = get_model_pricing("gpt-4o-2024-08-06")
+    assert pricing == get_model_pricing("gpt-4o")
+    assert OpenAIClient()._calculate_cost(cached, "gpt-4o") == pytest.approx(
+        200 * pricing["input"] + 800 * pricing["cached_input"] + 100 * pricing["output"]
+    )
+    # Unknown models are never priced below the most expensive known one
+    assert get_model_pricing("some-new-model")["input"] >= get_model_pricing("gpt-4")["input"]
+
+
+def test_registry_sends_self_hosted_models_to_their_own_pooled_endpoint(monkeypatch):
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import app.core.llm as llm
+    from app.core.llm_pool import DEFAULT_PROVIDER, ProviderConfig, ProviderRegistry
+
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            seen.append((self.path, self.headers["Authorization"], request["model"]))
+            body = json.dumps({
+                "id": "cmpl", "object": "chat.completion", "created": 0, "model": request["model"],
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "local"}}],
+                "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6}
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    registry = ProviderRegistry([ProviderConfig(
+        name="inference", base_url=f"http://127.0.0.1:{server.server_port}/v1", api_key="local-key",
+        models=["llama-3-8b"], max_connections=4, timeout=5
+    )])
+    monkeypatch.setattr(llm, "llm_providers", registry)
+
+    async def run():
+        client = OpenAIClient()
+        for _ in range(2):
+            response = await client.generate(model="llama-3-8b", prompt="hi", system_prompt="sys", temperature=0, max_tokens=5)
+            assert response["content"] == "local"
+        await registry.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.shutdown()
+    assert seen == [("/v1/chat/completions", "Bearer local-key", "llama-3-8b")] * 2
+    assert registry.provider_for("llama-3-8b") == "inference"
+    assert registry.provider_for("gpt-4") == DEFAULT_PROVIDER
+    assert "llama-3-8b" in registry.models() and "gpt-4" in registry.models()
+    stats = registry.stats()["inference"]
+    assert stats["max_connections"] == 4 and stats["new_connections"] == 1 and stats["requests"] == 2
+
+
+def test_registry_rejects_a_model_listed_by_two_providers():
+    from app.core.llm_pool import ProviderConfig, ProviderRegistry
+
+    with pytest.raises(ValueError):
+        ProviderRegistry([
+            ProviderConfig(name="a", base_url="http://a/v1", models=["m"]),
+            ProviderConfig(name="b", base_url="http://b/v1", models=["m"]),
+        ])
@@ -0,0 +1,94 @@
+import asyncio
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from app.core.config import settings
+from app.db.models.chat import ChatMessage, Conversation
+from app.services import memory_services
+from app.services.memory_services import ConversationSummarizer, build_history, select_history
+
+
+def messages(count):
+    return [
+        ChatMessage(sequence_id=i, sender="user" if i % 2 else "agent", content=f"message number {i} " + "word " * 20)
+        for i in range(1, count + 1)
+    ]
+
+
+def test_history_size_stays_bounded_as_the_conversation_grows():
+    sizes = [select_history("The user wants a refund for order 42.", messages(n), 800, "gpt-4").tokens for n in (8, 40, 400)]
+    assert max(sizes) <= 800 and max(sizes) - min(sizes) < 10
+
+    history = select_history(None, messages(10), 800, "gpt-4")
+    assert history.recent_messages == settings.CONVERSATION_RECENT_MESSAGES
+    assert history.text.splitlines()[-1].startswith("Assistant: message number 10")
+
+
+def test_refresh_folds_older_messages_into_the_stored_summary(monkeypatch):
+    prompts = []
+
+    async def generate(**kwargs):
+        prompts.append(kwargs)
+        return {"content": " Refund requested for order 42. "}
+
+    monkeypatch.setattr(memory_services.llm_client, "generate", generate)
+
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as connection:
+            await connection.run_sync(
+                Conversation.metadata.create_all, tables=[Conversation.__table__, ChatMessage.__table__]
+            )
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            db.add(Conversation(id=1, title="Refund"))
+            for message in messages(12):
+                message.conversation_id = 1
+                db.add(message)
+            await db.commit()
+
+            summarizer = ConversationSummarizer()
+            refreshed = await summarizer.refresh(db, 1, organization_id=7)
+            # Nothing new fell out of the recent window, so a second refresh has nothing to do
+            refreshed_again = await summarizer.refresh(db, 1, organization_id=7)
+            db.expire_all()
+            conversation = await db.get(Conversation, 1)
+            history = await build_history(db, 1, 13, "gpt-4")
+        await engine.dispose()
+        return refreshed, refreshed_again, conversation, history
+
+    refreshed, refreshed_again, conversation, history = asyncio.run(run())
+    assert refreshed and not refreshed_again
+    assert conversation.summary == "Refund requested for order 42."
+    assert conversation.summarized_through == 12 - settings.CONVERSATION_RECENT_MESSAGES
+    assert prompts[0]["priority"] == memory_services.BACKGROUND and prompts[0]["organization_id"] == 7
+    assert "message number 1 " in prompts[0]["prompt"] and "message number 7 " not in prompts[0]["prompt"]
+    assert history.summarized and history.recent_messages == settings.CONVERSATION_RECENT_MESSAGES
+
+
+def test_cancelled_turn_is_saved_but_left_out_of_history():
+    from app.db.repository.chat import save_cancelled_reply
+
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as connection:
+            await connection.run_sync(
+                Conversation.metadata.create_all, tables=[Conversation.__table__, ChatMessage.__table__]
+            )
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            db.add(Conversation(id=1, title="Refund"))
+            db.add(ChatMessage(conversation_id=1, sequence_id=1, sender="user", content="Where is order 42?"))
+            db.add(ChatMessage(conversation_id=1, sequence_id=2, sender="agent", content="It ships tomorrow."))
+            db.add(ChatMessage(conversation_id=1, sequence_id=3, sender="user", content="Write me a long poem"))
+            await db.commit()
+
+            reply = await save_cancelled_reply(db, {
+                "conversation_id": 1, "content": "Roses are", "sender": "agent",
+                "user_id": None, "agent_id": None, "sequence_id": 4
+            })
+            history = await build_history(db, 1, 5, "gpt-4")
+        await engine.dispose()
+        return reply, history
+
+    reply, history = asyncio.run(run())
+    assert reply.cancelled and reply.content == "Roses are"
+    # The next prompt only sees the completed turn
+    assert history.recent_messages == 2
+    assert "poem" not in history.text and "Roses" not in history.text
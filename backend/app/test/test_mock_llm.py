@@ -0,0 +1,92 @@
+import asyncio
+import httpx
+import numpy as np
+import openai
+import pytest
+from openai import AsyncOpenAI
+from app.core.llm import OpenAIClient
+from benchmarks.mock_llm import MockConfig, create_app
+
+MOCK_URL = "http://mock.test/v1"
+
+
+def mock_client(**config):
+    app = create_app(MockConfig(ttft_ms=0, tokens_per_second=0, embedding_ms=0, **config))
+    http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app))
+    return app, AsyncOpenAI(api_key="test", base_url=MOCK_URL, max_retries=0, http_client=http_client)
+
+
+def test_answers_are_deterministic_and_streaming_matches():
+    app, sdk = mock_client(completion_tokens=12)
+    client = OpenAIClient(client=sdk)
+    completion = dict(model="gpt-4", prompt="Where is my order?", system_prompt="sys", temperature=0.7, max_tokens=50)
+    deltas = []
+
+    async def on_delta(content):
+        deltas.append(content)
+
+    async def run():
+        first = await client.generate(**completion)
+        again = await client.generate(**{**completion, "temperature": 0})
+        other = await client.generate(**{**completion, "prompt": "How do refunds work?"})
+        streamed = await client.generate_streamed(on_delta, **completion)
+        return first, again, other, streamed
+
+    first, again, other, streamed = asyncio.run(run())
+    assert first["content"] == again["content"] != other["content"]
+    assert first["usage"]["completion_tokens"] == 12
+    assert streamed["content"] == "".join(deltas) == first["content"]
+    assert streamed["usage"] == first["usage"]
+    assert app.state.mock.stats.streamed == 1
+
+
+def test_injected_rate_limits_carry_retry_after():
+    app, sdk = mock_client(rate_limit_rate=1.0, retry_after=2.5)
+
+    async def run():
+        await sdk.chat.completions.create(model="gpt-4", messages=[{"role": "user", "content": "hi"}])
+
+    with pytest.raises(openai.RateLimitError) as error:
+        asyncio.run(run())
+    assert error.value.response.headers["retry-after"] == "2.5"
+    assert app.state.mock.stats.rate_limits_injected == 1
+
+
+def test_embeddings_are_deterministic_normalized_and_similar_for_shared_words():
+    _, sdk = mock_client()
+
+    async def run():
+        texts = ["refund policy for orders", "refund policy for orders", "reset my password"]
+        response = await sdk.embeddings.create(model="text-embedding-3-small", input=texts, dimensions=256)
+        return [np.asarray(item.embedding) for item in response.data]
+
+    same, repeat, other = asyncio.run(run())
+    assert len(same) == 256 and np.linalg.norm(same) == pytest.approx(1.0, abs=1e-5)
+    assert np.allclose(same, repeat)
+    assert float(same @ repeat) > float(same @ other)
+
+
+def test_mock_url_points_providers_and_embeddings_at_the_mock(monkeypatch):
+    from app.core.config import settings
+    from app.core.embeddings import _openai_embeddings, embedding_id
+    from app.core.llm_pool import ProviderRegistry
+
+    monkeypatch.setattr(settings, "LLM_MOCK_URL", MOCK_URL)
+    monkeypatch.setattr(settings, "LLM_PROVIDERS", {"inference": {"base_url": "http://gpu.internal/v1", "models": ["llama-3-8b"]}})
+    registry = ProviderRegistry.from_settings()
+    assert {pool.provider.base_url for pool in registry.pools.values()} == {MOCK_URL}
+    embeddings = _openai_embeddings("text-embedding-3-small")
+    assert embeddings.openai_api_base == MOCK_URL and not embeddings.check_embedding_ctx_length
+    # Mock vectors never share a cache or index namespace with the real model's
+    assert embedding_id("openai", "text-embedding-3-small") == "mock:text-embedding-3-small"
+
+
+def test_fault_bookkeeping_is_bounded(monkeypatch):
+    from benchmarks.mock_llm import MockLLM
+
+    monkeypatch.setattr(MockLLM, "SEEN_LIMIT", 3)
+    mock = MockLLM(MockConfig())
+    for key in ("a", "b", "a", "c", "d"):
+        mock.fault(key)
+    # "b" was the least recently seen body
+    assert list(mock._seen.items()) == [("a", 2), ("c", 1), ("d", 1)]
@@ -0,0 +1,116 @@
+import asyncio
+import httpx
+import openai
+import pytest
+from app.core.exceptions import invalid_api_key_error, openai_exception
+from app.core.model_router import (
+    CIRCUIT_OPEN, FALLBACK, HEDGE_FALLBACK, PRIMARY, ModelRouter, StreamInterrupted, is_model_failure
+)
+
+
+def router(**overrides):
+    options = dict(window=20, min_samples=4, error_threshold=0.5, open_seconds=60, hedge_multiplier=1.0, hedge_min_ms=10)
+    options.update(overrides)
+    return ModelRouter(**options)
+
+
+def provider_error():
+    request = httpx.Request("POST", "http://llm.test/v1/chat/completions")
+    try:
+        try:
+            raise openai.InternalServerError("boom", response=httpx.Response(500, request=request), body=None)
+        except Exception:
+            raise openai_exception("API error occurred")
+    except Exception as e:
+        return e
+
+
+def calls_to(behaviour):
+    """call(model) that runs behaviour[model] and remembers which models were asked"""
+    asked = []
+
+    async def call(model):
+        asked.append(model)
+        return await behaviour[model]()
+
+    return call, asked
+
+
+async def answer(model, delay=0.0):
+    await asyncio.sleep(delay)
+    return {"content": model, "model": model}
+
+
+async def fail():
+    raise provider_error()
+
+
+def test_mapped_provider_errors_count_as_model_failures():
+    assert is_model_failure(provider_error())
+    assert not is_model_failure(invalid_api_key_error())
+
+
+def test_failure_falls_back_and_repeated_failures_open_the_circuit():
+    model_router = router()
+    call, asked = calls_to({"gpt-4": fail, "gpt-3.5-turbo": lambda: answer("gpt-3.5-turbo")})
+
+    async def run():
+        return [await model_router.route(call, "gpt-4", "gpt-3.5-turbo") for _ in range(6)]
+
+    responses = asyncio.run(run())
+    assert [r["route"] for r in responses] == [FALLBACK] * 4 + [CIRCUIT_OPEN] * 2
+    assert asked.count("gpt-4") == 4
+    assert model_router.stats()["models"]["gpt-4"]["state"] == "open"
+
+
+def test_without_fallback_errors_reach_the_caller():
+    model_router = router()
+    call, _ = calls_to({"gpt-4": fail})
+    with pytest.raises(Exception) as error:
+        asyncio.run(model_router.route(call, "gpt-4", None))
+    assert is_model_failure(error.value)
+
+
+def test_half_open_probe_closes_the_circuit():
+    model_router = router(open_seconds=0)
+    behaviour = {"gpt-4": fail, "gpt-3.5-turbo": lambda: answer("gpt-3.5-turbo")}
+    call, _ = calls_to(behaviour)
+
+    async def run():
+        for _ in range(4):
+            await model_router.route(call, "gpt-4", "gpt-3.5-turbo")
+        behaviour["gpt-4"] = lambda: answer("gpt-4")
+        return await model_router.route(call, "gpt-4", "gpt-3.5-turbo")
+
+    assert asyncio.run(run())["route"] == PRIMARY
+    assert model_router.stats()["models"]["gpt-4"]["state"] == "closed"
+
+
+def test_slow_primary_is_hedged_past_its_p95():
+    model_router = router()
+    behaviour = {"gpt-4": lambda: answer("gpt-4", 0.001), "gpt-3.5-turbo": lambda: answer("gpt-3.5-turbo")}
+    call, _ = calls_to(behaviour)
+
+    async def run():
+        for _ in range(4):
+            await model_router.route(call, "gpt-4", "gpt-3.5-turbo", hedge=True)
+        behaviour["gpt-4"] = lambda: answer("gpt-4", 1.0)
+        return await model_router.route(call, "gpt-4", "gpt-3.5-turbo", hedge=True)
+
+    response = asyncio.run(run())
+    assert response["route"] == HEDGE_FALLBACK and response["model"] == "gpt-3.5-turbo"
+
+
+def test_interrupted_stream_is_not_answered_again_by_the_fallback():
+    model_router = router()
+
+    async def interrupted():
+        try:
+            raise provider_error()
+        except Exception as e:
+            raise StreamInterrupted("cut") from e
+
+    call, asked = calls_to({"gpt-4": interrupted, "gpt-3.5-turbo": lambda: answer("gpt-3.5-turbo")})
+    with pytest.raises(StreamInterrupted):
+        asyncio.run(model_router.route(call, "gpt-4", "gpt-3.5-turbo", streaming=True))
+    assert asked == ["gpt-4"]
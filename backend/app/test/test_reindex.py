@@ -0,0 +1,51 @@
+import os
+import asyncio
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from app.core import vector_store
+from app.core.config import settings
+from app.core.embedding_cache import CachedEmbeddings, EmbeddingCache
+from app.core.reindex import ReindexManager
+
+
+def test_reindex_builds_shadow_index_and_swaps(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "CHROMA_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "EMBEDDING_LEGACY_MODEL", "old-model")
+    monkeypatch.setattr(settings, "EMBEDDING_MODEL", "new-model")
+    monkeypatch.setattr(settings, "REINDEX_RETIRE_DELAY", 0)
+    cache = EmbeddingCache(maxsize=100, ttl=60)
+    monkeypatch.setattr(vector_store, "_embedding_functions", {
+        "old-model": CachedEmbeddings(DeterministicFakeEmbedding(size=8), cache, model="old-model"),
+        "new-model": CachedEmbeddings(DeterministicFakeEmbedding(size=12), cache, model="new-model"),
+    })
+
+    # An index written before manifests existed
+    legacy = Chroma(
+        persist_directory=str(tmp_path / "7"),
+        embedding_function=vector_store.get_embedding_function("old-model")
+    )
+    legacy.add_texts(
+        [f"chunk {i}" for i in range(10)],
+        metadatas=[{"knowledge_id": 1, "chunk_index": i} for i in range(10)]
+    )
+    assert vector_store.load_manifest(7)["active"]["model"] == "old-model"
+
+    manager = ReindexManager(batch_size=4, tokens_per_minute=10**9)
+    assert manager.stale_organizations([7]) == [7]
+
+    async def run():
+        await manager.run(7, {"provider": "openai", "model": "new-model"})
+        await asyncio.sleep(0.1)  # let the retire task remove the legacy files
+
+    asyncio.run(run())
+
+    manifest = vector_store.load_manifest(7)
+    assert manifest["active"]["model"] == "new-model"
+    assert manifest["active"]["path"] == "gen-1"
+    assert manifest["building"] is None
+    assert manager.jobs[7].progress()["percent"] == 100.0
+    assert not os.path.exists(tmp_path / "7" / "chroma.sqlite3")
+
+    store = vector_store.get_organization_vector_store(7)
+    assert store._collection.count() == 10
+    assert store.similarity_search("chunk 3", k=1)[0].page_content == "chunk 3"
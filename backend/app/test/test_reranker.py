@@ -0,0 +1,70 @@
+import numpy as np
+from langchain_core.documents import Document
+from app.core.reranker import OnnxCrossEncoder, Reranker
+
+
+class FakeEncoding:
+    def __init__(self, ids, type_ids, length):
+        self.ids = ids + [0] * (length - len(ids))
+        self.type_ids = type_ids + [0] * (length - len(type_ids))
+        self.attention_mask = [1] * len(ids) + [0] * (length - len(ids))
+
+
+class FakeTokenizer:
+    padding = None
+
+    def enable_truncation(self, max_length):
+        self.max_length = max_length
+
+    def enable_padding(self):
+        self.padding = {"pad_id": 0}
+
+    def encode_batch(self, pairs):
+        # Word ids are their length, passage words are marked with type id 1
+        rows = [([len(w) for w in query.split()] + [len(w) for w in passage.split()], [0] * len(query.split()) + [1] * len(passage.split())) for query, passage in pairs]
+        length = max(len(ids) for ids, _ in rows)
+        return [FakeEncoding(ids, type_ids, length) for ids, type_ids in rows]
+
+
+class FakeInput:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeSession:
+    """Relevance logit is the number of passage words as long as the first query word"""
+
+    def __init__(self):
+        self.batches = 0
+
+    def get_inputs(self):
+        return [FakeInput("input_ids"), FakeInput("attention_mask"), FakeInput("token_type_ids")]
+
+    def run(self, outputs, feeds):
+        self.batches += 1
+        ids, types = feeds["input_ids"], feeds["token_type_ids"]
+        matches = ((ids == ids[:, :1]) & (types == 1)).sum(axis=1).astype(np.float32)
+        return [np.stack([-matches, matches], axis=1)]
+
+
+def test_cross_encoder_reranks_in_batches_and_keeps_top_n():
+    session = FakeSession()
+    encoder = OnnxCrossEncoder(session, FakeTokenizer(), "fake", batch_size=2, threads=2)
+    passages = ["a bb cc", "dddd eeee ffff", "gggg", "hh ii", "jjjj kkkk"]
+    assert np.array_equal(encoder.score("wxyz", passages), [0, 3, 1, 0, 2])
+    assert session.batches == 3
+
+    reranker = Reranker(model=None, cross_encoder=encoder)
+    candidates = [(Document(page_content=text, id=str(i)), 0.9 - i * 0.1) for i, text in enumerate(passages)]
+    top = reranker.rerank("wxyz", candidates, top_n=2)
+    assert [doc.id for doc, _ in top] == ["1", "4"]
+    assert all(0 < score < 1 for _, score in top) and top[0][1] > top[1][1]
+    assert reranker.stats()["pairs_scored"] == 5
+
+
+def test_missing_model_disables_reranking(tmp_path, monkeypatch):
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "RERANK_MODEL_DIR", str(tmp_path))
+    reranker = Reranker(model="missing-model")
+    assert reranker.rerank("q", [(Document(page_content="x"), 0.5)], top_n=1) is None
+    assert reranker.stats()["disabled"]
@@ -0,0 +1,79 @@
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from app.core import vector_store
+from app.core.config import settings
+from app.core.sharded_vector_store import ShardedVectorStore, plan_shards
+from app.core.vector_maintenance import count_vectors_by_knowledge, delete_knowledge_vectors, reshard_index
+
+
+def test_reshard_spreads_chunks_and_search_matches_unsharded(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "CHROMA_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "EMBEDDING_MODEL", "fake-model")
+    embedder = DeterministicFakeEmbedding(size=16)
+    monkeypatch.setattr(vector_store, "_embedding_functions", {"fake-model": embedder})
+
+    store = vector_store.get_organization_vector_store(5)
+    assert isinstance(store, Chroma)
+    for knowledge_id in (1, 2, 3, 4):
+        store.add_texts(
+            [f"knowledge {knowledge_id} chunk {i}" for i in range(25)],
+            metadatas=[{"knowledge_id": knowledge_id, "chunk_index": i} for i in range(25)]
+        )
+    query = embedder.embed_query("knowledge 2 chunk 7")
+    expected = [doc.page_content for doc, _ in store.similarity_search_by_vector_with_relevance_scores(query, k=10)]
+
+    assert reshard_index(5, shards=4)["moved"] > 0
+    store = vector_store.get_organization_vector_store(5)
+    assert isinstance(store, ShardedVectorStore)
+    sizes = [shard._collection.count() for shard in store.shards]
+    assert sum(sizes) == 100 and min(sizes) > 0
+    found = [doc.page_content for doc, _ in store.similarity_search_by_vector_with_relevance_scores(query, k=10)]
+    assert found == expected
+
+    # Placement by knowledge base: a knowledge_id filter is answered by a single shard
+    reshard_index(5, shard_by="knowledge_base")
+    store = vector_store.get_organization_vector_store(5)
+    placement = [
+        {m["knowledge_id"] for m in shard._collection.get(include=["metadatas"])["metadatas"]}
+        for shard in store.shards
+    ]
+    assert all(sum(knowledge_id in ids for ids in placement) == 1 for knowledge_id in (1, 2, 3, 4))
+    assert len(store._route({"knowledge_id": 3})) == 1
+    hits = store.similarity_search_by_vector_with_relevance_scores(query, k=5, filter={"knowledge_id": 3})
+    assert len(hits) == 5 and all(doc.metadata["knowledge_id"] == 3 for doc, _ in hits)
+
+    assert delete_knowledge_vectors(store, 3, batch_size=7) == 25
+    assert count_vectors_by_knowledge(store, page_size=9) == {1: 25, 2: 25, 4: 25}
+
+    # Back to one shard, the leftover collections are dropped
+    reshard_index(5, shards=1)
+    store = vector_store.get_organization_vector_store(5)
+    assert isinstance(store, Chroma) and store._collection.count() == 75
+    assert len(store._client.list_collections()) == 1
+
+
+def test_plan_shards_doubles_until_shards_fit(monkeypatch):
+    monkeypatch.setattr(settings, "VECTOR_SHARD_MAX_SIZE", 100)
+    monkeypatch.setattr(settings, "VECTOR_MAX_SHARDS", 8)
+    assert plan_shards(50) == 1
+    assert plan_shards(250) == 4
+    assert plan_shards(250, current=4) == 4
+    assert plan_shards(10_000, current=2) == 8
+
+
+def test_from_texts_routes_chunks_to_their_shards(tmp_path):
+    embedder = DeterministicFakeEmbedding(size=16)
+    texts = [f"knowledge {i % 3} chunk {i}" for i in range(30)]
+    metadatas = [{"knowledge_id": i % 3, "chunk_index": i} for i in range(30)]
+    store = ShardedVectorStore.from_texts(
+        texts, embedder, metadatas=metadatas, shard_count=3, shard_by="knowledge_base", persist_directory=str(tmp_path)
+    )
+    assert store._collection.count() == 30
+    # Sharded by knowledge base, every knowledge base lives in exactly one shard
+    placement = [
+        {m["knowledge_id"] for m in shard._collection.get(include=["metadatas"])["metadatas"]}
+        for shard in store.shards
+    ]
+    assert all(sum(knowledge_id in ids for ids in placement) == 1 for knowledge_id in (0, 1, 2))
+    found = store.similarity_search("knowledge 1 chunk 4", k=1, filter={"knowledge_id": 1})
+    assert found[0].page_content == "knowledge 1 chunk 4"
@@ -0,0 +1,155 @@
+import asyncio
+from types import SimpleNamespace
+from app.core.single_flight import SingleFlight, flight_key, single_flight_allowed
+
+
+def agent(**config):
+    return SimpleNamespace(id=1, config=config, system_prompt=None, personality_traits=None, custom_prompt=None)
+
+
+def test_concurrent_identical_requests_share_one_streamed_answer():
+    flights = SingleFlight()
+    calls = []
+
+    async def work(stream_to):
+        calls.append(stream_to)
+        for part in ("Hel", "lo"):
+            await stream_to(part)
+            await asyncio.sleep(0.01)
+        return "Hello"
+
+    async def run():
+        received = {"leader": [], "follower": []}
+
+        async def leader_delta(content):
+            received["leader"].append(content)
+
+        async def follower_delta(content):
+            received["follower"].append(content)
+
+        leader = asyncio.create_task(flights.do("key", work, leader_delta))
+        await asyncio.sleep(0.005)
+        # Joins after the first delta went out, gets it replayed
+        follower = asyncio.create_task(flights.do("key", work, follower_delta))
+        return await leader, await follower, received
+
+    leader, follower, received = asyncio.run(run())
+    assert leader == ("Hello", False) and follower == ("Hello", True)
+    assert received["leader"] == received["follower"] == ["Hel", "lo"]
+    assert len(calls) == 1
+    assert flights.stats()["coalesced"] == 1 and flights.stats()["in_flight"] == 0
+
+
+def test_leader_disconnect_does_not_fail_followers():
+    flights = SingleFlight()
+
+    async def work(stream_to):
+        await stream_to("a")
+        await asyncio.sleep(0.01)
+        await stream_to("b")
+        return "ab"
+
+    async def run():
+        async def broken(content):
+            raise ConnectionError("socket closed")
+
+        follower_parts = []
+
+        async def follower_delta(content):
+            follower_parts.append(content)
+
+        leader = asyncio.create_task(flights.do("key", work, broken))
+        await asyncio.sleep(0)
+        follower = await flights.do("key", work, follower_delta)
+        leader.cancel()
+        return follower, follower_parts
+
+    follower, parts = asyncio.run(run())
+    assert follower == ("ab", True) and parts == ["a", "b"]
+
+
+def test_failure_reaches_every_waiter_and_clears_the_flight():
+    flights = SingleFlight()
+
+    async def work(stream_to):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("provider down")
+
+    async def run():
+        results = await asyncio.gather(flights.do("key", work), flights.do("key", work), return_exceptions=True)
+        return results
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flights.stats()["in_flight"] == 0 and flights.stats()["failures"] == 1
+
+
+def test_only_safe_agents_coalesce():
+    assert single_flight_allowed(agent(temperature=0.2))
+    assert not single_flight_allowed(agent(temperature=0.7))
+    assert not single_flight_allowed(agent(temperature=0.2, single_flight=False))
+    assert flight_key(agent(), "What  is it?", 0.2) == flight_key(agent(), "What is it? ", 0.2)
+    assert flight_key(agent(), "What is it?", 0.2) != flight_key(agent(model_name="gpt-4"), "What is it?", 0.2)
+
+
+def test_widget_flight_uses_its_own_session_once_the_leader_is_gone(monkeypatch):
+    import pytest
+    from contextlib import asynccontextmanager
+    from app.core.config import settings
+
+    # Needs the knowledge loaders (youtube, whisper) the widget service imports
+    widget_services = pytest.importorskip("app.services.widget_services")
+    WidgetService = widget_services.WidgetService
+
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ENABLED", False)
+    public_agent = SimpleNamespace(
+        id=1, organization_id=2, config={"temperature": 0.2}, context_window_size=2000, enable_fallback=False,
+        theme_color=None, greeting_message=None, is_public=True, system_prompt=None, personality_traits=None,
+        custom_prompt=None
+    )
+    leader_db = object()
+    flight_sessions, recorded = [], []
+    generating = asyncio.Event()
+
+    @asynccontextmanager
+    async def session_local():
+        session = object()
+        flight_sessions.append(session)
+        yield session
+
+    async def no_rag(*args, **kwargs):
+        raise RuntimeError("index unavailable")
+
+    async def knowledge_bases(db, agent_id):
+        assert db is not leader_db and agent_id == 1
+        return []
+
+    async def generate_routed(**kwargs):
+        generating.set()
+        await asyncio.sleep(10)
+
+    async def record_cancelled_chat(db, progress, started_at, **fields):
+        recorded.append((db, fields["agent_id"]))
+
+    service = WidgetService()
+
+    async def verify(db, agent_id):
+        return public_agent
+
+    monkeypatch.setattr(service, "verify_public_agent", verify)
+    monkeypatch.setattr(service.llm_client, "generate_routed", generate_routed)
+    monkeypatch.setattr(widget_services, "SessionLocal", session_local)
+    monkeypatch.setattr(widget_services, "build_rag_context", no_rag)
+    monkeypatch.setattr(widget_services, "get_agent_knowledge_bases", knowledge_bases)
+    monkeypatch.setattr(widget_services.AnalyticsService, "record_cancelled_chat", record_cancelled_chat)
+
+    async def run():
+        leader = asyncio.create_task(service.process_public_widget_message(leader_db, 1, "Where is my order?"))
+        await generating.wait()
+        leader.cancel()
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    # The fallback read and the cancellation record ran on sessions the flight opened itself
+    assert len(flight_sessions) == 2
+    assert recorded == [(flight_sessions[1], 1)]
@@ -0,0 +1,131 @@
+import os
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from app.core.vector_maintenance import (
+    claim_maintenance,
+    compact_store,
+    count_vectors_by_knowledge,
+    delete_knowledge_vectors,
+    find_orphans,
+    index_write,
+    load_state,
+    rebuild_collection,
+    release_maintenance,
+    swap_window
+)
+
+
+def make_store(path):
+    store = Chroma(persist_directory=str(path), embedding_function=DeterministicFakeEmbedding(size=16))
+    for knowledge_id in (1, 2, 3):
+        store.add_texts(
+            [f"knowledge {knowledge_id} chunk {i}" for i in range(10)],
+            metadatas=[{"knowledge_id": knowledge_id, "chunk_index": i} for i in range(10)]
+        )
+    store.add_texts(["legacy chunk without metadata"])
+    return store
+
+
+def test_delete_removes_only_that_knowledge(tmp_path):
+    store = make_store(tmp_path)
+    assert delete_knowledge_vectors(store, 2, batch_size=3) == 10
+    counts = count_vectors_by_knowledge(store, page_size=7)
+    assert counts == {1: 10, 3: 10, None: 1}
+
+
+def test_orphans_are_reported_and_compacted(tmp_path):
+    store = make_store(tmp_path)
+    report = find_orphans(store, live_ids={1})
+    assert report["orphaned_vectors"] == 20
+    assert report["orphaned_knowledge_ids"] == [2, 3]
+    assert report["untracked_vectors"] == 1
+
+    result = compact_store(store, str(tmp_path), live_ids={1}, dead_ratio=0.2)
+    assert result["purged_vectors"] == 20
+    assert result["rebuilt"]
+    assert load_state(str(tmp_path))["deleted_since_rebuild"] == 0
+
+    # The rebuilt collection keeps live records and still answers queries
+    assert count_vectors_by_knowledge(store) == {1: 10, None: 1}
+    hits = store.similarity_search("knowledge 1 chunk 4", k=1)
+    assert hits[0].metadata["knowledge_id"] == 1
+
+
+def test_only_one_worker_claims_maintenance_until_the_lock_goes_stale(tmp_path, monkeypatch):
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "CHROMA_DIR", str(tmp_path))
+    assert claim_maintenance(7)
+    assert not claim_maintenance(7)
+    lock_path = tmp_path / "7" / "maintenance.lock"
+    os.utime(lock_path, (0, 0))
+    # The holder stopped touching the lock, so it died mid-compaction
+    assert claim_maintenance(7)
+    release_maintenance(7)
+    assert not lock_path.exists()
+
+
+def test_knowledge_committed_after_the_snapshot_is_not_purged(tmp_path):
+    store = make_store(tmp_path)
+    # Knowledge 3 was committed after live_ids was read, the re-check finds it
+    result = compact_store(
+        store, str(tmp_path), live_ids={1}, dead_ratio=1.0,
+        confirm_orphans=lambda candidates: [k for k in candidates if k != 3]
+    )
+    assert result["purged_vectors"] == 10
+    assert count_vectors_by_knowledge(store) == {1: 10, 3: 10, None: 1}
+
+
+def test_rebuild_replays_writes_made_during_the_copy(tmp_path):
+    store = make_store(tmp_path)
+    removed = store.get(where={"knowledge_id": 2})["ids"]
+
+    class Window:
+        def __enter__(self):
+            # Writes landing between the copy and the swap
+            store.add_texts(["late chunk"], metadatas=[{"knowledge_id": 4, "chunk_index": 0}])
+            store.delete(ids=removed)
+
+        def __exit__(self, *exc):
+            return False
+
+    rebuild_collection(store, page_size=7, exclusive=Window)
+    assert count_vectors_by_knowledge(store) == {1: 10, 3: 10, 4: 1, None: 1}
+
+
+def test_writers_wait_for_the_swap_and_the_swap_waits_for_writers(tmp_path, monkeypatch):
+    import threading
+    import time
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "CHROMA_DIR", str(tmp_path))
+    events = []
+    release = threading.Event()
+
+    def swap():
+        with swap_window(7):
+            events.append("swap")
+            release.wait(5)
+
+    def write():
+        with index_write(7):
+            events.append("write")
+
+    swapper = threading.Thread(target=swap)
+    with index_write(7):
+        swapper.start()
+        time.sleep(0.2)
+        # The swap cannot start while a write is in flight
+        assert events == []
+    time.sleep(0.2)
+    assert events == ["swap"]
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    time.sleep(0.2)
+    # New writes wait until the swap is done
+    assert events == ["swap"]
+    release.set()
+    swapper.join(timeout=5)
+    writer.join(timeout=5)
+    assert events == ["swap", "write"]
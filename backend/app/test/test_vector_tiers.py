@@ -0,0 +1,117 @@
+import os
+import asyncio
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from app.core import vector_store
+from app.core.config import settings
+from app.core.vector_tiers import VectorTiering
+
+
+def test_tiers_promote_hot_chunks_and_match_chroma(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "CHROMA_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "EMBEDDING_MODEL", "fake-model")
+    embedder = DeterministicFakeEmbedding(size=16)
+    monkeypatch.setattr(vector_store, "_embedding_functions", {"fake-model": embedder})
+    monkeypatch.setattr(settings, "VECTOR_TIERING_ENABLED", True)
+    tiers = VectorTiering(small_index_size=10, hot_size=5, max_index_size=1000, decay=0.5)
+    monkeypatch.setattr(vector_store, "vector_tiers", tiers)
+
+    store = vector_store.get_organization_vector_store(3)
+    store.add_texts(
+        [f"knowledge {i % 4} chunk {i}" for i in range(60)],
+        metadatas=[{"knowledge_id": i % 4, "chunk_index": i} for i in range(60)]
+    )
+    index_dir = vector_store.get_organization_index_dir(3)
+
+    async def search(query, **kwargs):
+        results = await vector_store.search_with_relevance_scores(store, query, k=5, organization_id=3, **kwargs)
+        return [(doc.page_content, round(score, 3)) for doc, score in results]
+
+    # Before the first pass Chroma answers and the hits are counted
+    expected = asyncio.run(search("knowledge 1 chunk 9"))
+    for _ in range(3):
+        asyncio.run(search("knowledge 1 chunk 9"))
+    assert tiers.fallbacks == 4
+
+    result = tiers.refresh(3, store._collection, index_dir)
+    assert result["tiered"] and result["hot_vectors"] == 5 and not result["complete"]
+
+    # Hot hits and HNSW hits are merged, each chunk once
+    assert asyncio.run(search("knowledge 1 chunk 9")) == expected
+    assert tiers.served == 1 and tiers.hot_results == 5 and tiers.cold_results == 0
+    # Filters on knowledge_id are answered from the tiers too
+    only_2 = {"knowledge_id": {"$in": [2]}}
+    filtered = asyncio.run(search("knowledge 1 chunk 9", filter=only_2))
+    chroma = asyncio.run(vector_store.search_with_relevance_scores(store, "knowledge 1 chunk 9", k=5, filter=only_2))
+    assert [text for text, _ in filtered] == [doc.page_content for doc, _ in chroma]
+    assert tiers.served == 2
+
+    # A write makes the tiers stale, Chroma answers (and sees the new chunk) until the next pass
+    store.add_texts(["knowledge 1 chunk 9"], metadatas=[{"knowledge_id": 1, "chunk_index": 60}])
+    assert tiers.get(3, index_dir) is None
+    fresh = asyncio.run(search("knowledge 1 chunk 9"))
+    assert [text for text, _ in fresh[:2]] == ["knowledge 1 chunk 9"] * 2
+    assert tiers.fallbacks == 5
+
+    # Without retrievals the hit counts decay away and the organization leaves RAM
+    for _ in range(8):
+        tiers.retrieval_stats.decay(3, 0.5)
+    tiers.refresh(3, store._collection, index_dir)
+    assert 3 not in tiers.indexes
+
+
+def test_small_index_is_answered_from_ram_alone(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "CHROMA_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "EMBEDDING_MODEL", "fake-model")
+    monkeypatch.setattr(settings, "VECTOR_TIERING_ENABLED", True)
+    monkeypatch.setattr(vector_store, "_embedding_functions", {"fake-model": DeterministicFakeEmbedding(size=16)})
+    tiers = VectorTiering(small_index_size=50, hot_size=5, max_index_size=1000, decay=0.5)
+    monkeypatch.setattr(vector_store, "vector_tiers", tiers)
+
+    store = vector_store.get_organization_vector_store(5)
+    store.add_texts([f"chunk {i}" for i in range(30)], metadatas=[{"knowledge_id": i % 3} for i in range(30)])
+    expected = asyncio.run(vector_store.search_with_relevance_scores(store, "chunk 7", k=4))
+    tiers.record(5, [doc.id for doc, _ in expected])
+    result = tiers.refresh(5, store._collection, vector_store.get_organization_index_dir(5))
+    assert result["hot_vectors"] == 30 and result["complete"]
+
+    def no_hnsw(*args, **kwargs):
+        raise AssertionError("HNSW searched")
+    monkeypatch.setattr(vector_store, "_search_hnsw", no_hnsw)
+    tiered = asyncio.run(vector_store.search_with_relevance_scores(store, "chunk 7", k=4, organization_id=5))
+    assert [(doc.page_content, round(score, 3)) for doc, score in tiered] == [
+        (doc.page_content, round(score, 3)) for doc, score in expected
+    ]
+
+
+def test_ram_cap_is_shared_with_other_workers(tmp_path, monkeypatch):
+    import json
+    import time
+
+    monkeypatch.setattr(settings, "CHROMA_DIR", str(tmp_path / "chroma"))
+    monkeypatch.setattr(settings, "EMBEDDING_MODEL", "fake-model")
+    embedder = DeterministicFakeEmbedding(size=16)
+    monkeypatch.setattr(vector_store, "_embedding_functions", {"fake-model": embedder})
+    usage_dir = tmp_path / "usage"
+    usage_dir.mkdir()
+    row_bytes = 16 * 4
+    tiers = VectorTiering(
+        small_index_size=10, hot_size=5, max_index_size=1000, decay=0.5,
+        max_ram_bytes=60 * row_bytes, usage_dir=str(usage_dir)
+    )
+
+    store = vector_store.get_organization_vector_store(4)
+    store.add_texts([f"chunk {i}" for i in range(30)], metadatas=[{"knowledge_id": 1} for _ in range(30)])
+    index_dir = vector_store.get_organization_index_dir(4)
+    tiers.record(4, store._collection.get(limit=10)["ids"])
+    # Another worker on the node (the parent process stands in for it) holds most of the cap
+    (usage_dir / f"{os.getppid()}.json").write_text(json.dumps({"ram_bytes": 57 * row_bytes, "updated_at": time.time()}))
+
+    result = tiers.refresh(4, store._collection, index_dir)
+    assert result["hot_vectors"] == 3 and not result["complete"]
+    assert json.loads((usage_dir / f"{os.getpid()}.json").read_text())["ram_bytes"] == 3 * row_bytes
+    # The node lock is a plain file, released once the reservation is made
+    assert not (usage_dir / ".lock").exists()
+
+    tiers.drop(4)
+    assert json.loads((usage_dir / f"{os.getpid()}.json").read_text())["ram_bytes"] == 0
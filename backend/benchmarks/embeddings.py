@@ -0,0 +1,99 @@
+"""Embedding provider benchmark: bulk throughput (embeddings/sec) and single query latency.
+
+Run from the backend directory:
+
+    python -m benchmarks.embeddings --providers openai local --documents 512 --queries 50
+
+Results are printed as JSON. The query embedding cache is bypassed so every call reaches the provider.
+"""
+import os
+import json
+import time
+import random
+import argparse
+import statistics
+from dotenv import load_dotenv
+
+# Real keys come from .env, placeholders only let settings load for local-only runs
+load_dotenv()
+for key in ("CLERK_JWKS_URL", "CLERK_ISSUER", "CLERK_SECRET_KEY", "CLERK_PUBLISHABLE_KEY", "OPENAI_API_KEY"):
+    os.environ.setdefault(key, "benchmark")
+
+from app.core.embeddings import get_embeddings, resolve_embedding_config
+
+WORDS = (
+    "refund policy order shipping invoice account password reset support agent billing plan "
+    "upgrade cancel subscription delivery tracking warranty return product price discount"
+).split()
+
+
+def make_texts(count: int, words: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(words)) for _ in range(count)]
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def benchmark_provider(provider: str, model: str, documents: list, queries: list, batch_size: int) -> dict:
+    load_started = time.perf_counter()
+    embeddings = get_embeddings(provider, model)
+    embeddings.embed_query("warm up")
+    load_seconds = time.perf_counter() - load_started
+
+    started = time.perf_counter()
+    for start in range(0, len(documents), batch_size):
+        embeddings.embed_documents(documents[start:start + batch_size])
+    bulk_seconds = time.perf_counter() - started
+
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        embeddings.embed_query(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "provider": provider,
+        "model": model,
+        "load_seconds": round(load_seconds, 3),
+        "documents": len(documents),
+        "embeddings_per_second": round(len(documents) / bulk_seconds, 1),
+        "query_latency_ms": {
+            "p50": round(statistics.median(latencies), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "mean": round(statistics.mean(latencies), 2)
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--providers", nargs="+", default=["openai", "local"])
+    parser.add_argument("--model", action="append", default=[], help="provider=model override, repeatable")
+    parser.add_argument("--documents", type=int, default=512)
+    parser.add_argument("--words", type=int, default=150, help="words per document (~ one chunk)")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    overrides = dict(item.split("=", 1) for item in args.model)
+    documents = make_texts(args.documents, args.words)
+    queries = make_texts(args.queries, 12, seed=11)
+
+    results = []
+    for provider in args.providers:
+        config = resolve_embedding_config({"provider": provider, "model": overrides.get(provider)})
+        try:
+            results.append(benchmark_provider(config["provider"], config["model"], documents, queries, args.batch_size))
+        except Exception as e:
+            results.append({"provider": provider, "model": config["model"], "error": str(e)})
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
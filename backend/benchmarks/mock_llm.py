@@ -0,0 +1,248 @@
+"""Deterministic mock of the OpenAI chat completions (streaming too) and embeddings API, for load tests that cost nothing.
+
+Run from the backend directory:
+
+    python -m benchmarks.mock_llm --port 8100 --ttft-ms 400 --tokens-per-second 40 --error-rate 0.01 --rate-limit-rate 0.02
+
+then start the backend with LLM_MOCK_URL=http://127.0.0.1:8100/v1, which points chat completions, OpenAI embeddings
+and through them the vector store at the mock. The same prompt always gets the same answer, latency and faults: every
+random draw is seeded by --seed, the request body and how often that body was seen, so runs are reproducible even
+under concurrency and retries land on a fresh draw. GET /stats reports what was served and injected.
+"""
+import json
+import math
+import time
+import zlib
+import base64
+import random
+import asyncio
+import hashlib
+import argparse
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Dict, List, Union
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "the order ships within two business days and tracking is emailed once it leaves our warehouse "
+    "refunds go back to the original payment method after the return is inspected support can reset "
+    "your password update billing details change the plan or cancel the subscription at any time "
+    "warranty covers defects for one year please include the invoice number when you contact us"
+).split()
+
+
+@dataclass
+class MockConfig:
+    seed: int = 7
+    ttft_ms: float = 300.0  # median time to first token
+    ttft_sigma: float = 0.5  # lognormal shape, 0 makes every request take exactly ttft_ms
+    tokens_per_second: float = 50.0  # 0 sends the whole answer at once
+    completion_tokens: int = 120  # answer length, capped by the request's max_tokens
+    error_rate: float = 0.0  # share of requests answered with a 500
+    rate_limit_rate: float = 0.0  # share of requests answered with a 429
+    retry_after: float = 1.0  # seconds, sent with every 429
+    embedding_ms: float = 20.0
+    embedding_dimensions: int = 1536
+
+
+@dataclass
+class MockStats:
+    chat_requests: int = 0
+    streamed: int = 0
+    embedding_requests: int = 0
+    embedded_texts: int = 0
+    completion_tokens: int = 0
+    errors_injected: int = 0
+    rate_limits_injected: int = 0
+
+
+def count_tokens(text: str) -> int:
+    # Close enough to cl100k for English, and needs no tokenizer download
+    return max(1, math.ceil(len(text) / 4)) if text else 0
+
+
+def prompt_tokens(messages: List[dict]) -> int:
+    return sum(count_tokens(str(message.get("content") or "")) + 4 for message in messages) + 3
+
+
+def error_body(message: str, kind: str, status: int) -> JSONResponse:
+    return JSONResponse({"error": {"message": message, "type": kind, "param": None, "code": None}}, status_code=status)
+
+
+class MockLLM:
+    """Answers, timings and faults of the mock, all derived from the seed and the request"""
+
+    SEEN_LIMIT = 100_000  # request bodies whose repeat count is remembered, a long soak test must not grow without bound
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.stats = MockStats()
+        self._seen: "OrderedDict[str, int]" = OrderedDict()
+
+    def _rng(self, key: str, purpose: str) -> random.Random:
+        """Seeded by the request, so the same request gets the same answer and timing whatever else is in flight"""
+        return random.Random(f"{self.config.seed}:{purpose}:{key}")
+
+    def fault(self, key: str):
+        """429 or 500 for this request, drawn fresh for each repeat of the same body so retries can succeed"""
+        occurrence = self._seen.pop(key, 0)
+        self._seen[key] = occurrence + 1
+        if len(self._seen) > self.SEEN_LIMIT:
+            # Forgetting a body only restarts its fault draws, answers never depend on it
+            self._seen.popitem(last=False)
+        draw = self._rng(f"{key}:{occurrence}", "fault").random()
+        if draw < self.config.rate_limit_rate:
+            self.stats.rate_limits_injected += 1
+            response = error_body("Rate limit reached (injected by the mock)", "rate_limit_error", 429)
+            response.headers["retry-after"] = str(self.config.retry_after)
+            return response
+        if draw < self.config.rate_limit_rate + self.config.error_rate:
+            self.stats.errors_injected += 1
+            return error_body("The server had an error (injected by the mock)", "server_error", 500)
+        return None
+
+    def completion(self, key: str, max_tokens: int) -> List[str]:
+        rng = self._rng(key, "text")
+        length = max(1, min(self.config.completion_tokens, max_tokens))
+        return [(" " if i else "") + rng.choice(WORDS) for i in range(length)]
+
+    def first_token_delay(self, key: str) -> float:
+        median = self.config.ttft_ms / 1000
+        if median <= 0 or self.config.ttft_sigma <= 0:
+            return max(median, 0.0)
+        return self._rng(key, "latency").lognormvariate(math.log(median), self.config.ttft_sigma)
+
+    def token_delay(self) -> float:
+        return 1 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0.0
+
+    def embed(self, text: Union[str, List[int]], dimensions: int) -> np.ndarray:
+        """Bag of words with a fixed random direction per token, so texts sharing words land close together"""
+        tokens = text if isinstance(text, list) else text.lower().split()
+        vector = np.zeros(dimensions, dtype=np.float32)
+        for token in tokens:
+            # Drawn again for every use instead of cached, any vocabulary (or token ids) fits in constant memory.
+            # Always the full-size draw, so a shortened embedding is a prefix of the full one like OpenAI's
+            vector += np.random.default_rng(
+                [self.config.seed, zlib.crc32(str(token).encode())]
+            ).standard_normal(max(dimensions, self.config.embedding_dimensions))[:dimensions].astype(np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+def request_key(body: dict) -> str:
+    return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def create_app(config: MockConfig = None) -> FastAPI:
+    mock = MockLLM(config or MockConfig())
+    app = FastAPI(title="Mock LLM")
+    app.state.mock = mock
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        mock.stats.chat_requests += 1
+        # Sampling settings and stream flags don't change the answer, only the conversation does
+        key = request_key({"model": body.get("model"), "messages": body.get("messages", [])})
+        fault = mock.fault(request_key(body))
+        if fault is not None:
+            return fault
+
+        model = body.get("model", "mock")
+        words = mock.completion(key, body.get("max_tokens") or mock.config.completion_tokens)
+        usage = {
+            "prompt_tokens": prompt_tokens(body.get("messages", [])),
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens(body.get("messages", [])) + len(words),
+        }
+        mock.stats.completion_tokens += len(words)
+        completion_id = f"chatcmpl-mock-{key[:12]}"
+        delay = mock.first_token_delay(key)
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay + len(words) * mock.token_delay())
+            return {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "".join(words)}}],
+                "usage": usage,
+            }
+
+        mock.stats.streamed += 1
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        async def events() -> AsyncIterator[str]:
+            def chunk(delta: dict, finish_reason=None, choices=True, **extra) -> str:
+                payload = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if choices else [],
+                    **extra,
+                }
+                return f"data: {json.dumps(payload)}\n\n"
+
+            await asyncio.sleep(delay)
+            yield chunk({"role": "assistant", "content": ""})
+            for i, word in enumerate(words):
+                if i:
+                    await asyncio.sleep(mock.token_delay())
+                yield chunk({"content": word})
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                yield chunk({}, choices=False, usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        fault = mock.fault(request_key(body))
+        mock.stats.embedding_requests += 1
+        if fault is not None:
+            return fault
+
+        inputs = body.get("input", [])
+        # A single string, a list of strings, or token ids (one list, or a list of lists)
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dimensions = body.get("dimensions") or mock.config.embedding_dimensions
+        mock.stats.embedded_texts += len(inputs)
+        await asyncio.sleep(mock.config.embedding_ms / 1000)
+
+        data = []
+        for index, text in enumerate(inputs):
+            vector = mock.embed(text, dimensions)
+            embedding = base64.b64encode(vector.tobytes()).decode() if body.get("encoding_format") == "base64" else vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(len(text) if isinstance(text, list) else count_tokens(text) for text in inputs)
+        return {
+            "object": "list", "data": data, "model": body.get("model", "mock-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "created": 0, "owned_by": "mock"}]}
+
+    @app.get("/stats")
+    async def stats() -> Dict[str, Any]:
+        return {"config": asdict(mock.config), **asdict(mock.stats)}
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    defaults = MockConfig()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = vars(parser.parse_args())
+    host, port = args.pop("host"), args.pop("port")
+    uvicorn.run(create_app(MockConfig(**args)), host=host, port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
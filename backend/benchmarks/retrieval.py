@@ -0,0 +1,345 @@
+"""Retrieval benchmark: ingestion throughput, search latency, memory and recall@k per vector backend.
+
+Run from the backend directory:
+
+    python -m benchmarks.retrieval --chunks 10000 --queries 200
+    python -m benchmarks.retrieval --chunks 1000000 --backends chroma sharded --shards 8 --output results.json
+
+Everything runs against a throwaway CHROMA_DIR and sqlite database with a deterministic hashing embedding
+provider ("fake"), so results only move when the code does. Chunks are ingested through the real
+process_file (default) or process_text code paths. Results are printed as JSON and optionally written to --output.
+The throwaway directory is deleted when the run ends, --keep leaves it in place for inspection.
+"""
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import asyncio
+import argparse
+import shutil
+import resource
+import tempfile
+import statistics
+import subprocess
+from typing import Dict, List, Optional
+
+WORKDIR = tempfile.mkdtemp(prefix="retrieval-benchmark-")
+# Never touch real indexes, databases or the shared query cache
+os.environ.update({
+    "CHROMA_DIR": os.path.join(WORKDIR, "chroma"),
+    "KNOWLEDGE_BASE_DIR": os.path.join(WORKDIR, "knowledge"),
+    "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(WORKDIR, 'benchmark.db')}",
+    "EMBEDDING_PROVIDER": "fake",
+    "EMBEDDING_CACHE_SHARED": "false",
+    "REINDEX_ON_STARTUP": "false",
+    # Opt-in in the app, only the "tiered" backend passes an organization id and uses it
+    "VECTOR_TIERING_ENABLED": "true",
+})
+for key in ("CLERK_JWKS_URL", "CLERK_ISSUER", "CLERK_SECRET_KEY", "CLERK_PUBLISHABLE_KEY", "OPENAI_API_KEY"):
+    os.environ.setdefault(key, "benchmark")
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from app.core.config import settings
+from app.core.embeddings import register_embedding_provider
+
+ORGANIZATION_ID = 1
+BACKENDS = ("chroma", "sharded", "tiered")
+MODES = ("dense", "filtered")
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic bag-of-words embeddings: every token maps to a fixed random direction seeded by its crc32"""
+
+    def __init__(self, size: int = 256):
+        self.size = size
+        self.model = f"hash-{size}"
+        self._tokens: Dict[str, np.ndarray] = {}
+
+    def _token(self, token: str) -> np.ndarray:
+        vector = self._tokens.get(token)
+        if vector is None:
+            vector = np.random.default_rng(zlib.crc32(token.encode())).standard_normal(self.size).astype(np.float32)
+            self._tokens[token] = vector
+        return vector
+
+    def _embed(self, text: str) -> List[float]:
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        vector = np.sum([self._token(token) for token in tokens], axis=0) if tokens else np.zeros(self.size, np.float32)
+        return (vector / max(float(np.linalg.norm(vector)), 1e-12)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class SyntheticCorpus:
+    """Topic-clustered text with Zipf word frequencies, so near neighbours exist and recall means something"""
+
+    def __init__(self, seed: int = 7, vocabulary: int = 5000, topics: int = 200):
+        self.rng = random.Random(seed)
+        syllables = ["ka", "lo", "mi", "ren", "sa", "tu", "vi", "zor", "pel", "qua", "dan", "ix", "mo", "ret", "ul"]
+        words = set()
+        while len(words) < vocabulary:
+            words.add("".join(self.rng.choice(syllables) for _ in range(self.rng.randint(2, 4))))
+        self.words = sorted(words)
+        self.topics = [self.rng.sample(self.words, 60) for _ in range(topics)]
+        weights = [1 / (rank + 1) for rank in range(60)]
+        self.topic_weights = weights
+
+    def chunk(self, words: int = 120) -> str:
+        topic = self.rng.choice(self.topics)
+        # Mostly topic words, some background noise
+        return " ".join(
+            self.rng.choices(topic, weights=self.topic_weights)[0] if self.rng.random() < 0.8 else self.rng.choice(self.words)
+            for _ in range(words)
+        )
+
+    def query_from(self, chunk: str, words: int = 10) -> str:
+        tokens = chunk.split()
+        return " ".join(self.rng.sample(tokens, min(words, len(tokens))))
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ingest_files(corpus: SyntheticCorpus, chunks: int, chunks_per_file: int) -> dict:
+    from app.services.knowledge_services import process_file
+
+    directory = os.path.join(WORKDIR, "files")
+    os.makedirs(directory, exist_ok=True)
+    stored, files, seconds = 0, 0, 0.0
+    while stored < chunks:
+        path = os.path.join(directory, f"document-{files}.txt")
+        # Paragraphs of ~800 characters, the 1000 character splitter keeps each one a chunk
+        with open(path, "w") as f:
+            f.write("\n\n".join(corpus.chunk() for _ in range(min(chunks_per_file, chunks - stored))))
+        started = time.perf_counter()
+        stored += process_file(path, "text/plain", ORGANIZATION_ID, files + 1)
+        seconds += time.perf_counter() - started
+        files += 1
+    return {"path": "process_file", "documents": files, "chunks": stored, "seconds": round(seconds, 2)}
+
+
+async def ingest_texts(corpus: SyntheticCorpus, chunks: int, chunks_per_text: int) -> dict:
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.db.database import Base
+    import app.db.models  # noqa: F401 registers every table
+    from app.models.knowledge_base import TextKnowledgeRequest
+    from app.services.knowledge_services import process_text
+
+    engine = create_async_engine(settings.DATABASE_URL)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+    stored, texts, seconds = 0, 0, 0.0
+    # process_text caps a text at MAX_TEXT_LENGTH characters
+    per_text = max(1, min(chunks_per_text, settings.MAX_TEXT_LENGTH // 1000))
+    async with Session() as db:
+        while stored < chunks:
+            request = TextKnowledgeRequest(
+                name=f"text {texts}",
+                text_content="\n\n".join(corpus.chunk() for _ in range(min(per_text, chunks - stored))),
+                format="text"
+            )
+            started = time.perf_counter()
+            result = await process_text(request, ORGANIZATION_ID, db)
+            seconds += time.perf_counter() - started
+            stored += result["chunk_count"]
+            texts += 1
+    await engine.dispose()
+    return {"path": "process_text", "documents": texts, "chunks": stored, "seconds": round(seconds, 2)}
+
+
+def exact_neighbours(store, queries: List[List[float]], k: int, filters: List[Optional[dict]]) -> List[List[str]]:
+    """Brute force neighbours over every stored vector (Chroma's squared l2), the reference for recall@k"""
+    collection = store._collection
+    ids, vectors, knowledge_ids = [], [], []
+    offset, page_size = 0, 5000
+    while True:
+        page = collection.get(include=["embeddings", "metadatas"], limit=page_size, offset=offset)
+        ids.extend(page["ids"])
+        vectors.extend(page["embeddings"])
+        knowledge_ids.extend((metadata or {}).get("knowledge_id") for metadata in page["metadatas"])
+        if len(page["ids"]) < page_size:
+            break
+        offset += page_size
+    ids = np.asarray(ids, dtype=object)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    knowledge_ids = np.asarray([-1 if kid is None else kid for kid in knowledge_ids])
+    squared = np.einsum("ij,ij->i", matrix, matrix)
+
+    neighbours = []
+    for query, filter in zip(queries, filters):
+        q = np.asarray(query, dtype=np.float32)
+        distances = squared - 2 * (matrix @ q) + float(q @ q)
+        if filter:
+            distances = np.where(np.isin(knowledge_ids, filter["knowledge_id"]["$in"]), distances, np.inf)
+        top = np.argpartition(distances, k)[:k]
+        neighbours.append(list(ids[top[np.argsort(distances[top])]]))
+    return neighbours
+
+
+async def run_queries(store, queries: List[str], k: int, filters: List[Optional[dict]], organization_id: Optional[int]) -> dict:
+    from app.core.vector_store import search_with_relevance_scores
+
+    latencies, results = [], []
+    for query, filter in zip(queries, filters):
+        started = time.perf_counter()
+        found = await search_with_relevance_scores(store, query, k=k, filter=filter, organization_id=organization_id)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append([doc.id for doc, _ in found])
+    return {"latencies": latencies, "results": results}
+
+
+def summarize(backend: str, mode: str, k: int, run: dict, truth: List[List[str]]) -> dict:
+    latencies = run["latencies"]
+    recall = [len(set(found) & set(expected)) / max(len(expected), 1) for found, expected in zip(run["results"], truth)]
+    return {
+        "backend": backend,
+        "mode": mode,
+        "k": k,
+        "queries": len(latencies),
+        "latency_ms": {
+            "p50": round(statistics.median(latencies), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "mean": round(statistics.mean(latencies), 3)
+        },
+        "queries_per_second": round(len(latencies) / (sum(latencies) / 1000), 1),
+        f"recall_at_{k}": round(statistics.mean(recall), 4),
+        "rss_bytes": rss_bytes()
+    }
+
+
+async def benchmark(args) -> dict:
+    from app.core import vector_store
+    from app.core.vector_tiers import vector_tiers
+    from app.core.vector_maintenance import reshard_index
+
+    corpus = SyntheticCorpus(seed=args.seed)
+    rss_before = rss_bytes()
+    if args.ingest == "text":
+        ingestion = await ingest_texts(corpus, args.chunks, args.chunks_per_file)
+    else:
+        ingestion = await asyncio.to_thread(ingest_files, corpus, args.chunks, args.chunks_per_file)
+    ingestion["chunks_per_second"] = round(ingestion["chunks"] / max(ingestion["seconds"], 1e-9), 1)
+    ingestion["rss_growth_bytes"] = rss_bytes() - rss_before
+
+    store = vector_store.get_organization_vector_store(ORGANIZATION_ID)
+    # Queries are built from stored chunks so every one has real neighbours
+    sample = store._collection.get(include=["documents", "metadatas"], limit=min(args.queries * 20, store._collection.count()))
+    rows = random.Random(args.seed).sample(range(len(sample["ids"])), min(args.queries, len(sample["ids"])))
+    queries = [corpus.query_from(sample["documents"][i]) for i in rows]
+    knowledge_ids = sorted({(m or {}).get("knowledge_id") for m in sample["metadatas"]} - {None})
+    embedder = vector_store.get_organization_embedding_function(ORGANIZATION_ID)
+    query_vectors = embedder.embed_documents(queries)
+    filters = {
+        "dense": [None] * len(queries),
+        "filtered": [
+            {"knowledge_id": {"$in": random.Random(args.seed + i).sample(knowledge_ids, min(3, len(knowledge_ids)))}}
+            for i in range(len(queries))
+        ]
+    }
+    truth = {mode: exact_neighbours(store, query_vectors, args.k, filters[mode]) for mode in args.modes}
+
+    results = []
+    for backend in args.backends:
+        organization_id = None
+        if backend == "sharded":
+            reshard_index(ORGANIZATION_ID, shards=args.shards, shard_by=args.shard_by)
+        elif backend == "chroma":
+            reshard_index(ORGANIZATION_ID, shards=1)
+        elif backend == "tiered":
+            reshard_index(ORGANIZATION_ID, shards=1)
+            organization_id = ORGANIZATION_ID
+            store = vector_store.get_organization_vector_store(ORGANIZATION_ID)
+            # One warm-up round records the hits the promote pass works from
+            for mode in args.modes:
+                await run_queries(store, queries, args.k, filters[mode], organization_id)
+            vector_tiers.refresh(ORGANIZATION_ID, store._collection, vector_store.get_organization_index_dir(ORGANIZATION_ID))
+        store = vector_store.get_organization_vector_store(ORGANIZATION_ID)
+
+        for mode in args.modes:
+            # Warm the query embedding cache so only the index lookup is timed
+            await run_queries(store, queries[:10], args.k, filters[mode][:10], organization_id)
+            run = await run_queries(store, queries, args.k, filters[mode], organization_id)
+            results.append(summarize(backend, mode, args.k, run, truth[mode]))
+
+    return {
+        "commit": git_commit(),
+        "created_at": time.time(),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "corpus": {"chunks": store._collection.count(), "dimensions": args.dimensions, "queries": len(queries)},
+        "ingestion": ingestion,
+        "results": results,
+        "vector_tiers": vector_tiers.stats() if "tiered" in args.backends else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=10_000, help="corpus size, 10k to 1M")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--ingest", choices=["file", "text"], default="file")
+    parser.add_argument("--chunks-per-file", type=int, default=200)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--shards", type=int, default=max(2, min(os.cpu_count() or 2, 8)))
+    parser.add_argument("--shard-by", choices=["hash", "knowledge_base"], default="hash")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--keep", action="store_true", help=f"keep the indexes and database in {WORKDIR}")
+    args = None
+    try:
+        args = parser.parse_args()
+        register_embedding_provider(
+            "fake",
+            lambda model, dimensions=None: HashEmbeddings(dimensions or args.dimensions),
+            lambda: f"hash-{args.dimensions}"
+        )
+        report = asyncio.run(benchmark(args))
+        output = json.dumps(report, indent=2)
+        print(output)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output)
+    finally:
+        # A 1M chunk run leaves gigabytes behind, only keep them when asked to
+        if args is not None and args.keep:
+            print(f"Benchmark data kept in {WORKDIR}", file=sys.stderr)
+        else:
+            shutil.rmtree(WORKDIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()